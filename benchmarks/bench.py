@@ -0,0 +1,539 @@
+"""
+Parser and pipeline benchmarks for System Doctor.
+
+Runs every parser over the captured-output corpus in benchmarks/corpus and
+over generated outputs of large hosts, then replays the collectors, the
+compaction step and a whole diagnosis against a local mock chat-completions
+server. Results are appended to a history file and compared with the
+previous run on the same machine to catch regressions in parse speed,
+collection wall time and prompt size.
+
+Usage:
+    python3 benchmarks/bench.py              # Full run
+    python3 benchmarks/bench.py --quick      # Shorter timing loops
+    python3 benchmarks/bench.py --check      # Exit with status 1 on a regression
+"""
+import os
+import sys
+import json
+import glob
+import time
+import random
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import contextlib
+import subprocess
+import tracemalloc
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+CORPUS_DIR = os.path.join(BENCH_DIR, "corpus")
+HISTORY_FILE = os.path.join(BENCH_DIR, "history.jsonl")
+
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+import doctor  # noqa: E402
+
+# Timing loop length per benchmark (seconds)
+MIN_TIME = 0.5
+QUICK_MIN_TIME = 0.05
+# Allowed growth before a metric counts as a regression
+TIME_TOLERANCE = 0.25
+SIZE_TOLERANCE = 0.05
+
+# Large hosts generated on the fly: name -> (cpus, disks, partitions per disk, interfaces, processes, cgroups)
+LARGE_HOSTS = {
+    "generated-2048cpu-512disk": (2048, 512, 2, 64, 2000, 500),
+    "generated-256cpu-96disk-10kproc": (256, 96, 4, 16, 10000, 5000),
+}
+LARGE_IOSTAT_DEVICES = 600
+
+# Parse helpers
+def read_text(path):
+    with open(path) as f:
+        return f.read()
+
+def corpus_files(kind):
+    return sorted(glob.glob(os.path.join(CORPUS_DIR, kind, "*.txt")))
+
+def proc_hosts(generated_dir):
+    """Return {name: directory} of every captured and generated /proc corpus host."""
+    hosts = {os.path.basename(path): path for path in sorted(glob.glob(os.path.join(CORPUS_DIR, "proc", "*")))}
+    hosts.update({name: os.path.join(generated_dir, name) for name in LARGE_HOSTS})
+    return hosts
+
+def host_interval(host_dir):
+    try:
+        with open(os.path.join(host_dir, "meta.json")) as f:
+            return json.load(f).get("interval", 1.0)
+    except OSError:
+        return 1.0
+
+# Large host generators
+def write_file(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+def generate_large_host(root, cpus, disks, partitions, interfaces, processes, cgroups, interval=1.0, seed=0):
+    """
+    Write two /proc samples of a large host, `interval` seconds apart, in the
+    same layout as the captured corpus hosts (<root>/0 and <root>/1), with a
+    cgroup v2 tree of `cgroups` containers under <sample>/cgroup.
+    """
+    rng = random.Random(seed)
+    jiffies = int(100 * interval)
+    cpu = [[rng.randrange(10**6, 10**8) for _ in range(10)] for _ in range(cpus)]
+    disk_names = [f"nvme{i // 4}n{i % 4 + 1}" for i in range(disks)]
+    devices = [(name, [rng.randrange(10**5, 10**9) for _ in range(17)]) for name in disk_names]
+    for name in disk_names:
+        devices.extend((f"{name}p{p}", [rng.randrange(10**3, 10**8) for _ in range(17)]) for p in range(1, partitions + 1))
+    devices.extend((f"dm-{i}", [rng.randrange(10**3, 10**8) for _ in range(17)]) for i in range(disks // 4))
+    nics = [(f"eth{i}", [rng.randrange(10**6, 10**12) for _ in range(16)]) for i in range(interfaces)]
+    procs = {pid: [rng.randrange(10**3, 10**6), rng.randrange(10**3, 10**6), rng.randrange(1000, 10**6)]
+             for pid in rng.sample(range(1, 4 * 10**6), processes)}
+    vmstat_keys = ["nr_free_pages", "pgpgin", "pgpgout", "pswpin", "pswpout", "pgfault", "pgmajfault",
+                   "pgscan_kswapd", "pgscan_direct", "allocstall_normal", "allocstall_movable",
+                   "compact_stall", "oom_kill"]
+    vmstat = {key: rng.randrange(0, 10**9) for key in vmstat_keys}
+    # Kubernetes-like tree: kubepods.slice/pod<N>.slice/<container>.scope, ten containers per pod
+    containers = {f"kubepods.slice/pod{i // 10}.slice/ctr{i}.scope": [rng.randrange(10**6, 10**12) for _ in range(9)]
+                  for i in range(cgroups)}
+
+    for sample in (0, 1):
+        base = os.path.join(root, str(sample))
+        if sample:
+            # Advance every counter by a plausible amount for one interval
+            for row in cpu:
+                busy = rng.randrange(0, jiffies)
+                row[0] += busy
+                row[3] += jiffies - busy
+            for _, counters in devices:
+                for i in (0, 2, 3, 4, 6, 7, 9, 10):
+                    counters[i] += rng.randrange(0, 1000)
+            for _, counters in nics:
+                for i in (0, 1, 8, 9):
+                    counters[i] += rng.randrange(0, 10**6)
+            for counters in procs.values():
+                counters[0] += rng.randrange(0, jiffies)
+                counters[2] += rng.randrange(0, 10**6)
+            for key in vmstat:
+                vmstat[key] += rng.randrange(0, 1000)
+            for counters in containers.values():
+                counters[0] += rng.randrange(0, 10**6)
+                counters[1] += rng.randrange(0, 10**5)
+                counters[2] += 10
+                counters[3] += rng.randrange(0, 10)
+                for i in range(5, 9):
+                    counters[i] += rng.randrange(0, 10**6)
+
+        total = [sum(column) for column in zip(*cpu)]
+        write_file(os.path.join(base, "stat"), "".join(
+            [f"cpu  {' '.join(map(str, total))}\n"]
+            + [f"cpu{i} {' '.join(map(str, row))}\n" for i, row in enumerate(cpu)]
+            + ["intr 0\nctxt 123456789\nbtime 1700000000\nprocesses 4000000\n",
+               f"procs_running {rng.randrange(1, cpus)}\nprocs_blocked 3\n"]
+        ))
+        write_file(os.path.join(base, "schedstat"), "".join(
+            ["version 15\ntimestamp 4295000000\n"]
+            + [f"cpu{i} 0 0 {row[0] * 7} {row[3]} {row[0] * 5} {row[0] * 2} {row[0] * 10**7} {row[0] * 2 * 10**6} "
+               f"{row[0] * 3}\n" for i, row in enumerate(cpu)]
+        ))
+        write_file(os.path.join(base, "loadavg"), f"{cpus * 0.8:.2f} {cpus * 0.7:.2f} {cpus * 0.6:.2f} "
+                                                  f"{rng.randrange(1, cpus)}/{processes} 4000000\n")
+        write_file(os.path.join(base, "diskstats"), "".join(
+            f" 259 {i} {name} {' '.join(map(str, counters))}\n" for i, (name, counters) in enumerate(devices)
+        ))
+        write_file(os.path.join(base, "meminfo"), "".join(
+            f"{key}: {value} kB\n" for key, value in (
+                ("MemTotal", 2 * 10**9), ("MemFree", 10**8), ("MemAvailable", 6 * 10**8), ("Buffers", 10**6),
+                ("Cached", 4 * 10**8), ("SwapTotal", 0), ("SwapFree", 0), ("Dirty", 10**4),
+                ("Writeback", 0), ("Shmem", 10**6), ("SReclaimable", 10**7), ("SUnreclaim", 10**6)
+            )
+        ))
+        write_file(os.path.join(base, "vmstat"), "".join(f"{key} {value}\n" for key, value in vmstat.items()))
+        write_file(os.path.join(base, "net", "dev"),
+                   "Inter-|   Receive                                                |  Transmit\n"
+                   " face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop fifo colls carrier compressed\n"
+                   + "".join(f"{name:>6}: {' '.join(map(str, counters))}\n" for name, counters in nics))
+        write_file(os.path.join(base, "net", "sockstat"),
+                   f"sockets: used {processes * 3}\nTCP: inuse {processes} orphan 0 tw 120 alloc {processes} mem 512\n"
+                   "UDP: inuse 12 mem 4\n")
+        write_file(os.path.join(base, "net", "snmp"),
+                   "Tcp: ActiveOpens PassiveOpens InSegs OutSegs RetransSegs\n"
+                   f"Tcp: {1000 + sample * 10} {2000 + sample * 20} {10**9 + sample * 10**5} "
+                   f"{10**9 + sample * 10**5} {10**5 + sample * 30}\n")
+        for pid, (ticks, rss, io_bytes) in procs.items():
+            write_file(os.path.join(base, str(pid), "stat"),
+                       f"{pid} (worker-{pid % 97}) S 1 {pid} {pid} 0 -1 4194560 100 0 0 0 {ticks} {ticks // 4} "
+                       f"0 0 20 0 {pid % 64 + 1} 0 100 {rss * 4096} {rss} 18446744073709551615 0 0 0 0 0 0 0 0 0\n")
+            write_file(os.path.join(base, str(pid), "io"),
+                       f"rchar: {io_bytes}\nwchar: {io_bytes}\nsyscr: 10\nsyscw: 10\n"
+                       f"read_bytes: {io_bytes}\nwrite_bytes: {io_bytes // 2}\ncancelled_write_bytes: 0\n")
+        for path, (usage, throttled, periods, nr_throttled, memory, rbytes, wbytes, some, full) in containers.items():
+            cgroup = os.path.join(base, "cgroup", path)
+            write_file(os.path.join(cgroup, "cpu.stat"),
+                       f"usage_usec {usage}\nuser_usec {usage // 2}\nsystem_usec {usage // 2}\n"
+                       f"nr_periods {periods}\nnr_throttled {nr_throttled}\nthrottled_usec {throttled}\n")
+            write_file(os.path.join(cgroup, "memory.current"), f"{memory}\n")
+            write_file(os.path.join(cgroup, "memory.max"), f"{2 * memory}\n")
+            write_file(os.path.join(cgroup, "memory.events"), "low 0\nhigh 0\nmax 3\noom 0\noom_kill 0\n")
+            write_file(os.path.join(cgroup, "io.stat"),
+                       f"259:0 rbytes={rbytes} wbytes={wbytes} rios={rbytes // 4096} wios={wbytes // 4096} "
+                       "dbytes=0 dios=0\n")
+            for resource in ("cpu", "memory", "io"):
+                write_file(os.path.join(cgroup, f"{resource}.pressure"),
+                           f"some avg10=0.00 avg60=0.00 avg300=0.00 total={some}\n"
+                           f"full avg10=0.00 avg60=0.00 avg300=0.00 total={full}\n")
+    write_file(os.path.join(root, "meta.json"), json.dumps({"distro": "generated", "interval": interval}))
+
+def generate_iostat_output(devices, seed=0):
+    """Generate `iostat -d -x 1 2` output (sysstat 12 columns) for a host with many disks."""
+    rng = random.Random(seed)
+    header = ("Device            r/s     rkB/s   rrqm/s  %rrqm r_await rareq-sz     w/s     wkB/s   wrqm/s  %wrqm "
+              "w_await wareq-sz     d/s     dkB/s   drqm/s  %drqm d_await dareq-sz     f/s f_await  aqu-sz  %util")
+    lines = ["Linux 6.8.0-45-generic (big01) \t10/02/2024 \t_x86_64_\t(2048 CPU)", ""]
+    for _ in range(2):
+        lines.append(header)
+        for i in range(devices):
+            values = " ".join(f"{rng.uniform(0, 1000):8.2f}" for _ in range(22))
+            lines.append(f"nvme{i // 4}n{i % 4 + 1:<8} {values}")
+        lines.append("")
+    return "\n".join(lines)
+
+# Measurement
+def measure(func, arg, min_time):
+    """
+    Time `func(arg)` in a loop lasting at least `min_time`, then trace the
+    allocations of one extra call.
+
+    Returns:
+        dict: seconds per call, peak traced allocation and the result status
+    """
+    result = func(arg)  # Warm-up, and the status to report
+    calls = 0
+    started = time.perf_counter()
+    while True:
+        func(arg)
+        calls += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            break
+
+    tracemalloc.start()
+    try:
+        func(arg)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    status = result.get("status", "success") if isinstance(result, dict) else "success"
+    return {"us_per_call": round(elapsed / calls * 1e6, 2), "alloc_peak_kib": round(peak / 1024, 1), "status": status}
+
+def parser_cases(generated_dir):
+    """Yield (parser, input name, callable, argument, input bytes) for every parser and corpus input."""
+    for path in corpus_files("ss"):
+        yield "parse_ss_s", os.path.basename(path), doctor.parse_ss_s, read_text(path), os.path.getsize(path)
+    iostat_inputs = [(os.path.basename(path), read_text(path)) for path in corpus_files("iostat")]
+    iostat_inputs.append((f"generated-{LARGE_IOSTAT_DEVICES}-devices", generate_iostat_output(LARGE_IOSTAT_DEVICES)))
+    for name, text in iostat_inputs:
+        yield ("parse_iostat_output", name, lambda output: doctor.parse_iostat_output(output, "all"),
+               text, len(text.encode()))
+    for path in corpus_files("hostnamectl"):
+        yield ("parse_text_hostnamectl", os.path.basename(path), doctor.parse_text_hostnamectl,
+               read_text(path), os.path.getsize(path))
+
+    for host, host_dir in proc_hosts(generated_dir).items():
+        sample = os.path.join(host_dir, "0")
+        for reader, filename in ((doctor.read_proc_stat, "stat"), (doctor.read_schedstat, "schedstat"),
+                                 (doctor.read_diskstats, "diskstats"),
+                                 (doctor.read_meminfo, "meminfo"), (doctor.read_vmstat, "vmstat")):
+            path = os.path.join(sample, filename)
+            if os.path.exists(path):
+                yield reader.__name__, host, reader, path, os.path.getsize(path)
+        net_bytes = sum(os.path.getsize(path) for path in glob.glob(os.path.join(sample, "net", "*")))
+        yield "read_network_counters", host, doctor.read_network_counters, sample, net_bytes
+        if os.path.isdir(os.path.join(sample, "cgroup")):
+            yield ("read_cgroup_stats", host, doctor.read_cgroup_stats, os.path.join(sample, "cgroup"),
+                   sum(os.path.getsize(os.path.join(path, name)) for path, dirs, files in os.walk(os.path.join(sample, "cgroup"))
+                       for name in files))
+        if any(name.isdigit() for name in os.listdir(sample)):
+            yield ("read_process_stats", host, lambda proc: doctor.read_process_stats(proc=proc),
+                   sample, sum(os.path.getsize(path) for path in glob.glob(os.path.join(sample, "[0-9]*", "*"))))
+
+def bench_parsers(generated_dir, min_time):
+    print("📏 Parsers")
+    print(f"  {'parser':<24} {'input':<36} {'µs/call':>10} {'MB/s':>8} {'peak KiB':>9}  status")
+    results = {}
+    for parser, name, func, arg, size in parser_cases(generated_dir):
+        stats = measure(func, arg, min_time)
+        stats["input_bytes"] = size
+        results[f"{parser}/{name}"] = stats
+        mb_per_s = size / stats["us_per_call"] if stats["us_per_call"] else 0.0
+        print(f"  {parser:<24} {name:<36} {stats['us_per_call']:>10.1f} {mb_per_s:>8.1f} "
+              f"{stats['alloc_peak_kib']:>9.1f}  {stats['status']}")
+    return results
+
+# Pipeline replay
+def build_snapshot(host_dir):
+    """
+    Build a snapshot, in the format written by --record, from the two /proc
+    samples of a corpus host, so the pipeline can be replayed through doctor.Replay.
+    """
+    interval = host_interval(host_dir)
+    samples = {name: [] for name in doctor.SAMPLERS}
+    for t, sample in ((0.0, "0"), (interval, "1")):
+        base = os.path.join(host_dir, sample)
+        samples["cpu"].append((t, doctor.read_proc_stat(os.path.join(base, "stat"))))
+        samples["loadavg"].append((t, doctor.read_loadavg(os.path.join(base, "loadavg"))))
+        samples["disk"].append((t, doctor.read_diskstats(os.path.join(base, "diskstats"))))
+        samples["processes"].append((t, doctor.read_process_stats(proc=base)))
+        samples["network"].append((t, doctor.read_network_counters(proc=base)))
+        samples["vmstat"].append((t, doctor.read_vmstat(os.path.join(base, "vmstat"))))
+        if os.path.exists(os.path.join(base, "schedstat")):
+            samples["sched"].append((t, doctor.read_schedstat(os.path.join(base, "schedstat"))))
+        if os.path.isdir(os.path.join(base, "cgroup")):
+            samples["cgroups"].append((t, doctor.read_cgroup_stats(os.path.join(base, "cgroup"))))
+
+    results = {
+        "check_hostnamectl_info": {"status": "error", "message": "hostnamectl was not captured for this host"},
+        "check_cpu_info": {"status": "error", "message": "lscpu was not captured for this host"},
+    }
+    if os.path.exists(os.path.join(host_dir, "lscpu.json")):
+        with open(os.path.join(host_dir, "lscpu.json")) as f:
+            results["check_cpu_info"] = {"status": "success", "data": json.load(f)}
+    if os.path.exists(os.path.join(host_dir, "hostnamectl.txt")):
+        results["check_hostnamectl_info"] = doctor.parse_text_hostnamectl(read_text(os.path.join(host_dir, "hostnamectl.txt")))
+
+    tools = []
+    for call in doctor.my_tool_calls:
+        func_name = call["function"]["name"]
+        tools.append({
+            "id": call["id"],
+            "function": func_name,
+            "arguments": doctor.parse_tool_arguments(call),
+            "elapsed_s": 0.0,
+            "result": None if func_name in doctor.WINDOWED_TOOLS else results.get(func_name)
+        })
+    snapshot = {
+        "time": datetime.now().isoformat(),
+        "host": os.path.basename(host_dir),
+        "window": {"duration": interval, "interval": interval, "origin": "corpus", "samples": samples,
+                   # Block topology and process owners were not captured for corpus hosts
+                   "facts": {"meminfo": doctor.read_meminfo(os.path.join(host_dir, "1", "meminfo"))}},
+        "tools": tools
+    }
+    # Round-trip through JSON exactly like a recorded snapshot file
+    return json.loads(json.dumps(snapshot))
+
+class MockChatHandler(BaseHTTPRequestHandler):
+    """
+    A minimal streaming chat-completions endpoint: it asks for one check on
+    the first request and answers with a short report once tool results arrive.
+    """
+    protocol_version = "HTTP/1.1"
+    requests_seen = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        request = json.loads(body)
+        MockChatHandler.requests_seen.append(len(body))
+        has_tool_results = any(message["role"] == "tool" for message in request["messages"])
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send(data):
+            raw = b"data: " + (data if isinstance(data, bytes) else json.dumps(data).encode()) + b"\n\n"
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(raw), raw))
+
+        if has_tool_results:
+            for text in ("# Report\n", "The system ", "is healthy."):
+                send({"choices": [{"delta": {"content": text}}]})
+            send({"choices": [{"delta": {}, "finish_reason": "stop"}],
+                  "usage": {"prompt_tokens": len(body) // doctor.CHARS_PER_TOKEN, "completion_tokens": 8}})
+        else:
+            send({"choices": [{"delta": {"tool_calls": [{"index": 0, "id": "mock-0", "type": "function",
+                                                           "function": {"name": "check_memory_usage", "arguments": "{}"}}]}},
+                              ]})
+            send({"choices": [{"delta": {}, "finish_reason": "tool_calls"}]})
+        send(b"[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+@contextlib.contextmanager
+def mock_chat_server():
+    """Serve MockChatHandler on a free local port and point doctor at it."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockChatHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    api_url = doctor.API_URL
+    doctor.API_URL = f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+    try:
+        yield MockChatHandler
+    finally:
+        doctor.API_URL = api_url
+        server.shutdown()
+        server.server_close()
+
+def bench_pipeline(generated_dir, min_time, end_to_end=True):
+    print("🔁 Pipeline replay")
+    print(f"  {'host':<36} {'collect ms':>10} {'raw tok':>8} {'prompt tok':>10} {'e2e ms':>8}")
+    results = {}
+    server = mock_chat_server() if end_to_end else contextlib.nullcontext()
+    with server as handler, tempfile.TemporaryDirectory() as report_dir:
+        for host, host_dir in proc_hosts(generated_dir).items():
+            snapshot = build_snapshot(host_dir)
+            doctor._replay = doctor.Replay(snapshot)
+            try:
+                stats = {}
+                # Windowed collectors one by one
+                for func_name in doctor.WINDOWED_TOOLS:
+                    stats[f"{func_name}_us"] = measure(lambda _: doctor.FUNCTION_MAP[func_name](), None,
+                                                       min_time)["us_per_call"]
+
+                started = time.perf_counter()
+                collected = doctor.collect_tool_results(doctor._replay.tool_calls(), verbose=False)
+                stats["collect_s"] = round(time.perf_counter() - started, 4)
+                stats["raw_tokens"] = sum(doctor.estimate_tokens(json.dumps(result))
+                                          for call, func_name, arguments, result in collected)
+                stats["prompt_tokens"] = sum(doctor.estimate_tokens(content)
+                                             for content in doctor.compact_tool_results(collected, verbose=False))
+                stats["errors"] = [func_name for call, func_name, arguments, result in collected
+                                   if result.get("status") == "error"]
+
+                if end_to_end:
+                    handler.requests_seen.clear()
+                    cwd = os.getcwd()
+                    os.chdir(report_dir)
+                    try:
+                        started = time.perf_counter()
+                        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                            doctor.analyze_performance()
+                        stats["e2e_s"] = round(time.perf_counter() - started, 4)
+                    finally:
+                        os.chdir(cwd)
+                    stats["e2e_requests"] = len(handler.requests_seen)
+                    stats["e2e_prompt_tokens"] = max(handler.requests_seen, default=0) // doctor.CHARS_PER_TOKEN
+            finally:
+                doctor._replay = None
+
+            results[host] = stats
+            e2e = f"{stats['e2e_s'] * 1000:>8.1f}" if "e2e_s" in stats else f"{'-':>8}"
+            print(f"  {host:<36} {stats['collect_s'] * 1000:>10.1f} {stats['raw_tokens']:>8} "
+                  f"{stats['prompt_tokens']:>10} {e2e}")
+    return results
+
+# Regression tracking
+def flatten(results):
+    """Flatten nested results into {"section/name/metric": value} for the tracked metrics."""
+    flat = {}
+    for section, entries in results.items():
+        for name, stats in entries.items():
+            for metric, value in stats.items():
+                if isinstance(value, (int, float)) and tracked_tolerance(metric) is not None:
+                    flat[f"{section}/{name}/{metric}"] = value
+    return flat
+
+def tracked_tolerance(metric):
+    """Return the allowed relative growth of a metric, or None if it is not tracked."""
+    if metric.endswith(("_us", "_s", "us_per_call")):
+        return TIME_TOLERANCE
+    if metric.endswith(("tokens", "_kib")):
+        return SIZE_TOLERANCE
+    return None
+
+def load_previous_run(history_file, machine):
+    previous = None
+    try:
+        with open(history_file) as f:
+            for line in f:
+                try:
+                    run = json.loads(line)
+                except ValueError:
+                    continue
+                if run.get("machine") == machine:
+                    previous = run
+    except OSError:
+        pass
+    return previous
+
+def find_regressions(previous, current):
+    regressions = []
+    old = flatten(previous["results"])
+    for key, value in flatten(current).items():
+        before = old.get(key)
+        if not before:
+            continue
+        if value > before * (1 + tracked_tolerance(key.rsplit("/", 1)[1])):
+            regressions.append((key, before, value))
+    return regressions
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "-C", BENCH_DIR, "rev-parse", "--short", "HEAD"],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the System Doctor parsers and pipeline.")
+    parser.add_argument("--quick", action="store_true", help="use short timing loops")
+    parser.add_argument("--only", choices=("parsers", "pipeline"), help="run a single benchmark section")
+    parser.add_argument("--no-e2e", action="store_true", help="skip the end-to-end run against the mock server")
+    parser.add_argument("--history", default=HISTORY_FILE, help="file the results are appended to")
+    parser.add_argument("--no-save", action="store_true", help="do not append this run to the history")
+    parser.add_argument("--check", action="store_true", help="exit with status 1 if a metric regressed")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    min_time = QUICK_MIN_TIME if args.quick else MIN_TIME
+    results = {}
+
+    with tempfile.TemporaryDirectory() as generated_dir:
+        print("🏗️ Generating large host corpus...")
+        for seed, (name, shape) in enumerate(LARGE_HOSTS.items()):
+            generate_large_host(os.path.join(generated_dir, name), *shape, seed=seed)
+
+        if args.only in (None, "parsers"):
+            results["parsers"] = bench_parsers(generated_dir, min_time)
+        if args.only in (None, "pipeline"):
+            results["pipeline"] = bench_pipeline(generated_dir, min_time, end_to_end=not args.no_e2e)
+
+    run = {
+        "time": datetime.now().isoformat(),
+        "machine": f"{socket.gethostname()}|{platform.machine()}|{os.cpu_count()}",
+        "python": platform.python_version(),
+        "revision": git_revision(),
+        "results": results
+    }
+
+    regressions = []
+    previous = load_previous_run(args.history, run["machine"])
+    if previous:
+        regressions = find_regressions(previous, results)
+        print(f"📈 Compared with the run of {previous['time']} ({previous.get('revision') or 'unknown revision'})")
+        for key, before, after in regressions:
+            print(f"  ⚠️ {key}: {before} -> {after} (+{(after / before - 1) * 100:.0f}%)")
+        if not regressions:
+            print("  ✅ No regressions")
+
+    if not args.no_save:
+        with open(args.history, "a") as f:
+            f.write(json.dumps(run) + "\n")
+        print(f"📝 Results appended to {args.history}")
+
+    if args.check and regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,37 @@
 
 import os
 import re
+import pwd
 import json
+import ctypes
+import mmap
+import zlib
+import struct
 import time
+import array
+import heapq
+import random
+import shutil
+import signal
+import resource
+import select
+import socket
+import inspect
+import sys
+import argparse
+import operator
+import contextlib
+import functools
+import threading
 import subprocess
+import http.server
+import collections
+import socketserver
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
 
 import requests
+from requests.adapters import HTTPAdapter
 
 # Configuration - Replace with your actual values
 API_URL = "https://api.siliconflow.cn/v1/chat/completions"
@@ -19,6 +44,111 @@ MODEL_NAME = "deepseek-ai/DeepSeek-R1"
 # MODEL_NAME = "Pro/deepseek-ai/DeepSeek-V3"
 # MODEL_NAME = "Pro/deepseek-ai/DeepSeek-R1"
 
+# API client - one pooled keep-alive session, streamed responses
+STREAM_RESPONSES = True
+API_POOL_SIZE = 4
+API_CONNECT_TIMEOUT = 10
+API_TIMEOUT = 600        # Seconds allowed between bytes of a response
+
+# Prompt size - tool results are compacted to fit this budget before the analysis call
+TOKEN_BUDGET = 6000
+CHARS_PER_TOKEN = 4      # Rough estimate used to count tokens without a tokenizer
+
+# Static facts (lscpu, hostnamectl) are cached on disk until reboot, hotplug or TTL expiry
+STATIC_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".cache", "system-doctor", "static_facts.json")
+STATIC_CACHE_TTL = 24 * 3600
+
+# Agent loop - the model may request more checks over several rounds
+MAX_AGENT_ROUNDS = 5
+MAX_AGENT_SECONDS = 900
+# Seconds a tool result stays fresh within a session before it is collected again
+TOOL_RESULT_TTL = {
+    "check_hostnamectl_info": 3600,
+    "check_cpu_info": 3600,
+    "check_cpu_usage": 60,
+    "check_memory_usage": 60,
+    "check_disk_io": 60,
+    "check_network_info": 60,
+    "check_running_processes": 30,
+    "check_scheduler_latency": 30,
+    "check_cgroup_usage": 30,
+    "check_thread_activity": 15,
+    "check_kernel_log": 60,
+}
+DEFAULT_TOOL_RESULT_TTL = 30
+
+# Daemon mode - recent metrics are kept in memory and served to diagnosis runs
+DAEMON_SOCKET = os.path.join(os.path.dirname(STATIC_CACHE_FILE), "daemon.sock")
+DAEMON_HISTORY_SECONDS = 600   # How far back the ring buffers reach
+DAEMON_INTERVAL = 1            # Seconds between reads of the cheap sources
+DAEMON_EDGE_INTERVAL = 15      # Seconds between reads of processes, network and vmstat
+DAEMON_CLIENT_TIMEOUT = 2
+DAEMON_MAX_BYTES = 256 * 1048576   # Memory budget of the whole history, shared equally by the sources
+
+# Metrics exporter (--serve-metrics)
+METRICS_ADDRESS = "127.0.0.1"
+METRICS_PORT = 9477
+METRICS_INTERVAL = 15   # Seconds a collection is served before scrapes trigger a new one
+
+# Kernel log scanner - where the previous scan stopped, and what to read without /dev/kmsg
+KERNEL_LOG_CURSOR_FILE = os.path.join(os.path.dirname(STATIC_CACHE_FILE), "kernel_log_cursor.json")
+KERNEL_LOG_FALLBACK_FILES = ("/var/log/kern.log", "/var/log/dmesg")
+KERNEL_LOG_EXAMPLES = 3           # Most recent messages kept per event class
+KERNEL_LOG_MESSAGE_CHARS = 300
+KERNEL_LOG_BLOCK_BYTES = 1 << 20  # Bytes of a log file classified at once
+KERNEL_LOG_BLOCK_RECORDS = 4096   # /dev/kmsg records classified at once
+KERNEL_LOG_FIRST_RUN_SECONDS = 3600  # Without a cursor, only messages this recent are classified
+
+# Local pre-triage - with TRIAGE_ONLY (--triage-only) a conclusive finding skips the model entirely
+TRIAGE_ONLY = False
+
+# Timing trace written next to every report (performance_report_*.trace.json)
+TRACE_EXPORT = True
+TRACE_SUMMARY = False   # Also append a per-stage timing table to the report
+
+# PSI watch mode (--watch) - stall thresholds as microseconds of stall per PSI_WINDOW_US
+PSI_TRIGGERS = {
+    "cpu": ("some", 300000),
+    "memory": ("some", 150000),
+    "io": ("some", 300000),
+}
+PSI_WINDOW_US = 2000000          # 2 s is the shortest window unprivileged users may register
+PSI_FALLBACK_INTERVAL = 2        # Seconds between avg10 reads when triggers cannot be registered
+WATCH_COOLDOWN = 600             # Seconds before the same resource may trigger another capture
+WATCH_MIN_INTERVAL = 120         # Seconds between any two captures
+WATCH_MAX_CAPTURES_PER_HOUR = 6
+WATCH_MAX_ANALYSES_PER_HOUR = 2  # Large model calls made for captures (--watch --analyze)
+
+# Fleet mode (--emit-snapshot / --fleet)
+FLEET_INGEST_WORKERS = 8
+FLEET_MAX_CONCURRENCY = API_POOL_SIZE   # Analysis requests in flight at once
+FLEET_REQUESTS_PER_MINUTE = 30
+FLEET_HOSTS_PER_REQUEST = 20            # Hosts of one symptom group analyzed in one request
+FLEET_RETRIES = 4
+FLEET_RETRY_BACKOFF = 2                 # Seconds before the first retry, doubled on every attempt
+
+# Snapshot files written by --record
+SNAPSHOT_COMPRESSION = 6
+
+# Low-impact mode (--low-impact) for hosts that are already overloaded
+LOW_IMPACT_NICE = 19
+LOW_IMPACT_MAX_CPU_SECONDS = 10     # CPU time budget of the whole run
+LOW_IMPACT_MAX_RSS_MB = 200
+LOW_IMPACT_MAX_LOAD_PER_CPU = 4.0   # Above this 1-minute load per CPU, expensive collectors are skipped
+LOW_IMPACT_EXPENSIVE_TOOLS = ("check_running_processes", "check_scheduler_latency")  # Both scan every /proc/[pid]
+LOW_IMPACT_MAX_WORKERS = 2
+
+# Tool execution - collectors run concurrently in a bounded worker pool
+PARALLEL_TOOL_CALLS = True
+TOOL_MAX_WORKERS = 8
+TOOL_TIMEOUT = 30    # Seconds allowed for a single tool
+BATCH_TIMEOUT = 60   # Seconds allowed for the whole batch of tool calls
+SUBPROCESS_TIMEOUT = 10   # Seconds allowed for an external command such as lscpu
+
+# Sampling window shared by the time-based collectors (CPU, memory, disk, processes, network)
+SAMPLING_DURATION = 5   # Default window length (seconds)
+SAMPLING_INTERVAL = 1   # Seconds between intermediate counter reads (also the disk sampling rate)
+DISK_INTERVAL_RANGE = (0.1, 5)  # Bounds of an explicit check_disk_io sampling interval (seconds)
 
 # Fix for Function Calling compatibility
 # Suppress hallucinations
@@ -86,6 +216,33 @@ my_tool_calls = [
         "arguments": " {}"
     }
     },
+    {
+    "index": 7,
+    "id": "019754ff2926f98aa40602a84183ee02",
+    "type": "function",
+    "function": {
+        "name": "check_scheduler_latency",
+        "arguments": " {}"
+    }
+    },
+    {
+    "index": 8,
+    "id": "019754ff2a31d7c5e1f08b3e4c6a9d17",
+    "type": "function",
+    "function": {
+        "name": "check_cgroup_usage",
+        "arguments": " {}"
+    }
+    },
+    {
+    "index": 9,
+    "id": "019754ff2b4e8a1f6c3d92b07e5f1a48",
+    "type": "function",
+    "function": {
+        "name": "check_kernel_log",
+        "arguments": " {}"
+    }
+    },
 
 ]
 
@@ -121,7 +278,8 @@ def parse_ss_s(ss_output: str):
                 continue
 
             if line.startswith("Total:"):
-                ss_data["Total"] = int(line.split(':')[1].strip())
+                # iproute2 < 4.x 追加 "(kernel N)"
+                ss_data["Total"] = int(line.split(':')[1].split()[0])
                 continue
 
             if line.startswith("TCP:"):
@@ -132,7 +290,8 @@ def parse_ss_s(ss_output: str):
                     state_pairs = states_str.split(',')
                     for pair in state_pairs:
                         key, value = pair.strip().split()
-                        ss_data["TCP_summary"]["states"][key] = int(value)
+                        # 旧版本的 timewait 写作 "97/0"
+                        ss_data["TCP_summary"]["states"][key] = int(value.split('/')[0])
                 else:
                     ss_data["TCP_summary"]["total"] = int(line.split(':')[1].split('(')[0].strip())
                 continue
@@ -146,7 +305,7 @@ def parse_ss_s(ss_output: str):
                 parts = line.strip().split()
                 if not parts: continue # 再次跳过空行
                 protocol_name = parts[0]
-                values = [int(v) for v in parts[1:]]
+                values = [int(v) if v != "-" else None for v in parts[1:]]
                 ss_data["Transport"][protocol_name] = dict(zip(transport_headers, values))
 
         # 校验是否解析到了关键数据，防止输入为空或完全不相关的内容
@@ -158,49 +317,183 @@ def parse_ss_s(ss_output: str):
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
-def check_network_info():
+# Tracing - per-stage timing spans, exported in the Chrome trace event format
+class Tracer:
     """
-    执行 'ss -s' 命令并调用分析函数。
-    
-    Returns:
-        一个字典，包含从 'ss -s' 命令分析得出的网络信息，或在执行失败时返回错误信息。
+    Record timing spans of one diagnosis run.
+
+    Every stage, tool, subprocess, parse, serialization and HTTP request
+    becomes a complete ("X") event on the thread that ran it, so the export
+    opens in chrome://tracing or ui.perfetto.dev with one track per thread.
     """
-    try:
-        # 定义要执行的命令
-        command = ["ss", "-s"]
-        
-        # 执行命令。
-        # - capture_output=True: 捕获标准输出和标准错误。
-        # - text=True: 将输出解码为文本。
-        # - check=True: 如果命令返回非零退出码（即失败），则引发 CalledProcessError。
-        result = subprocess.run(
-            command, 
-            capture_output=True, 
-            text=True, 
-            check=True
-        )
-        
-        # 将命令的标准输出传递给分析函数
-        return parse_ss_s(result.stdout)
 
-    except FileNotFoundError:
-        # 如果系统中没有'ss'命令，会触发此异常
-        return {
-            "status": "error", 
-            "message": "Command 'ss' not found. Please ensure it is installed and in the system's PATH."
-        }
-    except subprocess.CalledProcessError as e:
-        # 如果 'ss -s' 命令执行失败（例如，权限不足），会触发此异常
-        return {
-            "status": "error", 
-            "message": f"Command 'ss -s' failed with error: {e.stderr.strip()}"
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.events = []
+        self.threads = {}
+        self._lock = threading.Lock()
+
+    def _timestamp(self, t):
+        return round((t - self.origin) * 1e6, 1)
+
+    def add(self, name, category, start, end, **args):
+        """Record a span that ran from `start` to `end` (time.perf_counter values)."""
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": self._timestamp(start),
+            "dur": round((end - start) * 1e6, 1),
+            "pid": os.getpid(),
+            "tid": thread.ident
         }
-    except Exception as e:
-        # 捕获其他任何意外错误
-        return {"status": "error", "message": f"An unexpected error occurred: {str(e)}"}
+        if args:
+            event["args"] = args
+        with self._lock:
+            self.threads[thread.ident] = thread.name
+            self.events.append(event)
+
+    def counter(self, name, **values):
+        """Record the current value of one or more counters, drawn as a graph track."""
+        with self._lock:
+            self.events.append({
+                "name": name,
+                "ph": "C",
+                "ts": self._timestamp(time.perf_counter()),
+                "pid": os.getpid(),
+                "args": values
+            })
+
+    @contextlib.contextmanager
+    def span(self, name, category, **args):
+        """Time the enclosed block. The yielded dict can be updated with more span arguments."""
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            self.add(name, category, start, time.perf_counter(), **args)
+
+    def export(self, path):
+        """Write the trace as Chrome trace event JSON."""
+        with self._lock:
+            events = [
+                {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+                for tid, name in self.threads.items()
+            ] + self.events
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def summary(self):
+        """Return a Markdown table of the total, mean and maximum time per span name."""
+        totals = {}
+        with self._lock:
+            for event in self.events:
+                if event["ph"] == "X":
+                    entry = totals.setdefault((event["cat"], event["name"]), [0, 0.0, 0.0])
+                    entry[0] += 1
+                    entry[1] += event["dur"]
+                    entry[2] = max(entry[2], event["dur"])
+        lines = [
+            "| Stage | Category | Count | Total (ms) | Mean (ms) | Max (ms) |",
+            "|---|---|---:|---:|---:|---:|"
+        ]
+        for (category, name), (count, total, longest) in sorted(totals.items(), key=lambda item: -item[1][1]):
+            lines.append(f"| {name} | {category} | {count} | {total / 1000:.1f} | "
+                         f"{total / count / 1000:.1f} | {longest / 1000:.1f} |")
+        return "\n".join(lines)
+
+_tracer = None  # Tracer of the running diagnosis, if any
+
+def trace_span(name, category="stage", **args):
+    """Time a block under the active tracer; a no-op when nothing is being traced."""
+    if _tracer is None:
+        return contextlib.nullcontext(args)
+    return _tracer.span(name, category, **args)
+
+def trace_add(name, category, start, end, **args):
+    if _tracer is not None:
+        _tracer.add(name, category, start, end, **args)
+
+# Static host facts cache - lscpu and hostnamectl output only changes across boots or hotplug
+_static_cache = None
+_static_cache_lock = threading.Lock()
+
+def read_boot_id():
+    """Read the ID of the current boot."""
+    with open("/proc/sys/kernel/random/boot_id") as f:
+        return f.read().strip()
+
+def hardware_signature():
+    """Fingerprint the online CPUs, installed memory and hostname, to notice hotplug or renames."""
+    try:
+        with open("/sys/devices/system/cpu/online") as f:
+            online = f.read().strip()
+    except OSError:
+        online = str(os.cpu_count())
+    with open("/proc/meminfo") as f:
+        mem_total = f.readline().split()[1]  # MemTotal is always the first line
+    return f"{online}|{mem_total}|{os.uname().nodename}"
+
+def _load_static_cache():
+    global _static_cache
+    if _static_cache is None:
+        try:
+            with open(STATIC_CACHE_FILE) as f:
+                _static_cache = json.load(f)
+        except (OSError, ValueError):
+            _static_cache = {}
+    return _static_cache
+
+def _save_static_cache():
+    try:
+        os.makedirs(os.path.dirname(STATIC_CACHE_FILE), exist_ok=True)
+        tmp_file = f"{STATIC_CACHE_FILE}.{os.getpid()}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(_static_cache, f)
+        os.replace(tmp_file, STATIC_CACHE_FILE)
+    except OSError:
+        pass  # A read-only home directory must not break the diagnosis
+
+def static_fact(func):
+    """
+    Serve a static collector from the on-disk cache.
+
+    A cached result is reused while the boot ID and hardware signature match
+    and it is younger than STATIC_CACHE_TTL. Every result carries a "cache"
+    entry so the model knows whether the data came from the cache.
+    """
+    @functools.wraps(func)
+    def wrapper():
+        key = func.__name__
+        now = time.time()
+        try:
+            boot_id, signature = read_boot_id(), hardware_signature()
+        except OSError:
+            return func()  # No way to validate a cache entry
 
+        with _static_cache_lock:
+            entry = _load_static_cache().get(key)
+        if (entry and entry["boot_id"] == boot_id and entry["signature"] == signature
+                and now - entry["stored_at"] < STATIC_CACHE_TTL):
+            return dict(entry["result"], cache={"hit": True, "age_s": round(now - entry["stored_at"], 1)})
+
+        result = func()
+        # The low-impact /proc fallbacks are not cached, so normal runs still get the full tool output
+        if result.get("status") == "success" and "source" not in result:
+            with _static_cache_lock:
+                _load_static_cache()[key] = {
+                    "boot_id": boot_id,
+                    "signature": signature,
+                    "stored_at": now,
+                    "result": result
+                }
+                _save_static_cache()
+        return dict(result, cache={"hit": False})
+    return wrapper
 
 # Check CPU hardware information
+@static_fact
 def check_cpu_info():
     """
     Executes the lscpu -J command and parses the result into a JSON structure.
@@ -208,17 +501,22 @@ def check_cpu_info():
     Returns:
         dict: Contains the status and the parsed data.
     """
+    if _low_impact is not None:
+        return read_cpu_info_proc()  # Do not fork on an overloaded host
     try:
         # Execute lscpu command
-        result = subprocess.run(
-            ['lscpu', '-J'],
-            capture_output=True,
-            text=True,
-            check=True
-        )
+        with trace_span("spawn lscpu", "subprocess"):
+            result = subprocess.run(
+                ['lscpu', '-J'],
+                capture_output=True,
+                text=True,
+                check=True,
+                timeout=SUBPROCESS_TIMEOUT
+            )
         
         # Parse JSON output
-        lscpu_data = json.loads(result.stdout)
+        with trace_span("parse lscpu", "parse"):
+            lscpu_data = json.loads(result.stdout)
         return {"status": "success", "data": lscpu_data}
     
     except subprocess.CalledProcessError as e:
@@ -230,6 +528,7 @@ def check_cpu_info():
     
 
 # System information
+@static_fact
 def check_hostnamectl_info():
     """
     Executes the hostnamectl command and parses the result into a JSON structure.
@@ -237,17 +536,22 @@ def check_hostnamectl_info():
     Returns:
         dict: Contains the status and the parsed data.
     """
+    if _low_impact is not None:
+        return read_host_info_proc()  # Do not fork on an overloaded host
     try:
         # Execute hostnamectl command
-        result = subprocess.run(
-            ['hostnamectl', '--json=pretty'],
-            capture_output=True,
-            text=True,
-            check=True
-        )
+        with trace_span("spawn hostnamectl", "subprocess"):
+            result = subprocess.run(
+                ['hostnamectl', '--json=pretty'],
+                capture_output=True,
+                text=True,
+                check=True,
+                timeout=SUBPROCESS_TIMEOUT
+            )
         
         # Parse JSON output
-        hostnamectl_data = json.loads(result.stdout)
+        with trace_span("parse hostnamectl", "parse"):
+            hostnamectl_data = json.loads(result.stdout)
         return {"status": "success", "data": hostnamectl_data}
     
     except subprocess.CalledProcessError as e:
@@ -258,22 +562,26 @@ def check_hostnamectl_info():
         # Fallback to text parsing if the system does not support JSON output
         return parse_text_hostnamectl()
 
-def parse_text_hostnamectl():
+def parse_text_hostnamectl(output=None):
     """
     Text parsing method for when hostnamectl does not support JSON output.
+    Parses `output` when given instead of running hostnamectl.
     """
     try:
-        # Execute hostnamectl command
-        result = subprocess.run(
-            ['hostnamectl'],
-            capture_output=True,
-            text=True,
-            check=True
-        )
+        if output is None:
+            # Execute hostnamectl command
+            with trace_span("spawn hostnamectl", "subprocess"):
+                output = subprocess.run(
+                    ['hostnamectl'],
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                    timeout=SUBPROCESS_TIMEOUT
+                ).stdout
         
         # Parse text output
         data = {}
-        for line in result.stdout.splitlines():
+        for line in output.splitlines():
             # Skip empty lines and icon lines
             if not line.strip() or "Icon name" in line or "Chassis" in line and ":" not in line:
                 continue
@@ -300,185 +608,1752 @@ def parse_text_hostnamectl():
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
-# Performance monitoring function implementations
-def check_cpu_usage(duration=5):
-    """Check CPU usage and load."""
-    try:
-        # Use mpstat to collect data
-        result = subprocess.run(
-            ["mpstat", "-P", "ALL", str(duration), "1"],
-            capture_output=True, text=True, timeout=duration+5
-        )
-        # Simplified parsing - more complete parsing is needed in a real application
-        lines = result.stdout.split('\n')
-        cpu_data = {}
-        for line in lines:
-            if line.startswith("Average:") and "all" in line:
-                parts = line.split()
-                cpu_data = {
-                    "user": float(parts[2]),
-                    "system": float(parts[4]),
-                    "idle": float(parts[11]),
-                    "load_1min": os.getloadavg()[0]
-                }
-        return {"status": "success", "data": cpu_data}
-    except Exception as e:
-        return {"status": "error", "message": str(e)}
+# Low-impact mode - for hosts that are already overloaded
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1
+# ioprio_set syscall number per architecture (there is no libc wrapper)
+IOPRIO_SET_SYSCALL = {"x86_64": 251, "aarch64": 30, "i686": 289, "armv7l": 314, "ppc64le": 273, "s390x": 282}
 
-def check_memory_usage():
-    """Check memory usage."""
-    try:
-        result = subprocess.run(
-            ["free", "-m"], capture_output=True, text=True, timeout=5
-        )
-        lines = result.stdout.split('\n')
-        mem_line = lines[1].split()
-        swap_line = lines[2].split()
+class CpuBudgetExceeded(BaseException):
+    """Raised from SIGXCPU when the run has used up LOW_IMPACT_MAX_CPU_SECONDS."""
+
+def lower_own_priority(niceness=LOW_IMPACT_NICE):
+    """
+    Drop this process to the given nice level and to the idle I/O class.
+
+    Both settings are per thread on Linux and are inherited by threads
+    started afterwards, so this has to run before any worker is started.
+    Returns the I/O class that was applied.
+    """
+    os.nice(max(0, niceness - os.nice(0)))
+    number = IOPRIO_SET_SYSCALL.get(os.uname().machine)
+    if number is not None:
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.syscall(number, IOPRIO_WHO_PROCESS, 0, IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT) == 0:
+            return "idle"
+    # Without an explicit class the I/O priority follows the nice level
+    return "best-effort (from nice)"
+
+def read_own_rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * PAGE_SIZE / 1048576
+
+class LowImpactGuard:
+    """
+    Keep the diagnosis itself from adding load to an overloaded host.
+
+    Lowers the CPU and I/O priority, caps the CPU time of the process with
+    RLIMIT_CPU, skips expensive collectors when the load is extreme or the
+    process has exceeded its own CPU or RSS budget, and measures what the
+    run cost so the report can show it did not distort the metrics.
+    """
+
+    def __init__(self, max_cpu_seconds=LOW_IMPACT_MAX_CPU_SECONDS, max_rss_mb=LOW_IMPACT_MAX_RSS_MB,
+                 max_load_per_cpu=LOW_IMPACT_MAX_LOAD_PER_CPU):
+        self.max_cpu_seconds = max_cpu_seconds
+        self.max_rss_mb = max_rss_mb
+        self.max_load_per_cpu = max_load_per_cpu
+        self.io_class = None
+        self.skipped = {}
+        self._start_times = os.times()
+        self._started = time.monotonic()
+
+    def enter(self):
+        """Apply the priorities and the CPU time limit to this process."""
+        self.io_class = lower_own_priority()
+        used = self._cpu_seconds()
+        soft = int(self._start_times.user + self._start_times.system + used) + self.max_cpu_seconds + 1
+        try:
+            resource.setrlimit(resource.RLIMIT_CPU, (soft, soft + 5))  # The kernel kills us 5s after SIGXCPU
+        except ValueError:
+            pass  # A lower hard limit is already in place
+
+        def on_sigxcpu(signum, frame):
+            raise CpuBudgetExceeded(f"CPU budget of {self.max_cpu_seconds}s exceeded")
+        signal.signal(signal.SIGXCPU, on_sigxcpu)
+        return self
+
+    def _cpu_seconds(self):
+        times = os.times()
+        return (times.user - self._start_times.user) + (times.system - self._start_times.system)
+
+    def check(self, func_name):
+        """Return the reason to skip a tool, or None if it may run."""
+        reason = None
+        if self._cpu_seconds() >= self.max_cpu_seconds * 0.8:
+            reason = f"own CPU time is close to the {self.max_cpu_seconds}s budget"
+        elif read_own_rss_mb() >= self.max_rss_mb:
+            reason = f"own RSS is over the {self.max_rss_mb} MB cap"
+        elif func_name in LOW_IMPACT_EXPENSIVE_TOOLS:
+            load_per_cpu = read_loadavg()["load"][0] / (os.cpu_count() or 1)
+            if load_per_cpu >= self.max_load_per_cpu:
+                reason = f"1-minute load is {load_per_cpu:.1f} per CPU"
+        if reason:
+            self.skipped[func_name] = reason
+        return reason
+
+    def overhead(self):
+        """Measure what the diagnosis has cost so far."""
+        times = os.times()
+        wall = time.monotonic() - self._started
+        cpu = self._cpu_seconds()
         return {
-            "status": "success",
-            "data": {
-                "total_mb": int(mem_line[1]),
-                "used_mb": int(mem_line[2]),
-                "free_mb": int(mem_line[3]),
-                "swap_used_mb": int(swap_line[2])
-            }
+            "wall_seconds": round(wall, 1),
+            "cpu_seconds": round(cpu, 2),
+            "cpu_percent_of_one_core": round(100.0 * cpu / wall, 1) if wall else 0.0,
+            "child_cpu_seconds": round(
+                times.children_user + times.children_system
+                - self._start_times.children_user - self._start_times.children_system, 2
+            ),
+            "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "skipped_tools": dict(self.skipped)
         }
-    except Exception as e:
-        return {"status": "error", "message": str(e)}
 
-def check_disk_io(device="all"):
-    """Check disk I/O performance and return structured data."""
+    def describe(self):
+        """Describe the measured overhead as Markdown for the report."""
+        overhead = self.overhead()
+        lines = [
+            f"Low-impact mode: nice {os.nice(0)}, {self.io_class} I/O priority, "
+            f"CPU budget {self.max_cpu_seconds}s, RSS cap {self.max_rss_mb} MB.",
+            "",
+            f"This diagnosis used {overhead['cpu_seconds']}s of CPU "
+            f"({overhead['cpu_percent_of_one_core']}% of one core over {overhead['wall_seconds']}s), "
+            f"{overhead['child_cpu_seconds']}s in child processes and {overhead['max_rss_mb']} MB peak RSS."
+        ]
+        for func_name, reason in overhead["skipped_tools"].items():
+            lines.append(f"- Skipped {func_name}: {reason}")
+        return "\n".join(lines)
+
+_low_impact = None  # LowImpactGuard when running with --low-impact
+
+def read_cpu_info_proc():
+    """
+    Describe the CPUs from /proc/cpuinfo and /sys without forking lscpu.
+
+    The result uses the lscpu -J field layout, so it is compacted and read
+    the same way as the lscpu output.
+    """
+    processors = []
+    with open("/proc/cpuinfo") as f:
+        for block in f.read().strip().split("\n\n"):
+            entry = {}
+            for line in block.splitlines():
+                key, _, value = line.partition(":")
+                entry[key.strip()] = value.strip()
+            processors.append(entry)
+    first = processors[0] if processors else {}
+    sockets = {entry.get("physical id") for entry in processors} - {None}
+    siblings = int(first.get("siblings", 1) or 1)
+    cores = int(first.get("cpu cores", siblings) or siblings)
+
+    fields = [
+        ("Architecture", os.uname().machine),
+        ("CPU(s)", str(len(processors))),
+        ("On-line CPU(s) list", read_small_file("/sys/devices/system/cpu/online").decode().strip()),
+        ("Vendor ID", first.get("vendor_id")),
+        ("Model name", first.get("model name")),
+        ("CPU family", first.get("cpu family")),
+        ("Model", first.get("model")),
+        ("Thread(s) per core", str(siblings // cores)),
+        ("Core(s) per socket", str(cores)),
+        ("Socket(s)", str(len(sockets) or 1)),
+        ("Stepping", first.get("stepping")),
+        ("BogoMIPS", first.get("bogomips")),
+        ("Address sizes", first.get("address sizes")),
+        ("Flags", first.get("flags")),
+    ]
     try:
-        # Increase sampling count for better reliability
-        cmd = ["iostat", "-d", "-x", "-y", "1", "3"]  # Change to 3 samples
-        
-        # Execute command
-        result = subprocess.run(
-            cmd, 
-            capture_output=True, 
-            text=True, 
-            timeout=20  # Increase timeout
-        )
-        
-        # Check if the command executed successfully
-        if result.returncode != 0:
-            error_msg = result.stderr.strip() or "Command failed to execute"
-            return {"status": "error", "message": error_msg}
-            
-        # Parse output
-        return parse_iostat_output(result.stdout, device)
-    except subprocess.TimeoutExpired:
-        return {"status": "error", "message": "Command timed out"}
-    except Exception as e:
-        return {"status": "error", "message": f"Execution error: {str(e)}"}
+        max_khz = read_small_file("/sys/devices/system/cpu/cpu0/cpufreq/cpuinfo_max_freq").decode().strip()
+        fields.append(("CPU max MHz", f"{int(max_khz) / 1000:.4f}"))
+    except OSError:
+        pass
+    try:
+        nodes = sorted(name for name in os.listdir("/sys/devices/system/node") if name[4:].isdigit()
+                       and name.startswith("node"))
+        fields.append(("NUMA node(s)", str(len(nodes))))
+        for node in nodes:
+            cpulist = read_small_file(f"/sys/devices/system/node/{node}/cpulist").decode().strip()
+            fields.append((f"NUMA node{node[4:]} CPU(s)", cpulist))
+    except OSError:
+        pass
+    return {
+        "status": "success",
+        "data": {"lscpu": [{"field": f"{name}:", "data": value} for name, value in fields if value is not None]},
+        "source": "/proc/cpuinfo"
+    }
 
-def parse_iostat_output(output, tarcheck_device):
-    """Parse iostat output - enhanced version."""
-    # Split the output into lines
-    lines = output.strip().split('\n')
-    
-    # If there is no output content
-    if not lines or len(lines) < 3:
-        return {"status": "error", "message": "iostat output is empty or has an abnormal format"}
-    
-    # Find all data blocks
-    data_blocks = []
-    current_block = []
-    in_block = False
-    
-    for line in lines:
-        # Detect header line
-        if line.startswith("Device"):
-            # If already in a data block, end the current one
-            if in_block:
-                data_blocks.append(current_block)
-                current_block = []
-            in_block = True
-            headers = [h.lower() for h in line.split()]
-            current_block.append(headers)
-            continue
-            
-        # If it is a data line
-        if in_block and line.strip():
+def read_host_info_proc():
+    """Describe the host from /etc/os-release, /proc and /sys/class/dmi without forking hostnamectl."""
+    data = {
+        "Hostname": read_small_file("/proc/sys/kernel/hostname").decode().strip(),
+        "KernelName": os.uname().sysname,
+        "KernelRelease": os.uname().release,
+        "KernelVersion": os.uname().version,
+        "Architecture": os.uname().machine,
+    }
+    try:
+        with open("/etc/os-release") as f:
+            release = dict(line.rstrip("\n").split("=", 1) for line in f if "=" in line)
+        data["OperatingSystemPrettyName"] = release.get("PRETTY_NAME", "").strip('"')
+    except OSError:
+        pass
+    for key, name in (("HardwareVendor", "sys_vendor"), ("HardwareModel", "product_name"),
+                      ("FirmwareVersion", "bios_version"), ("FirmwareDate", "bios_date")):
+        try:
+            data[key] = read_small_file(f"/sys/class/dmi/id/{name}").decode().strip()
+        except OSError:
+            pass
+    return {"status": "success", "data": data, "source": "/proc"}
+
+# Shared sampling window - one window serves every time-based collector
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+def read_proc_stat(path="/proc/stat"):
+    """Read the per-CPU jiffy counters, procs_running and procs_blocked from /proc/stat."""
+    counters = {}
+    with open(path) as f:
+        for line in f:
+            if line.startswith("cpu"):
+                parts = line.split()
+                counters[parts[0]] = [int(v) for v in parts[1:]]
+            elif line.startswith("procs_"):
+                key, value = line.split()
+                counters[key] = int(value)
+    return counters
+
+def read_loadavg(path="/proc/loadavg"):
+    """Read load averages and the run-queue size from /proc/loadavg."""
+    with open(path) as f:
+        parts = f.read().split()
+    runnable, total = parts[3].split("/")
+    return {
+        "load": [float(v) for v in parts[:3]],
+        "runnable": int(runnable),
+        "tasks": int(total)
+    }
+
+def read_diskstats(path="/proc/diskstats"):
+    """Read the I/O counters of every block device from /proc/diskstats."""
+    counters = {}
+    with open(path) as f:
+        for line in f:
             parts = line.split()
-            # Ensure there are enough data columns
-            if len(parts) >= len(headers):
-                current_block.append(parts)
-    
-    # Add the last block
-    if in_block and current_block:
-        data_blocks.append(current_block)
-    
-    # If no data blocks were found
-    if not data_blocks:
-        return {"status": "error", "message": "No valid data blocks found"}
-    
-    # Select the most suitable data block (prefer the last one)
-    selected_block = None
-    
-    # Try to use the last data block
-    if data_blocks:
-        selected_block = data_blocks[-1]
-    
-    # If the last block only has a header and no data, try the previous one
-    if selected_block and len(selected_block) == 1:
-        for block in reversed(data_blocks):
-            if len(block) > 1:
-                selected_block = block
-                break
-    
-    # If a valid block is still not found
-    if not selected_block or len(selected_block) < 2:
-        return {"status": "error", "message": "Not enough data rows found"}
-    
-    # Parse the selected data block
-    headers = selected_block[0]
-    data_lines = selected_block[1:]
-    
-    # Parse data
-    devices = []
-    for parts in data_lines:
-        # Device name is the first column
-        device_name = parts[0]
-        
-        # If a specific device is specified, skip others
-        if tarcheck_device != "all" and device_name != tarcheck_device:
-            continue
-            
-        # Create a data dictionary for the device
-        device_data = {"device": device_name}
-        
-        # Parse various metrics
-        for i in range(1, min(len(headers), len(parts))):
-            header = headers[i]
-            value_str = parts[i]
-            
-            # Handle special values
-            if value_str == "0.00" or value_str == "0.0":
-                value = 0.0
-            else:
+            counters[parts[2]] = [int(v) for v in parts[3:]]
+    return counters
+
+def read_small_file(path, size=4096):
+    """Read a small /proc file with raw os calls, avoiding file object overhead on hot paths."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return os.read(fd, size)
+    finally:
+        os.close(fd)
+
+# One process as seen by a single /proc scan (the sched_* fields come from /proc/[pid]/schedstat)
+ProcessSample = collections.namedtuple(
+    "ProcessSample", "comm state ticks rss threads read_bytes write_bytes sched_run_ns sched_wait_ns sched_slices",
+    defaults=(0, 0, 0)  # Snapshots recorded before the scheduler fields existed
+)
+
+def read_process_stats(with_io=True, with_sched=True, proc="/proc"):
+    """
+    Scan /proc/[pid] with scandir and read the stat (and io and schedstat)
+    file of every process. `proc` points the scan at another procfs mount or
+    a captured copy.
+
+    Returns:
+        dict: pid -> ProcessSample
+    """
+    counters = {}
+    with os.scandir(proc) as entries:
+        for entry in entries:
+            pid = entry.name
+            if not pid.isdigit():
+                continue
+            try:
+                data = read_small_file(f"{proc}/{pid}/stat")
+            except OSError:
+                continue  # The process exited while we were scanning
+            # comm may contain spaces and parentheses, so split around the last ')'
+            lpar = data.find(b"(")
+            rpar = data.rfind(b")")
+            fields = data[rpar + 2:].split(None, 22)
+
+            read_bytes = write_bytes = 0
+            if with_io:
+                # Only readable for our own processes unless running as root
                 try:
-                    value = float(value_str)
-                except ValueError:
-                    value = value_str  # Keep the original string
-            
-            device_data[header] = value
-        
-        devices.append(device_data)
-    
-    # If a specific device was specified but not found
-    if tarcheck_device != "all" and not devices:
-        return {
-            "status": "error", 
-            "message": f"Device not found: {tarcheck_device}",
-            "available_devices": [block[0] for block in data_lines]
-        }
-    
-    # Calculate key metrics
-    key_metrics = {
-        "total_iops": 0.0,
-        "total_throughput": 0.0,
-        "max_utilization": 0.0,
+                    io = read_small_file(f"{proc}/{pid}/io").split()
+                    read_bytes, write_bytes = int(io[9]), int(io[11])
+                except (OSError, IndexError, ValueError):
+                    pass
+
+            sched = (0, 0, 0)
+            if with_sched:
+                # Time on the CPU, time waiting on a run queue (ns) and timeslices of the main thread
+                try:
+                    run_ns, wait_ns, slices = read_small_file(f"{proc}/{pid}/schedstat").split()
+                    sched = (int(run_ns), int(wait_ns), int(slices))
+                except (OSError, ValueError):
+                    pass  # Kernel without CONFIG_SCHED_INFO
+
+            counters[int(pid)] = ProcessSample(
+                data[lpar + 1:rpar].decode(errors="replace"),
+                fields[0].decode(),
+                int(fields[11]) + int(fields[12]),
+                int(fields[21]),
+                int(fields[17]),
+                read_bytes,
+                write_bytes,
+                *sched
+            )
+    return counters
+
+def read_schedstat(path="/proc/schedstat"):
+    """
+    Read the per-CPU scheduler counters from /proc/schedstat.
+
+    Returns:
+        dict: cpu name -> [time running (ns), time tasks waited on its run queue (ns), timeslices]
+    """
+    counters = {}
+    with open(path) as f:
+        for line in f:
+            if line.startswith("cpu"):
+                parts = line.split()
+                # yld_count, legacy, sched_count, sched_goidle, ttwu_count, ttwu_local, then the three used here
+                counters[parts[0]] = [int(v) for v in parts[7:10]]
+    return counters
+
+def read_meminfo(path="/proc/meminfo"):
+    """Read /proc/meminfo into a dictionary of kB values."""
+    meminfo = {}
+    with open(path) as f:
+        for line in f:
+            key, value = line.split(":", 1)
+            meminfo[key] = int(value.split()[0])
+    return meminfo
+
+def read_vmstat(path="/proc/vmstat"):
+    """Read the virtual memory event counters from /proc/vmstat."""
+    counters = {}
+    with open(path) as f:
+        for line in f:
+            key, value = line.split()
+            counters[key] = int(value)
+    return counters
+
+# Columns of /proc/net/dev, receive side first then transmit side
+NET_DEV_COLUMNS = (
+    "rx_bytes", "rx_packets", "rx_errors", "rx_drops", "rx_fifo", "rx_frame", "rx_compressed", "rx_multicast",
+    "tx_bytes", "tx_packets", "tx_errors", "tx_drops", "tx_fifo", "tx_colls", "tx_carrier", "tx_compressed",
+)
+# Protocol counters reported as per-second rates: (table, counter)
+NET_PROTOCOL_COUNTERS = (
+    ("Ip", "InReceives"), ("Ip", "InDiscards"), ("Ip", "OutDiscards"),
+    ("Tcp", "ActiveOpens"), ("Tcp", "PassiveOpens"), ("Tcp", "AttemptFails"), ("Tcp", "EstabResets"),
+    ("Tcp", "InSegs"), ("Tcp", "OutSegs"), ("Tcp", "RetransSegs"), ("Tcp", "InErrs"), ("Tcp", "OutRsts"),
+    ("Udp", "InDatagrams"), ("Udp", "OutDatagrams"), ("Udp", "NoPorts"), ("Udp", "InErrors"),
+    ("Udp", "RcvbufErrors"), ("Udp", "SndbufErrors"),
+    ("TcpExt", "ListenOverflows"), ("TcpExt", "ListenDrops"), ("TcpExt", "TCPTimeouts"),
+    ("TcpExt", "TCPSynRetrans"), ("TcpExt", "TCPBacklogDrop"), ("TcpExt", "TCPReqQFullDrop"),
+    ("TcpExt", "TCPAbortOnMemory"), ("TcpExt", "PruneCalled"),
+)
+
+def parse_proc_net_table(text):
+    """Parse the header/value line pairs of /proc/net/snmp and /proc/net/netstat."""
+    tables = {}
+    lines = text.splitlines()
+    for header, values in zip(lines[::2], lines[1::2]):
+        name, _, keys = header.partition(":")
+        tables[name] = dict(zip(keys.split(), (int(v) for v in values.split()[1:])))
+    return tables
+
+def read_network_counters(proc="/proc"):
+    """Read socket usage, per-interface and per-protocol counters from /proc/net."""
+    sockets = {}
+    with open(f"{proc}/net/sockstat") as f:
+        for line in f:
+            name, _, values = line.partition(":")
+            parts = values.split()
+            sockets[name] = dict(zip(parts[::2], (int(v) for v in parts[1::2])))
+
+    interfaces = {}
+    with open(f"{proc}/net/dev") as f:
+        for line in f.readlines()[2:]:
+            name, _, values = line.partition(":")
+            interfaces[name.strip()] = [int(v) for v in values.split()]
+
+    protocols = {}
+    for path in (f"{proc}/net/snmp", f"{proc}/net/netstat"):
+        try:
+            with open(path) as f:
+                protocols.update(parse_proc_net_table(f.read()))
+        except OSError:
+            pass  # netstat is missing on some minimal kernels
+
+    return {"sockets": sockets, "interfaces": interfaces, "protocols": protocols}
+
+# cgroup v2 counters of one cgroup (usec, bytes and event counts; 0 when a controller is not enabled there)
+CgroupSample = collections.namedtuple(
+    "CgroupSample",
+    "cpu_usec throttled_usec nr_periods nr_throttled memory_current memory_max memory_high_events "
+    "memory_max_events oom_kills io_rbytes io_wbytes io_rios io_wios "
+    "cpu_some_usec memory_some_usec memory_full_usec io_some_usec io_full_usec leaf"
+)
+# The unified hierarchy, or where hybrid hosts mount it next to the v1 controllers
+CGROUP_ROOTS = ("/sys/fs/cgroup", "/sys/fs/cgroup/unified")
+
+def find_cgroup_root():
+    """Return the mount point of the cgroup v2 hierarchy, or None on cgroup v1 only hosts."""
+    for root in CGROUP_ROOTS:
+        if os.path.exists(os.path.join(root, "cgroup.controllers")):
+            return root
+    return None
+
+def read_cgroup_keyed(path, size=4096):
+    """Read a flat keyed cgroup file ("key value" lines) into {key: int}; {} when it does not exist."""
+    try:
+        parts = read_small_file(path, size).split()
+    except OSError:
+        return {}
+    return dict(zip(parts[::2], map(int, parts[1::2])))
+
+def read_cgroup_pressure(path):
+    """Return the cumulative (some, full) stall time in usec from a cgroup pressure file."""
+    try:
+        lines = read_small_file(path).splitlines()
+    except OSError:
+        return 0, 0
+    totals = [int(line.rsplit(b"=", 1)[1]) for line in lines]
+    return totals[0], totals[1] if len(totals) > 1 else 0
+
+def read_cgroup_stats(root=None):
+    """
+    Walk the cgroup v2 hierarchy once with scandir and read the CPU, memory,
+    I/O and pressure counters of every cgroup below the root, without
+    forking. `root` points the walk at another mount or a captured copy.
+
+    Returns:
+        dict: cgroup path relative to the root ("/system.slice/...") -> CgroupSample
+    """
+    root = root or find_cgroup_root()
+    counters = {}
+    if root is None:
+        return counters
+    pending = [(root, "")]
+    while pending:
+        path, name = pending.pop()
+        try:
+            with os.scandir(path) as entries:
+                children = [(entry.path, f"{name}/{entry.name}") for entry in entries
+                            if entry.is_dir(follow_symlinks=False)]
+        except OSError:
+            continue  # The cgroup was removed while we were walking
+        pending.extend(children)
+        if not name:
+            continue  # The root holds the system-wide totals the other collectors already report
+
+        cpu = read_cgroup_keyed(f"{path}/cpu.stat")
+        events = read_cgroup_keyed(f"{path}/memory.events")
+        io_rbytes = io_wbytes = io_rios = io_wios = 0
+        try:
+            # One line per device: "MAJ:MIN rbytes=N wbytes=N rios=N wios=N ..."
+            for line in read_small_file(f"{path}/io.stat", 65536).splitlines():
+                fields = dict(field.split(b"=") for field in line.split()[1:])
+                io_rbytes += int(fields.get(b"rbytes", 0))
+                io_wbytes += int(fields.get(b"wbytes", 0))
+                io_rios += int(fields.get(b"rios", 0))
+                io_wios += int(fields.get(b"wios", 0))
+        except (OSError, ValueError):
+            pass
+        try:
+            memory_current = int(read_small_file(f"{path}/memory.current"))
+        except (OSError, ValueError):
+            memory_current = 0
+        try:
+            memory_max = int(read_small_file(f"{path}/memory.max"))
+        except (OSError, ValueError):
+            memory_max = 0  # "max" means no limit
+        cpu_some, _ = read_cgroup_pressure(f"{path}/cpu.pressure")
+        memory_some, memory_full = read_cgroup_pressure(f"{path}/memory.pressure")
+        io_some, io_full = read_cgroup_pressure(f"{path}/io.pressure")
+
+        counters[name] = CgroupSample(
+            cpu.get(b"usage_usec", 0), cpu.get(b"throttled_usec", 0),
+            cpu.get(b"nr_periods", 0), cpu.get(b"nr_throttled", 0),
+            memory_current, memory_max,
+            events.get(b"high", 0), events.get(b"max", 0), events.get(b"oom_kill", 0),
+            io_rbytes, io_wbytes, io_rios, io_wios,
+            cpu_some, memory_some, memory_full, io_some, io_full,
+            not children
+        )
+    return counters
+
+def own_running_threads():
+    """Count the threads of this process that are running or runnable, the calling one included."""
+    running = 0
+    for tid in os.listdir("/proc/self/task"):
+        try:
+            with open(f"/proc/self/task/{tid}/stat", "rb") as f:
+                if f.read().rpartition(b")")[2].split(None, 1)[0] == b"R":
+                    running += 1
+        except (OSError, IndexError):
+            pass  # Thread exited
+    return running
+
+# The live run-queue counts include our own sampling and collector threads, which
+# alone can make an idle 1-CPU host look saturated, so samples note them to be discounted
+def sample_proc_stat():
+    """Read /proc/stat, with how many of procs_running are our own threads."""
+    counters = read_proc_stat()
+    counters["procs_running_own"] = own_running_threads()
+    return counters
+
+def sample_loadavg():
+    """Read /proc/loadavg, with how many of the runnable tasks are our own threads."""
+    loadavg = read_loadavg()
+    loadavg["runnable_own"] = own_running_threads()
+    return loadavg
+
+# Counter sources: name -> (reader, read at every intermediate tick)
+SAMPLERS = {
+    "cpu": (sample_proc_stat, True),
+    "loadavg": (sample_loadavg, True),
+    "disk": (read_diskstats, True),
+    "processes": (read_process_stats, False),  # Only read at the window edges
+    "network": (read_network_counters, False),
+    "vmstat": (read_vmstat, False),
+    "sched": (read_schedstat, True),
+    "cgroups": (read_cgroup_stats, False),
+}
+
+# Tools that are served from the sampling window, and the sources they need
+WINDOWED_TOOLS = {
+    "check_cpu_usage": ("cpu", "loadavg"),
+    "check_disk_io": ("disk",),
+    "check_running_processes": ("processes",),
+    "check_network_info": ("network",),
+    "check_memory_usage": ("vmstat",),
+    "check_scheduler_latency": ("cpu", "sched", "processes"),
+    "check_cgroup_usage": ("cgroups",),
+}
+
+class SamplingWindow:
+    """
+    A single sampling window shared by every time-based collector.
+
+    Every source is read at the start and at the end of the window, and the
+    cheap ones at every `interval` in between, so the CPU, disk and process
+    numbers describe the same moment and can be correlated with each other.
+    """
+
+    def __init__(self, duration=SAMPLING_DURATION, interval=SAMPLING_INTERVAL, sources=None):
+        self.duration = duration
+        self.interval = interval
+        self.sources = tuple(sources or SAMPLERS)
+        self.samples = {name: [] for name in self.sources}
+        self.errors = {}
+        self.facts = {}
+        self.origin = "live"
+        self._done = threading.Event()
+        self._facts_lock = threading.Lock()
+
+    def _read(self, edge):
+        for name in self.sources:
+            reader, every_tick = SAMPLERS[name]
+            if not (edge or every_tick):
+                continue
+            try:
+                with trace_span(f"read {name}", "sample"):
+                    self.samples[name].append((time.monotonic(), reader()))
+            except Exception as e:
+                self.errors[name] = str(e)
+
+    def run(self):
+        """Sample the window in the calling thread and return it."""
+        started = time.perf_counter()
+        try:
+            start = time.monotonic()
+            end = start + self.duration
+            self._read(edge=True)
+            next_tick = start + self.interval
+            while next_tick < end:
+                time.sleep(max(0, next_tick - time.monotonic()))
+                self._read(edge=False)
+                next_tick += self.interval
+            time.sleep(max(0, end - time.monotonic()))
+            self._read(edge=True)
+        finally:
+            self._done.set()
+            trace_add("sampling window", "window", started, time.perf_counter(),
+                      duration=self.duration, sources=list(self.sources))
+        return self
+
+    def start(self):
+        """Sample the window in a background thread."""
+        threading.Thread(target=self.run, name="sampling-window", daemon=True).start()
+        return self
+
+    def wait(self, timeout=None):
+        """Block until the window has closed."""
+        self._done.wait(timeout)
+        return self
+
+    def span(self, name):
+        """Return (elapsed seconds, first sample, last sample) of a source."""
+        samples = self.samples.get(name, [])
+        if len(samples) < 2:
+            raise RuntimeError(self.errors.get(name, f"No samples collected for '{name}'"))
+        (t0, first), (t1, last) = samples[0], samples[-1]
+        return t1 - t0, first, last
+
+    def fact(self, key, reader, *args, missing=None):
+        """
+        Return a piece of host state a collector reads next to the samples
+        (meminfo, block topology, process owners), reading it at most once
+        per window. Facts are recorded with the window, so a replay serves
+        them without touching the live system; one that was not recorded
+        gives `missing`, or an error if there is no default.
+        """
+        if args:
+            key = ":".join(map(str, (key,) + args))
+        if key not in self.facts:
+            if self.origin == "replay":
+                if missing is None:
+                    raise RuntimeError(f"{key} was not recorded in this snapshot")
+                return missing
+            value = reader(*args)
+            with self._facts_lock:
+                self.facts.setdefault(key, value)
+        return self.facts[key]
+
+    def copy_facts(self):
+        """Return a copy of the facts that is safe to serialize while collectors still add to them."""
+        with self._facts_lock:
+            return dict(self.facts)
+
+_shared_window = None
+
+def open_shared_window(calls):
+    """
+    Start one sampling window covering every windowed tool in a batch of
+    (function name, arguments) pairs. The window lasts as long as the
+    longest requested duration, or SAMPLING_DURATION if none was given.
+    """
+    global _shared_window
+    sources = set()
+    durations = []
+    for func_name, arguments in calls:
+        if func_name in WINDOWED_TOOLS:
+            sources.update(WINDOWED_TOOLS[func_name])
+            try:
+                if "duration" in arguments:
+                    durations.append(float(arguments["duration"]))
+            except (TypeError, ValueError):
+                pass
+    if sources and _replay is not None:
+        _shared_window = _replay.window
+    elif sources:
+        duration = max(durations, default=SAMPLING_DURATION)
+        # Recorded history answers immediately; otherwise sample live
+        _shared_window = history_window(sources, duration) or SamplingWindow(duration, sources=sources).start()
+    return _shared_window
+
+def close_shared_window():
+    global _shared_window
+    _shared_window = None
+
+def sampling_window(sources, duration=None, interval=None):
+    """
+    Return the shared window if it covers `sources` (and was sampled at the
+    requested `interval`, when one is given), otherwise a window from recorded
+    history (unless a specific `interval` is asked for), otherwise sample a
+    private one. A replay always serves the recorded window, whatever the
+    interval asked for.
+    """
+    window = _shared_window
+    if window is not None and set(sources) <= set(window.sources) and interval in (None, window.interval):
+        with trace_span("wait for window", "window"):
+            return window.wait()
+    if _replay is not None:
+        # Never sample the live system while replaying a snapshot
+        if _replay.window is None:
+            raise RuntimeError("No sampling window was recorded in this snapshot")
+        return _replay.window
+    if interval is None:
+        window = history_window(sources, duration or SAMPLING_DURATION)
+        if window is not None:
+            return window
+    return SamplingWindow(duration or SAMPLING_DURATION, interval or SAMPLING_INTERVAL, sources=sources).run()
+
+# Daemon mode - a resident sampler keeps recent counters in bounded ring buffers
+class PackedTable:
+    """
+    A {key: namedtuple} sample (processes, cgroups) stored as flat arrays.
+
+    Numbers cost 8 bytes each instead of an int object plus a tuple slot,
+    and strings such as comm are interned, so repeated samples of the same
+    process share them.
+    """
+
+    __slots__ = ("cls", "keys", "numbers", "strings", "string_fields", "nbytes")
+
+    def __init__(self, table):
+        rows = list(table.values())
+        self.cls = type(rows[0])
+        self.string_fields = tuple(i for i, value in enumerate(rows[0]) if isinstance(value, str))
+        number_fields = [i for i in range(len(self.cls._fields)) if i not in self.string_fields]
+        keys = list(table)
+        self.keys = array.array("q", keys) if isinstance(keys[0], int) else [sys.intern(key) for key in keys]
+        self.numbers = array.array("q", [int(row[i]) for row in rows for i in number_fields])
+        self.strings = [[sys.intern(row[i]) for row in rows] for i in self.string_fields]
+        self.nbytes = 8 * len(keys) * (len(self.string_fields) + 1) + self.numbers.itemsize * len(self.numbers)
+
+    def unpack(self):
+        width = len(self.cls._fields)
+        step = width - len(self.string_fields)
+        numbers = self.numbers
+        table = {}
+        for n, key in enumerate(self.keys):
+            values = iter(numbers[n * step:(n + 1) * step])
+            strings = iter([column[n] for column in self.strings])
+            table[key] = self.cls._make(next(strings) if i in self.string_fields else next(values) for i in range(width))
+        return table
+
+def pack_sample(sample):
+    """Store a sample compactly: tables of namedtuples as PackedTable, lists of counters as array('q')."""
+    if not isinstance(sample, dict) or not sample:
+        return sample
+    first = next(iter(sample.values()))
+    if isinstance(first, tuple) and hasattr(first, "_fields"):
+        return PackedTable(sample)
+    try:
+        return {key: array.array("q", value) if isinstance(value, list) else value for key, value in sample.items()}
+    except (TypeError, OverflowError):
+        return sample  # Not plain integer counters
+
+def unpack_sample(sample):
+    """Undo pack_sample(), giving back the types the collectors and JSON expect."""
+    if isinstance(sample, PackedTable):
+        return sample.unpack()
+    if isinstance(sample, dict):
+        return {key: value.tolist() if isinstance(value, array.array) else value for key, value in sample.items()}
+    return sample
+
+def sample_size(sample):
+    """Estimate the memory a (packed) sample holds on to, in bytes."""
+    if isinstance(sample, PackedTable):
+        return sample.nbytes
+    if isinstance(sample, array.array):
+        return 64 + sample.itemsize * len(sample)
+    if isinstance(sample, dict):
+        return 64 + sum(100 + sample_size(value) for value in sample.values())
+    if isinstance(sample, (list, tuple)):
+        return 56 + sum(8 + sample_size(value) for value in sample)
+    return 32
+
+class RingBuffer:
+    """
+    Bounded history of timestamped samples.
+
+    Holds at most `capacity` samples and at most `max_bytes` of estimated
+    sample memory. Past the byte budget every other older sample is dropped,
+    so the history keeps its reach at a coarser resolution and memory stays
+    bounded however many processes or cgroups the host has.
+    """
+
+    def __init__(self, capacity, max_bytes):
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.entries = collections.deque()  # (timestamp, sample, size)
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def append(self, timestamp, sample):
+        size = sample_size(sample)
+        with self._lock:
+            self.entries.append((timestamp, sample, size))
+            self.bytes += size
+            while len(self.entries) > self.capacity:
+                self.bytes -= self.entries.popleft()[2]
+            while self.bytes > self.max_bytes and len(self.entries) > 2:
+                # Keep the newest sample and every other one before it
+                newest = len(self.entries) - 1
+                self.entries = collections.deque(
+                    entry for i, entry in enumerate(self.entries) if (newest - i) % 2 == 0
+                )
+                self.bytes = sum(entry[2] for entry in self.entries)
+
+    def since(self, start):
+        """Return the (timestamp, sample) pairs taken at or after `start`, oldest first."""
+        with self._lock:
+            return [(timestamp, sample) for timestamp, sample, size in self.entries if timestamp >= start]
+
+class HistorySampler:
+    """
+    Resident sampler that records every SAMPLERS source into ring buffers.
+
+    Cheap sources are read every `interval` seconds; sources that are only
+    needed at window edges (processes, network, vmstat, cgroups) every
+    `edge_interval` seconds. Any window up to `history_seconds` long can then
+    be served from memory instead of being sampled live. Samples are stored
+    packed, and each source gets an equal share of `max_bytes`.
+    """
+
+    def __init__(self, history_seconds=DAEMON_HISTORY_SECONDS, interval=DAEMON_INTERVAL,
+                 edge_interval=DAEMON_EDGE_INTERVAL, max_bytes=DAEMON_MAX_BYTES):
+        self.rings = {}
+        for name, (reader, every_tick) in SAMPLERS.items():
+            step = interval if every_tick else edge_interval
+            self.rings[name] = (step, RingBuffer(int(history_seconds / step) + 2, max_bytes // len(SAMPLERS)))
+        self.errors = {}  # source -> last error, while reading it keeps failing
+        self._stop = threading.Event()
+
+    def run(self):
+        due = {name: time.monotonic() for name in self.rings}
+        while not self._stop.is_set():
+            now = time.monotonic()
+            for name, (step, ring) in self.rings.items():
+                if due[name] <= now:
+                    try:
+                        ring.append(time.monotonic(), pack_sample(SAMPLERS[name][0]()))
+                        if self.errors.pop(name, None) is not None:
+                            print(f"✅ Sampling {name} works again")
+                    except Exception as e:
+                        # Warn when a source starts failing, not on every tick it keeps failing
+                        if name not in self.errors:
+                            print(f"⚠️ Warning: Could not sample {name}: {e}")
+                        self.errors[name] = str(e)
+                    due[name] += step
+                    if due[name] <= now:
+                        due[name] = now + step  # We fell behind; skip missed ticks instead of bursting
+            self._stop.wait(max(0, min(due.values()) - time.monotonic()))
+
+    def start(self):
+        threading.Thread(target=self.run, name="history-sampler", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def samples(self, sources, duration):
+        """Return the recorded samples covering the last `duration` seconds of each source."""
+        now = time.monotonic()
+        samples = {}
+        for name in sources:
+            step, ring = self.rings[name]
+            # Start one step early so the window spans at least `duration`
+            history = ring.since(now - max(duration, step) - step)
+            # Edge-only sources just need the oldest and newest sample
+            if not SAMPLERS[name][1]:
+                history = history[:1] + history[1:][-1:]
+            if len(history) < 2:
+                # Thinning can leave gaps wider than the window: fall back to the newest pair
+                history = ring.since(float("-inf"))[-2:]
+            samples[name] = [(timestamp, unpack_sample(sample)) for timestamp, sample in history]
+        return samples
+
+_history = None   # HistorySampler of this process when running as the daemon
+
+def decode_history_samples(samples):
+    """Rebuild the sample types that JSON flattened on the way from the daemon."""
+    for name, history in samples.items():
+        if name == "processes":
+            samples[name] = [
+                (t, {int(pid): ProcessSample(*values) for pid, values in sample.items()})
+                for t, sample in history
+            ]
+        elif name == "cgroups":
+            samples[name] = [
+                (t, {path: CgroupSample(*values) for path, values in sample.items()})
+                for t, sample in history
+            ]
+    return samples
+
+def fetch_daemon_samples(sources, duration):
+    """
+    Ask a running daemon for recorded samples and the errors of the sources
+    it cannot read; returns None when no daemon answers.
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(DAEMON_CLIENT_TIMEOUT)
+            client.connect(DAEMON_SOCKET)
+            client.sendall(json.dumps({"sources": list(sources), "duration": duration}).encode() + b"\n")
+            with client.makefile("rb") as reply:
+                reply = json.loads(reply.readline())
+                return decode_history_samples(reply["samples"]), reply.get("errors", {})
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def history_window(sources, duration):
+    """
+    Build a closed SamplingWindow from recorded history, either from this
+    process's sampler or from a running daemon. Returns None when no history
+    covers every source. A source the sampler fails to read at all (sched
+    on kernels without schedstats) would fail a live window just the same,
+    so it is left out of the window with its error instead.
+    """
+    if _history:
+        samples, errors = _history.samples(sources, duration), dict(_history.errors)
+    else:
+        samples, errors = fetch_daemon_samples(sources, duration) or (None, {})
+    if not samples:
+        return None
+    missing = [name for name in sources if len(samples.get(name, [])) < 2]
+    if any(name not in errors for name in missing):
+        return None
+    window = SamplingWindow(duration, sources=sources)
+    window.samples = samples
+    window.errors = {name: errors[name] for name in missing}
+    window.origin = "history"
+    window._done.set()
+    return window
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Answer one {"sources": [...], "duration": seconds} request with recorded
+    samples, and the last error of every requested source that is failing.
+    """
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            sources = [name for name in request["sources"] if name in SAMPLERS]
+            samples = _history.samples(sources, float(request["duration"]))
+            errors = {name: _history.errors[name] for name in sources if name in _history.errors}
+            reply = {"samples": samples, "errors": errors}
+        except (ValueError, KeyError, TypeError) as e:
+            reply = {"error": str(e)}
+        self.wfile.write(json.dumps(reply, separators=(",", ":")).encode() + b"\n")
+
+def run_daemon():
+    """Run the resident sampler and serve its history on DAEMON_SOCKET until interrupted."""
+    global _history
+    _history = HistorySampler().start()
+
+    os.makedirs(os.path.dirname(DAEMON_SOCKET), exist_ok=True)
+    if os.path.exists(DAEMON_SOCKET):
+        os.remove(DAEMON_SOCKET)  # Stale socket from a previous run
+    server = socketserver.ThreadingUnixStreamServer(DAEMON_SOCKET, DaemonRequestHandler)
+    server.daemon_threads = True
+    os.chmod(DAEMON_SOCKET, 0o600)
+
+    # Exit cleanly on SIGTERM as well as Ctrl-C
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    print(f"📚 Recording {DAEMON_HISTORY_SECONDS}s of metrics history, serving on {DAEMON_SOCKET}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        _history.stop()
+        server.server_close()
+        os.remove(DAEMON_SOCKET)
+        print("\nDaemon stopped.")
+
+# Snapshot recording and replay - raw collector data in a compact append-only file
+#
+# File layout: SNAPSHOT_MAGIC, then one record per collected batch:
+#   header (tag, payload length, CRC32 of payload) + zlib-compressed JSON payload
+# Records are only ever appended, and readers walk them through mmap.
+SNAPSHOT_MAGIC = b"SYSDOC01"
+SNAPSHOT_HEADER = struct.Struct("<4sII")
+SNAPSHOT_TAG = b"BATC"
+
+_recorder = None   # SnapshotRecorder when running with --record
+_replay = None     # Replay when running with --replay
+
+class SnapshotRecorder:
+    """Append the raw collector data and timings of every collected batch to a snapshot file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, window, calls, results, timings):
+        snapshot = {
+            "time": datetime.now().isoformat(),
+            "host": os.uname().nodename,
+            "window": None,
+            "tools": [
+                {
+                    "id": call["id"],
+                    "function": func_name,
+                    "arguments": arguments,
+                    "elapsed_s": round(elapsed, 4),
+                    # Windowed tools are rebuilt from the raw window samples on replay
+                    "result": None if func_name in WINDOWED_TOOLS else result
+                }
+                for (call, func_name, arguments), result, elapsed in zip(calls, results, timings)
+            ]
+        }
+        if window is not None:
+            snapshot["window"] = {
+                "duration": window.duration,
+                "interval": window.interval,
+                "origin": window.origin,
+                "samples": window.samples,
+                "errors": dict(window.errors),
+                # A timed-out collector may still be adding facts
+                "facts": window.copy_facts()
+            }
+        payload = zlib.compress(json.dumps(snapshot, separators=(",", ":")).encode(), SNAPSHOT_COMPRESSION)
+        with self._lock, open(self.path, "ab") as f:
+            if f.tell() == 0:
+                f.write(SNAPSHOT_MAGIC)
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_TAG, len(payload), zlib.crc32(payload)) + payload)
+
+def read_snapshots(path):
+    """
+    Yield every snapshot recorded in a file, oldest first.
+
+    The file is memory-mapped and records are located by their headers, so
+    only the records actually decoded are read from disk. A truncated last
+    record (from an interrupted write) ends the iteration.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+                raise ValueError(f"{path} is not a snapshot file")
+            offset = len(SNAPSHOT_MAGIC)
+            while offset + SNAPSHOT_HEADER.size <= len(mm):
+                tag, length, crc = SNAPSHOT_HEADER.unpack_from(mm, offset)
+                start = offset + SNAPSHOT_HEADER.size
+                if start + length > len(mm):
+                    break
+                payload = mm[start:start + length]
+                if tag == SNAPSHOT_TAG and zlib.crc32(payload) == crc:
+                    yield json.loads(zlib.decompress(payload))
+                offset = start + length
+
+class Replay:
+    """Serve the collectors from one recorded snapshot instead of the live system."""
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.window = None
+        if snapshot.get("window"):
+            recorded = snapshot["window"]
+            samples = decode_history_samples(recorded["samples"])
+            self.window = SamplingWindow(recorded["duration"], recorded["interval"], sources=samples)
+            self.window.samples = samples
+            self.window.errors = recorded.get("errors", {})
+            self.window.facts = recorded.get("facts", {})
+            self.window.origin = "replay"
+            self.window._done.set()
+        self.results = {
+            tool_call_key(tool["function"], tool["arguments"]): tool["result"]
+            for tool in snapshot["tools"]
+            if tool["result"] is not None
+        }
+
+    def tool_calls(self):
+        """Rebuild the recorded tool calls in the format the model sends them."""
+        return [
+            {
+                "id": tool["id"],
+                "type": "function",
+                "function": {"name": tool["function"], "arguments": json.dumps(tool["arguments"])}
+            }
+            for tool in self.snapshot["tools"]
+        ]
+
+    def result(self, func_name, arguments):
+        """Return the recorded result of a tool that does not use the sampling window."""
+        return self.results.get(
+            tool_call_key(func_name, arguments),
+            {"status": "error", "message": f"{func_name} was not recorded in this snapshot"}
+        )
+
+def run_replay(path, index=None, analyze=False):
+    """
+    Re-run recorded snapshots through the collectors and the compaction step,
+    and with `analyze` through the whole analysis pipeline, without touching
+    the live system.
+    """
+    global _replay
+    started = time.perf_counter()
+    count = 0
+    for number, snapshot in enumerate(read_snapshots(path)):
+        if index is not None and number != index:
+            continue
+        count += 1
+        _replay = Replay(snapshot)
+        try:
+            if analyze:
+                print(f"🔁 Replaying snapshot #{number} from {snapshot['host']} at {snapshot['time']}")
+                analyze_performance()
+                continue
+            replay_start = time.perf_counter()
+            collected = collect_tool_results(_replay.tool_calls(), verbose=False)
+            contents = compact_tool_results(collected, verbose=False)
+            tokens = sum(estimate_tokens(content) for content in contents)
+            errors = sum(1 for call, func_name, arguments, result in collected if result.get("status") == "error")
+            print(f"#{number} {snapshot['time']} {snapshot['host']}: {len(collected)} tools, {errors} errors, "
+                  f"~{tokens} tokens, replayed in {(time.perf_counter() - replay_start) * 1000:.1f}ms")
+        finally:
+            _replay = None
+    print(f"🔁 Replayed {count} snapshot(s) in {time.perf_counter() - started:.2f}s")
+
+def check_network_info():
+    """
+    Check socket usage, interface throughput and protocol error rates.
+
+    Reads /proc/net/sockstat, /proc/net/dev, /proc/net/snmp and
+    /proc/net/netstat at the edges of the sampling window, without spawning
+    ss, so the cost does not grow with the number of sockets.
+
+    Returns:
+        一个字典，包含套接字统计、各网卡速率和各协议速率，或在失败时返回错误信息。
+    """
+    try:
+        elapsed, first, last = sampling_window(("network",)).span("network")
+
+        interfaces = []
+        for name, end in last["interfaces"].items():
+            start = first["interfaces"].get(name, [0] * len(end))
+            rates = {
+                column: round(max(b - a, 0) / elapsed, 2)
+                for column, a, b in zip(NET_DEV_COLUMNS, start, end)
+                if not column.endswith(("fifo", "frame", "compressed", "colls", "carrier"))
+            }
+            interfaces.append(dict({"interface": name}, **rates))
+
+        protocols = {}
+        for table, counter in NET_PROTOCOL_COUNTERS:
+            end = last["protocols"].get(table, {}).get(counter)
+            if end is None:
+                continue  # Not reported by this kernel
+            start = first["protocols"].get(table, {}).get(counter, end)
+            protocols.setdefault(table, {})[f"{counter}/s"] = round(max(end - start, 0) / elapsed, 2)
+
+        # Share of TCP segments that were retransmissions during the window
+        tcp = protocols.get("Tcp", {})
+        if tcp.get("OutSegs/s"):
+            tcp["retransmit_ratio"] = round(100.0 * tcp.get("RetransSegs/s", 0) / tcp["OutSegs/s"], 2)
+        if "CurrEstab" in last["protocols"].get("Tcp", {}):
+            tcp["CurrEstab"] = last["protocols"]["Tcp"]["CurrEstab"]
+
+        return {
+            "status": "success",
+            "data": {
+                "sockets": last["sockets"],
+                "interfaces": interfaces,
+                "protocols": protocols,
+                "window_seconds": round(elapsed, 2)
+            }
+        }
+    except Exception as e:
+        return {"status": "error", "message": f"An unexpected error occurred: {str(e)}"}
+
+# Performance monitoring function implementations
+CPU_STATES = ("user", "nice", "system", "idle", "iowait", "irq", "softirq", "steal", "guest", "guest_nice")
+SATURATED_CORE_BUSY = 90.0  # A core above this busy percentage is reported as saturated
+
+def cpu_percentages(start, end):
+    """Convert two /proc/stat jiffy rows into mpstat-style percentages."""
+    d = dict(zip(CPU_STATES, (b - a for a, b in zip(start, end))))
+    for state in CPU_STATES:
+        d.setdefault(state, 0)  # Older kernels do not report steal/guest
+    # guest time is already included in user and nice, so it is not added to the total
+    total = sum(d[state] for state in CPU_STATES[:8]) or 1
+    usage = {
+        "user": d["user"] - d["guest"],
+        "nice": d["nice"] - d["guest_nice"],
+        "system": d["system"],
+        "iowait": d["iowait"],
+        "irq": d["irq"],
+        "softirq": d["softirq"],
+        "steal": d["steal"],
+        "guest": d["guest"] + d["guest_nice"],
+        "idle": d["idle"]
+    }
+    usage = {state: round(100.0 * max(value, 0) / total, 2) for state, value in usage.items()}
+    usage["busy"] = round(100.0 - usage["idle"] - usage["iowait"], 2)
+    return usage
+
+def check_cpu_usage(duration=5):
+    """
+    Check CPU usage and load over the sampling window.
+
+    Reads /proc/stat deltas directly, so sysstat is not needed, and reports
+    a per-core breakdown so single-core saturation is not hidden by the
+    all-CPU average.
+    """
+    try:
+        window = sampling_window(("cpu", "loadavg"), duration)
+        elapsed, first, last = window.span("cpu")
+        overall = cpu_percentages(first["cpu"], last["cpu"])
+
+        per_core = []
+        for name, end in last.items():
+            if not name.startswith("cpu") or name == "cpu" or name not in first:
+                continue  # Skip procs_*, the aggregate row and CPUs hotplugged during the window
+            core = {"cpu": int(name[3:])}
+            core.update(cpu_percentages(first[name], end))
+            per_core.append(core)
+        per_core.sort(key=lambda core: core["cpu"])
+
+        # Run-queue size sampled across the whole window, without our own threads
+        loadavg = [sample for _, sample in window.samples["loadavg"]]
+        runnable = [max(sample["runnable"] - sample.get("runnable_own", 0), 0) for sample in loadavg]
+        load = loadavg[-1]["load"] if loadavg else list(os.getloadavg())
+
+        cpu_data = dict(overall)
+        cpu_data.update({
+            "load_1min": load[0],
+            "load_5min": load[1],
+            "load_15min": load[2],
+            "run_queue": {
+                "min": min(runnable, default=0),
+                "mean": round(sum(runnable) / len(runnable), 2) if runnable else 0,
+                "max": max(runnable, default=0),
+                "tasks": loadavg[-1]["tasks"] if loadavg else 0
+            },
+            "cpu_count": len(per_core),
+            "max_core_busy": max((core["busy"] for core in per_core), default=0.0),
+            "saturated_cores": [core["cpu"] for core in per_core if core["busy"] >= SATURATED_CORE_BUSY],
+            "per_core": per_core,
+            "window_seconds": round(elapsed, 2)
+        })
+        return {"status": "success", "data": cpu_data}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+def check_memory_usage():
+    """
+    Check memory usage and memory pressure over the sampling window.
+
+    Usage comes from /proc/meminfo; fault, swap, reclaim, compaction and OOM
+    activity comes from /proc/vmstat deltas, which tells a box whose memory
+    is full of page cache apart from one that is thrashing.
+    """
+    try:
+        window = sampling_window(("vmstat",))
+        elapsed, first, last = window.span("vmstat")
+        meminfo = window.fact("meminfo", read_meminfo)
+
+        def mb(*keys):
+            return round(sum(meminfo.get(key, 0) for key in keys) / 1024)
+
+        def rate(*prefixes):
+            # Sum every counter starting with one of the prefixes (e.g. per-zone allocstall_*)
+            delta = sum(
+                max(value - first.get(key, value), 0)
+                for key, value in last.items()
+                if key.startswith(prefixes) and not key.endswith("_throttle")
+            )
+            return round(delta / elapsed, 2)
+
+        total_kb = meminfo["MemTotal"]
+        cache_kb = meminfo.get("Buffers", 0) + meminfo.get("Cached", 0) + meminfo.get("SReclaimable", 0)
+        return {
+            "status": "success",
+            "data": {
+                "total_mb": mb("MemTotal"),
+                "used_mb": round((total_kb - meminfo["MemFree"] - cache_kb) / 1024),
+                "free_mb": mb("MemFree"),
+                "available_mb": mb("MemAvailable"),
+                "buff_cache_mb": round(cache_kb / 1024),
+                "shmem_mb": mb("Shmem"),
+                "dirty_mb": mb("Dirty"),
+                "writeback_mb": mb("Writeback"),
+                "slab_unreclaimable_mb": mb("SUnreclaim"),
+                "swap_total_mb": mb("SwapTotal"),
+                "swap_used_mb": round((meminfo.get("SwapTotal", 0) - meminfo.get("SwapFree", 0)) / 1024),
+                "major_faults/s": rate("pgmajfault"),
+                "swap_in_pages/s": rate("pswpin"),
+                "swap_out_pages/s": rate("pswpout"),
+                "kswapd_scan_pages/s": rate("pgscan_kswapd"),
+                "direct_scan_pages/s": rate("pgscan_direct"),
+                "direct_reclaim_stalls/s": rate("allocstall"),
+                "compaction_stalls/s": rate("compact_stall"),
+                "oom_kills": max(last.get("oom_kill", 0) - first.get("oom_kill", 0), 0),
+                "window_seconds": round(elapsed, 2)
+            }
+        }
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+NOTABLE_CPU_WAIT = 100.0  # ms/s of run-queue wait above which a CPU is listed on its own when compacting
+
+def check_scheduler_latency(top_n=5):
+    """
+    Check how long runnable tasks wait for a CPU over the sampling window.
+
+    Per-CPU run-queue wait comes from /proc/schedstat (every tick), per-task
+    wait from /proc/[pid]/schedstat at the window edges, and the runnable and
+    blocked task counts from /proc/stat. A busy-but-not-full CPU average can
+    hide long queues, and this is where they show up.
+    """
+    try:
+        window = sampling_window(("cpu", "sched", "processes"))
+        cpu_samples = [sample for _, sample in window.samples["cpu"]]
+        data = {}
+        for key in ("procs_running", "procs_blocked"):
+            values = [max(sample[key] - sample.get(f"{key}_own", 0), 0) for sample in cpu_samples if key in sample]
+            if values:
+                data[key] = {"min": min(values), "mean": round(sum(values) / len(values), 2), "max": max(values)}
+
+        if len(window.samples.get("sched", [])) >= 2:
+            samples = window.samples["sched"]
+            elapsed, first, last = window.span("sched")
+            per_cpu = []
+            for name, (run_ns, wait_ns, slices) in last.items():
+                if name not in first:
+                    continue
+                d_run, d_wait, d_slices = (b - a for a, b in zip(first[name], (run_ns, wait_ns, slices)))
+                # Worst single interval, so a short burst is not averaged away
+                peak = max(
+                    ((b[1][name][1] - a[1][name][1]) / 1e6 / (b[0] - a[0])
+                     for a, b in zip(samples, samples[1:]) if name in a[1] and name in b[1] and b[0] > a[0]),
+                    default=0.0
+                )
+                per_cpu.append({
+                    "cpu": int(name[3:]),
+                    "wait_ms/s": round(d_wait / 1e6 / elapsed, 2),
+                    "wait_ms/s_max": round(peak, 2),
+                    "run_ms/s": round(d_run / 1e6 / elapsed, 2),
+                    "timeslices/s": round(d_slices / elapsed, 2),
+                    "avg_wait_ms": round(d_wait / d_slices / 1e6, 3) if d_slices else 0.0
+                })
+            per_cpu.sort(key=lambda cpu: cpu["cpu"])
+            total_wait = sum(cpu["wait_ms/s"] for cpu in per_cpu)
+            total_slices = sum(cpu["timeslices/s"] for cpu in per_cpu)
+            data["runqueue"] = {
+                "wait_ms/s": round(total_wait, 2),
+                "avg_wait_ms": round(total_wait / total_slices, 3) if total_slices else 0.0,
+                "max_cpu_wait_ms/s": max((cpu["wait_ms/s"] for cpu in per_cpu), default=0.0)
+            }
+            data["per_cpu"] = per_cpu
+        else:
+            data["per_cpu_unavailable"] = window.errors.get("sched", "Not enough /proc/schedstat samples") + \
+                " (the kernel may be built without CONFIG_SCHEDSTATS)"
+
+        elapsed, first, last = window.span("processes")
+        waits = []
+        for pid, end in last.items():
+            start = first.get(pid)
+            if start is None or start.sched_wait_ns > end.sched_wait_ns:
+                start = ProcessSample("", "", 0, 0, 0, 0, 0)
+            d_wait = end.sched_wait_ns - start.sched_wait_ns
+            if d_wait > 0:
+                waits.append((d_wait, end.sched_run_ns - start.sched_run_ns, end.sched_slices - start.sched_slices,
+                              pid, end))
+        data["top_waiting_tasks"] = [
+            {
+                "pid": pid,
+                "command": end.comm,
+                "state": end.state,
+                "wait_ms/s": round(d_wait / 1e6 / elapsed, 2),
+                "run_ms/s": round(d_run / 1e6 / elapsed, 2),
+                "wait_share": round(100.0 * d_wait / (d_wait + d_run), 1) if d_wait + d_run else 0.0,
+                "avg_wait_ms": round(d_wait / d_slices / 1e6, 3) if d_slices else 0.0
+            }
+            for d_wait, d_run, d_slices, pid, end in heapq.nlargest(top_n, waits, key=operator.itemgetter(0))
+        ]
+        data["window_seconds"] = round(elapsed, 2)
+        return {"status": "success", "data": data}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+# Rankings of check_cgroup_usage: name -> (sort key, reported metrics, leaves only)
+CGROUP_RANKINGS = {
+    "cpu": ("cpu_percent", ("cpu_percent", "throttled_ms/s"), True),
+    "throttling": ("throttled_ms/s", ("throttled_ms/s", "throttled_periods_pct", "cpu_percent"), False),
+    "memory": ("memory_mb", ("memory_mb", "memory_limit_pct"), True),
+    "memory_limit": ("memory_limit_pct", ("memory_limit_pct", "memory_mb", "memory_max_mb", "memory_high_events",
+                                          "memory_max_events", "oom_kills"), False),
+    "io": ("io_kB/s", ("read_kB/s", "write_kB/s", "iops"), True),
+    "pressure": ("stall_pct", ("cpu_some_pct", "memory_some_pct", "memory_full_pct", "io_some_pct", "io_full_pct"),
+                 True),
+}
+
+def cgroup_metrics(start, end, elapsed):
+    """Turn two CgroupSamples of the same cgroup into rates, percentages and event counts."""
+    elapsed_us = elapsed * 1e6
+    d = [max(b - a, 0) for a, b in zip(start[:13], end[:13])] + \
+        [max(b - a, 0) * 100.0 / elapsed_us for a, b in zip(start[13:18], end[13:18])]
+    (cpu_usec, throttled_usec, periods, throttled, _, _, high_events, max_events, oom_kills,
+     rbytes, wbytes, rios, wios, cpu_some, memory_some, memory_full, io_some, io_full) = d
+    return {
+        "cpu_percent": round(cpu_usec * 100.0 / elapsed_us, 2),
+        "throttled_ms/s": round(throttled_usec / 1e3 / elapsed, 2),
+        "throttled_periods_pct": round(100.0 * throttled / periods, 1) if periods else 0.0,
+        "memory_mb": round(end.memory_current / 1048576, 1),
+        "memory_max_mb": round(end.memory_max / 1048576, 1) if end.memory_max else None,
+        "memory_limit_pct": round(100.0 * end.memory_current / end.memory_max, 1) if end.memory_max else 0.0,
+        "memory_high_events": high_events,
+        "memory_max_events": max_events,
+        "oom_kills": oom_kills,
+        "read_kB/s": round(rbytes / 1024 / elapsed, 2),
+        "write_kB/s": round(wbytes / 1024 / elapsed, 2),
+        "io_kB/s": round((rbytes + wbytes) / 1024 / elapsed, 2),
+        "iops": round((rios + wios) / elapsed, 2),
+        "cpu_some_pct": round(cpu_some, 2),
+        "memory_some_pct": round(memory_some, 2),
+        "memory_full_pct": round(memory_full, 2),
+        "io_some_pct": round(io_some, 2),
+        "io_full_pct": round(io_full, 2),
+        "stall_pct": round(max(cpu_some, memory_some, io_some), 2),
+    }
+
+def check_cgroup_usage(top_n=5, include_parents=False):
+    """
+    Rank cgroups (containers, pods, systemd services and slices) by CPU,
+    CPU throttling, memory, memory limit, I/O and pressure stall time over
+    the sampling window.
+
+    Usage rankings only list leaf cgroups by default, since every parent
+    also counts the usage of its children; throttling and memory limits are
+    ranked across the whole tree because they apply where the limit is set.
+    """
+    try:
+        window = sampling_window(("cgroups",))
+        elapsed, first, last = window.span("cgroups")
+        if not last:
+            return {"status": "error", "message": "No cgroups found in the cgroup v2 hierarchy (the host may use cgroup v1 only)"}
+
+        rows = []
+        for name, end in last.items():
+            start = first.get(name)
+            if start is None:
+                continue  # Created during the window, so it has no delta to report
+            rows.append((name, end.leaf, cgroup_metrics(start, end, elapsed)))
+
+        data = {"cgroup_count": len(last), "window_seconds": round(elapsed, 2)}
+        for ranking, (key, metrics, leaves_only) in CGROUP_RANKINGS.items():
+            candidates = [
+                (metrics_row[key], name, metrics_row) for name, leaf, metrics_row in rows
+                if metrics_row[key] and (leaf or include_parents or not leaves_only)
+            ]
+            data[f"top_{ranking}"] = [
+                {"cgroup": name, **{metric: metrics_row[metric] for metric in metrics}}
+                for value, name, metrics_row in heapq.nlargest(top_n, candidates, key=operator.itemgetter(0))
+            ]
+        # OOM kills matter however few there are, so list every cgroup that had one
+        data["oom_killed_cgroups"] = [
+            {"cgroup": name, "oom_kills": metrics_row["oom_kills"]}
+            for name, leaf, metrics_row in rows if metrics_row["oom_kills"]
+        ]
+        return {"status": "success", "data": data}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+# Columns of /proc/diskstats used by the disk engine (offsets after the device name)
+DISKSTAT_COLUMNS = {
+    "reads": 0,
+    "read_sectors": 2,
+    "read_ms": 3,
+    "writes": 4,
+    "write_sectors": 6,
+    "write_ms": 7,
+    "io_ms": 9,
+    "weighted_ms": 10,
+}
+# Metrics summarised across every sample of the window
+DISK_STATS_METRICS = ("iops", "throughput_kB/s", "await", "aqu-sz", "%util")
+
+def block_topology():
+    """
+    Describe the block devices from /sys/class/block.
+
+    Returns:
+        dict: device -> {"partition_of": parent or None, "slaves": [...], "dm_name": name or None}
+    """
+    topology = {}
+    base = "/sys/class/block"
+    for name in os.listdir(base):
+        path = os.path.join(base, name)
+        info = {"partition_of": None, "slaves": [], "dm_name": None}
+        if os.path.exists(os.path.join(path, "partition")):
+            info["partition_of"] = os.path.basename(os.path.dirname(os.path.realpath(path)))
+        try:
+            info["slaves"] = os.listdir(os.path.join(path, "slaves"))
+        except OSError:
+            pass
+        try:
+            with open(os.path.join(path, "dm", "name")) as f:
+                info["dm_name"] = f.read().strip()
+        except OSError:
+            pass
+        topology[name] = info
+    return topology
+
+def physical_devices(name, topology):
+    """Resolve a partition or device-mapper device to the physical disks below it."""
+    info = topology.get(name)
+    if info is None:
+        return {name}
+    if info["partition_of"]:
+        return physical_devices(info["partition_of"], topology)
+    if info["slaves"]:
+        return set().union(*(physical_devices(slave, topology) for slave in info["slaves"]))
+    return {name}
+
+def disk_columns(sample, names):
+    """Turn one /proc/diskstats sample into one column per counter, ordered like `names`."""
+    return {column: [sample[name][i] for name in names] for column, i in DISKSTAT_COLUMNS.items()}
+
+def disk_metrics(start, end, elapsed):
+    """
+    Compute the metrics of every device between two column snapshots.
+
+    Works a column at a time over all devices, so hundreds of NVMe
+    namespaces and dm devices cost one pass per metric.
+    """
+    # Clamp negative deltas from counter wrap-around on old kernels
+    d = {column: [max(v, 0) for v in map(operator.sub, end[column], start[column])] for column in start}
+    ios = list(map(operator.add, d["reads"], d["writes"]))
+    io_ms = list(map(operator.add, d["read_ms"], d["write_ms"]))
+    elapsed_ms = elapsed * 1000
+    return {
+        "r/s": [v / elapsed for v in d["reads"]],
+        "w/s": [v / elapsed for v in d["writes"]],
+        "iops": [v / elapsed for v in ios],
+        "rkB/s": [v / 2 / elapsed for v in d["read_sectors"]],
+        "wkB/s": [v / 2 / elapsed for v in d["write_sectors"]],
+        "throughput_kB/s": [(r + w) / 2 / elapsed for r, w in zip(d["read_sectors"], d["write_sectors"])],
+        "r_await": [t / n if n else 0.0 for t, n in zip(d["read_ms"], d["reads"])],
+        "w_await": [t / n if n else 0.0 for t, n in zip(d["write_ms"], d["writes"])],
+        "await": [t / n if n else 0.0 for t, n in zip(io_ms, ios)],
+        "aqu-sz": [v / elapsed_ms for v in d["weighted_ms"]],
+        "%util": [min(100.0, v * 100 / elapsed_ms) for v in d["io_ms"]],
+    }
+
+def series_stats(values):
+    """Return min, mean, p95 (nearest rank) and max of a series."""
+    if not values:
+        return {"min": 0.0, "mean": 0.0, "p95": 0.0, "max": 0.0}
+    ordered = sorted(values)
+    p95 = ordered[max(0, -(-95 * len(ordered) // 100) - 1)]
+    return {
+        "min": round(ordered[0], 2),
+        "mean": round(sum(ordered) / len(ordered), 2),
+        "p95": round(p95, 2),
+        "max": round(ordered[-1], 2)
+    }
+
+def check_disk_io(device="all", include_partitions=False, rollup=False, interval=None):
+    """
+    Check disk I/O performance over the sampling window and return structured data.
+
+    /proc/diskstats is sampled every `interval` seconds (SAMPLING_INTERVAL by
+    default). Each device reports its whole-window IOPS, throughput, await,
+    queue depth and utilisation, plus min/mean/p95/max across the samples.
+    An explicit `interval` that differs from the shared window's gets its own
+    window; the interval actually used is reported. Only devices present in
+    every sample are reported, so hot-plugged devices do not break the window.
+    With `rollup`, partitions and device-mapper devices are grouped under the
+    physical disks they live on.
+    """
+    try:
+        if interval is not None and not DISK_INTERVAL_RANGE[0] <= interval <= DISK_INTERVAL_RANGE[1]:
+            return {"status": "error", "message": f"interval must be between {DISK_INTERVAL_RANGE[0]} "
+                                                  f"and {DISK_INTERVAL_RANGE[1]} seconds"}
+        window = sampling_window(("disk",), interval=interval)
+        samples = window.samples["disk"]
+        if len(samples) < 2:
+            raise RuntimeError(window.errors.get("disk", "Not enough disk samples collected"))
+        last = samples[-1][1]
+        if device != "all" and device not in last:
+            return {
+                "status": "error",
+                "message": f"Device not found: {device}",
+                "available_devices": sorted(last)
+            }
+
+        # Devices present for the whole window that have ever done any I/O
+        present = set(last).intersection(*(sample for _, sample in samples))
+        if device != "all" and device not in present:
+            return {
+                "status": "error",
+                "message": f"Device {device} was not present for the whole sampling window (hot-plugged or removed)",
+                "available_devices": sorted(present)
+            }
+        names = [name for name in last if name in present and (last[name][0] or last[name][4] or name == device)]
+        topology = window.fact("block_topology", block_topology, missing={})
+
+        columns = [(t, disk_columns(sample, names)) for t, sample in samples]
+        overall = disk_metrics(columns[0][1], columns[-1][1], columns[-1][0] - columns[0][0])
+        intervals = [disk_metrics(a, b, tb - ta) for (ta, a), (tb, b) in zip(columns, columns[1:])]
+
+        rows = {}
+        for i, name in enumerate(names):
+            info = topology.get(name, {})
+            row = {"device": name}
+            if info.get("dm_name"):
+                row["dm_name"] = info["dm_name"]
+            row.update({metric: round(values[i], 2) for metric, values in overall.items()})
+            row["stats"] = {
+                metric: series_stats([values[metric][i] for values in intervals])
+                for metric in DISK_STATS_METRICS
+            }
+            rows[name] = row
+
+        def is_partition(name):
+            return bool(topology.get(name, {}).get("partition_of"))
+
+        def is_logical(name):
+            info = topology.get(name, {})
+            return bool(info.get("partition_of") or info.get("slaves"))
+
+        if device != "all":
+            devices = [rows[device]]
+        else:
+            devices = [row for name, row in rows.items() if include_partitions or not is_partition(name)]
+
+        # Sum physical disks only, so dm devices and partitions are not counted twice
+        physical = [row for name, row in rows.items() if not is_logical(name)] if device == "all" else devices
+        key_metrics = {
+            "total_iops": round(sum(row["iops"] for row in physical), 2),
+            "total_throughput": round(sum(row["throughput_kB/s"] for row in physical), 2),
+            "max_utilization": max((row["%util"] for row in devices), default=0.0),
+            "device_count": len(devices)
+        }
+
+        data = {
+            "devices": devices,
+            "summary": key_metrics,
+            "samples": len(samples),
+            "interval_seconds": window.interval,
+            "window_seconds": round(samples[-1][0] - samples[0][0], 2),
+            "timestamp": datetime.now().isoformat()
+        }
+
+        if rollup:
+            rollups = {}
+            for name, row in rows.items():
+                if not is_logical(name):
+                    continue
+                for disk in physical_devices(name, topology):
+                    member = {"device": name, "iops": row["iops"], "throughput_kB/s": row["throughput_kB/s"]}
+                    if "dm_name" in row:
+                        member["dm_name"] = row["dm_name"]
+                    rollups.setdefault(disk, {"device": disk, "members": []})["members"].append(member)
+            for disk, group in rollups.items():
+                if disk in rows:
+                    group.update({metric: rows[disk][metric] for metric in ("iops", "throughput_kB/s", "%util")})
+                group["members"].sort(key=lambda member: member["iops"], reverse=True)
+            data["rollups"] = list(rollups.values())
+
+        return {"status": "success", "data": data}
+    except Exception as e:
+        return {"status": "error", "message": f"Execution error: {str(e)}"}
+
+def parse_iostat_output(output, tarcheck_device):
+    """Parse iostat output - enhanced version."""
+    # Split the output into lines
+    lines = output.strip().split('\n')
+    
+    # If there is no output content
+    if not lines or len(lines) < 3:
+        return {"status": "error", "message": "iostat output is empty or has an abnormal format"}
+    
+    # Find all data blocks
+    data_blocks = []
+    current_block = []
+    in_block = False
+    
+    for line in lines:
+        # Detect header line
+        if line.startswith("Device"):
+            # If already in a data block, end the current one
+            if in_block:
+                data_blocks.append(current_block)
+                current_block = []
+            in_block = True
+            headers = [h.lower() for h in line.split()]
+            current_block.append(headers)
+            continue
+            
+        # If it is a data line
+        if in_block and line.strip():
+            parts = line.split()
+            # Ensure there are enough data columns
+            if len(parts) >= len(headers):
+                current_block.append(parts)
+    
+    # Add the last block
+    if in_block and current_block:
+        data_blocks.append(current_block)
+    
+    # If no data blocks were found
+    if not data_blocks:
+        return {"status": "error", "message": "No valid data blocks found"}
+    
+    # Select the most suitable data block (prefer the last one)
+    selected_block = None
+    
+    # Try to use the last data block
+    if data_blocks:
+        selected_block = data_blocks[-1]
+    
+    # If the last block only has a header and no data, try the previous one
+    if selected_block and len(selected_block) == 1:
+        for block in reversed(data_blocks):
+            if len(block) > 1:
+                selected_block = block
+                break
+    
+    # If a valid block is still not found
+    if not selected_block or len(selected_block) < 2:
+        return {"status": "error", "message": "Not enough data rows found"}
+    
+    # Parse the selected data block
+    headers = selected_block[0]
+    data_lines = selected_block[1:]
+    
+    # Parse data
+    devices = []
+    for parts in data_lines:
+        # Device name is the first column
+        device_name = parts[0]
+        
+        # If a specific device is specified, skip others
+        if tarcheck_device != "all" and device_name != tarcheck_device:
+            continue
+            
+        # Create a data dictionary for the device
+        device_data = {"device": device_name}
+        
+        # Parse various metrics
+        for i in range(1, min(len(headers), len(parts))):
+            header = headers[i]
+            value_str = parts[i]
+            
+            # Handle special values
+            if value_str == "0.00" or value_str == "0.0":
+                value = 0.0
+            else:
+                try:
+                    value = float(value_str)
+                except ValueError:
+                    value = value_str  # Keep the original string
+            
+            device_data[header] = value
+        
+        devices.append(device_data)
+    
+    # If a specific device was specified but not found
+    if tarcheck_device != "all" and not devices:
+        return {
+            "status": "error", 
+            "message": f"Device not found: {tarcheck_device}",
+            "available_devices": [block[0] for block in data_lines]
+        }
+    
+    # Calculate key metrics
+    key_metrics = {
+        "total_iops": 0.0,
+        "total_throughput": 0.0,
+        "max_utilization": 0.0,
         "device_count": len(devices)
     }
     
@@ -486,11 +2361,14 @@ def parse_iostat_output(output, tarcheck_device):
         # Calculate total throughput and IOPS
         for d in devices:
             # Compatible with different iostat version column names
-            rps = d.get("r/s", d.get("rsec/s", 0)) / 2.0  # Conversion needed if using rsec/s
-            wps = d.get("w/s", d.get("wsec/s", 0)) / 2.0
+            # (old versions report sectors per second, 2 sectors = 1 kB)
+            rps = d.get("r/s", 0)
+            wps = d.get("w/s", 0)
+            rkbs = d.get("rkb/s", d.get("rsec/s", 0) / 2.0)
+            wkbs = d.get("wkb/s", d.get("wsec/s", 0) / 2.0)
             
             key_metrics["total_iops"] += rps + wps
-            key_metrics["total_throughput"] += d.get("rkb/s", d.get("rkB/s", 0)) + d.get("wkb/s", d.get("wkB/s", 0))
+            key_metrics["total_throughput"] += rkbs + wkbs
             
             # Check maximum utilization
             util = d.get("%util", 0.0)
@@ -515,25 +2393,515 @@ def parse_iostat_output(output, tarcheck_device):
         }
     }
 
-def check_running_processes(top_n=5):
-    """Check processes with the highest resource consumption."""
+PROCESS_SORT_KEYS = ("cpu", "memory", "io")
+
+def read_process_status(pid):
+    """Read the owner (uid and user name) and context switch counters of one process from /proc/[pid]/status."""
+    status = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("Uid", "voluntary_ctxt_switches", "nonvoluntary_ctxt_switches"):
+                    status[key] = int(value.split()[0])
+    except OSError:
+        pass
+    if "Uid" in status:
+        try:
+            status["user"] = pwd.getpwuid(status["Uid"]).pw_name
+        except KeyError:
+            status["user"] = str(status["Uid"])
+    return status
+
+def check_running_processes(top_n=5, sort_by=PROCESS_SORT_KEYS):
+    """
+    Check processes with the highest resource consumption over the sampling window.
+
+    CPU% and I/O rates come from two /proc scans at the window edges, so they
+    describe what is running right now rather than lifetime averages. The top
+    N for every key in `sort_by` are picked with heap selection instead of
+    sorting every process.
+    """
     try:
-        result = subprocess.run(
-            ["ps", "-eo", "pid,user,%cpu,%mem,comm", "--sort=-%cpu"],
-            capture_output=True, text=True, timeout=5
+        if isinstance(sort_by, str):
+            sort_by = [sort_by]
+        unknown = [key for key in sort_by if key not in PROCESS_SORT_KEYS]
+        if unknown:
+            return {"status": "error", "message": f"Unknown sort keys: {unknown}. Use {list(PROCESS_SORT_KEYS)}"}
+
+        window = sampling_window(("processes",))
+        elapsed, first, last = window.span("processes")
+        mem_total_kb = window.fact("meminfo", read_meminfo)["MemTotal"]
+
+        usage = []
+        for pid, end in last.items():
+            start = first.get(pid)
+            # Processes started inside the window (or a reused PID) used all of their counters in it
+            if start is None or start.ticks > end.ticks:
+                start = ProcessSample("", "", 0, 0, 0, 0, 0)
+            usage.append((
+                end.ticks - start.ticks,
+                max(end.read_bytes - start.read_bytes, 0) + max(end.write_bytes - start.write_bytes, 0),
+                pid,
+                start,
+                end
+            ))
+
+        selectors = {
+            "cpu": lambda row: row[0],
+            "memory": lambda row: row[4].rss,
+            "io": lambda row: row[1],
+        }
+
+        described = {}
+        def describe(row):
+            ticks, io_bytes, pid, start, end = row
+            if pid not in described:
+                # A process that exited before it was described has no status either
+                status = window.fact("process_status", read_process_status, pid, missing={})
+                described[pid] = {
+                    "pid": pid,
+                    "user": status.get("user", ""),
+                    "state": end.state,
+                    "cpu": round(100.0 * ticks / CLOCK_TICKS / elapsed, 1),
+                    "mem": round(100.0 * end.rss * PAGE_SIZE / 1024 / mem_total_kb, 1),
+                    "rss_mb": round(end.rss * PAGE_SIZE / 1048576, 1),
+                    "read_kB/s": round((end.read_bytes - start.read_bytes) / 1024 / elapsed, 1),
+                    "write_kB/s": round((end.write_bytes - start.write_bytes) / 1024 / elapsed, 1),
+                    "threads": end.threads,
+                    "voluntary_ctxt_switches": status.get("voluntary_ctxt_switches"),
+                    "nonvoluntary_ctxt_switches": status.get("nonvoluntary_ctxt_switches"),
+                    "command": end.comm
+                }
+            return described[pid]
+
+        data = {"process_count": len(last), "window_seconds": round(elapsed, 2)}
+        for key in sort_by:
+            data[f"top_{key}"] = [describe(row) for row in heapq.nlargest(top_n, usage, key=selectors[key])]
+        return {"status": "success", "data": data}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+# Per-thread drill-down - where the time of the hottest processes goes, one row per thread pool
+THREAD_POOL_DIGITS = re.compile(r"\d+")
+THREAD_WCHAN_SAMPLE = 64   # Threads per group whose wait channel is read
+
+# One thread as seen by a single /proc/[pid]/task scan (ns counters from schedstat, 0 when unavailable)
+ThreadSample = collections.namedtuple("ThreadSample", "comm state ticks run_ns wait_ns voluntary involuntary")
+
+def read_thread_stats(pid, proc="/proc"):
+    """
+    Read stat, schedstat and the context switch counters of every thread of
+    one process.
+
+    Returns:
+        dict: tid -> ThreadSample
+    """
+    threads = {}
+    task = f"{proc}/{pid}/task"
+    with os.scandir(task) as entries:
+        tids = [entry.name for entry in entries]
+    for tid in tids:
+        try:
+            data = read_small_file(f"{task}/{tid}/stat")
+        except OSError:
+            continue  # The thread exited while we were scanning
+        lpar = data.find(b"(")
+        rpar = data.rfind(b")")
+        fields = data[rpar + 2:].split(None, 14)
+        run_ns = wait_ns = 0
+        try:
+            run_ns, wait_ns = map(int, read_small_file(f"{task}/{tid}/schedstat").split()[:2])
+        except (OSError, ValueError):
+            pass  # Kernel without CONFIG_SCHED_INFO
+        voluntary = involuntary = 0
+        try:
+            # The two counters are the last lines of status, so search from the end
+            status = read_small_file(f"{task}/{tid}/status", 16384)
+            start = status.rfind(b"\nvoluntary_ctxt_switches:")
+            if start >= 0:
+                voluntary, involuntary = (int(line.split()[1]) for line in status[start + 1:].splitlines()[:2])
+        except (OSError, ValueError, IndexError):
+            pass
+        threads[int(tid)] = ThreadSample(
+            data[lpar + 1:rpar].decode(errors="replace"),
+            fields[0].decode(),
+            int(fields[11]) + int(fields[12]),
+            run_ns,
+            wait_ns,
+            voluntary,
+            involuntary
         )
+    return threads
+
+def read_wchan(pid, tid, proc="/proc"):
+    """Return the kernel function a sleeping thread waits in, or None when it is running or hidden."""
+    try:
+        wchan = read_small_file(f"{proc}/{pid}/task/{tid}/wchan").decode()
+    except OSError:
+        return None
+    return wchan if wchan not in ("", "0") else None
+
+def read_cmdline(pid, limit=200):
+    """Return the full command line of a process, truncated to `limit` characters."""
+    try:
+        return read_small_file(f"/proc/{pid}/cmdline", limit * 4).replace(b"\0", b" ").decode(errors="replace").strip()[:limit]
+    except OSError:
+        return ""
+
+def thread_groups(pid, first, last, elapsed, top_n):
+    """
+    Group the threads of one process by name with digits collapsed, so
+    "worker-1" ... "worker-64" become one "worker-#" row (a group whose
+    threads all have the same name keeps that name), and return the
+    `top_n` busiest groups plus the hottest single threads.
+
+    Returns:
+        tuple: (CPU% of the whole process, groups, hottest threads)
+    """
+    groups = {}
+    rows = []
+    for tid, end in last.items():
+        start = first.get(tid)
+        if start is None:
+            start = ThreadSample(end.comm, "", 0, 0, 0, 0, 0)  # Started inside the window
+        if end.run_ns or start.run_ns:
+            cpu = (end.run_ns - start.run_ns) / 1e7 / elapsed
+        else:
+            cpu = 100.0 * (end.ticks - start.ticks) / CLOCK_TICKS / elapsed
+        row = (cpu, tid, end,
+               (end.wait_ns - start.wait_ns) / 1e6 / elapsed,
+               (end.voluntary - start.voluntary) / elapsed,
+               (end.involuntary - start.involuntary) / elapsed)
+        rows.append(row)
+        groups.setdefault(THREAD_POOL_DIGITS.sub("#", end.comm), []).append(row)
+
+    ranked = heapq.nlargest(top_n, groups.items(), key=lambda item: sum(row[0] for row in item[1]))
+    summary = []
+    for name, members in ranked:
+        names = {row[2].comm for row in members}
+        if len(names) == 1:
+            name = names.pop()
+        states = collections.Counter(row[2].state for row in members)
+        # Wait channels of the sleepers show what an idle or blocked pool is waiting for
+        sleepers = [row[1] for row in members if row[2].state in ("S", "D")][:THREAD_WCHAN_SAMPLE]
+        wchans = collections.Counter(filter(None, (read_wchan(pid, tid) for tid in sleepers)))
+        group = {
+            "name": name,
+            "threads": len(members),
+            "cpu_percent": round(sum(row[0] for row in members), 1),
+            "max_thread_cpu": round(max(row[0] for row in members), 1),
+            "states": dict(states),
+            "wait_ms/s": round(sum(row[3] for row in members), 2),
+            "voluntary_switches/s": round(sum(row[4] for row in members), 1),
+            "involuntary_switches/s": round(sum(row[5] for row in members), 1),
+        }
+        if wchans:
+            group["wchan"] = dict(wchans.most_common(3))
+        summary.append(group)
+
+    hottest = [
+        {
+            "tid": tid,
+            "name": end.comm,
+            "cpu_percent": round(cpu, 1),
+            "state": end.state,
+            "wait_ms/s": round(wait, 2),
+            "voluntary_switches/s": round(voluntary, 1),
+            "involuntary_switches/s": round(involuntary, 1),
+            "wchan": read_wchan(pid, tid) if end.state != "R" else None
+        }
+        for cpu, tid, end, wait, voluntary, involuntary in heapq.nlargest(3, rows, key=operator.itemgetter(0))
+    ]
+    return round(sum(row[0] for row in rows), 1), summary, hottest
+
+def check_thread_activity(pids=None, top_k=3, top_n=8, duration=1):
+    """
+    Drill down into the threads of the busiest processes.
+
+    Without `pids`, the `top_k` processes by CPU over the sampling window are
+    picked. The threads of each one are sampled twice, `duration` seconds
+    apart, and reported per thread pool (name with digits collapsed) with
+    CPU%, states, run-queue wait, context switch rates and the wait channels
+    of the sleeping threads.
+    """
+    try:
+        if not pids:
+            elapsed, first, last = sampling_window(("processes",)).span("processes")
+            busiest = heapq.nlargest(
+                top_k, last.items(),
+                key=lambda item: item[1].ticks - first[item[0]].ticks if item[0] in first else item[1].ticks
+            )
+            pids = [pid for pid, sample in busiest]
+        pids = [int(pid) for pid in pids]
+
+        started = time.monotonic()
+        first = {}
+        for pid in pids:
+            try:
+                first[pid] = read_thread_stats(pid)
+            except OSError:
+                pass  # Exited, or not ours to read
+        time.sleep(max(0, duration - (time.monotonic() - started)))
+        elapsed = time.monotonic() - started
+
         processes = []
-        for line in result.stdout.split('\n')[1:top_n+1]:
-            if line.strip():
-                parts = line.split(maxsplit=4)
-                processes.append({
-                    "pid": parts[0],
-                    "user": parts[1],
-                    "cpu": float(parts[2]),
-                    "mem": float(parts[3]),
-                    "command": parts[4] if len(parts) > 4 else ""
-                })
-        return {"status": "success", "data": processes}
+        for pid in pids:
+            if pid not in first:
+                processes.append({"pid": pid, "error": "Process not found or not readable"})
+                continue
+            try:
+                last = read_thread_stats(pid)
+            except OSError:
+                processes.append({"pid": pid, "error": "Process exited during sampling"})
+                continue
+            cpu, groups, hottest = thread_groups(pid, first[pid], last, elapsed, top_n)
+            processes.append({
+                "pid": pid,
+                "command": read_cmdline(pid) or next(iter(last.values())).comm,
+                "threads": len(last),
+                "cpu_percent": cpu,
+                "thread_groups": groups,
+                "hottest_threads": hottest
+            })
+        return {"status": "success", "data": {"processes": processes, "window_seconds": round(elapsed, 2)}}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+# Kernel log scanner - classify new kernel messages since the previous run
+# Event classes: name -> (literal keywords, pattern, resource, severity). Lines are first
+# screened for the keywords with plain substring search, and only the few that contain one
+# are matched against the patterns, in order; the first matching class wins.
+KERNEL_LOG_CLASSES = {
+    "oom_kill": (("Kill",), r"(?:Out of memory|Memory cgroup out of memory): Kill(?:ed)? process",
+                 "memory", "critical"),
+    "hung_task": (("blocked for more than",), r"blocked for more than \d+ seconds", "disk", "critical"),
+    "soft_lockup": (("lockup", "LOCKUP"), r"soft lockup - CPU#\d+ stuck|hard LOCKUP", "cpu", "critical"),
+    "rcu_stall": (("rcu",), r"rcu_\w+ (?:self-)?detected stalls?", "cpu", "critical"),
+    "nvme_timeout": (("nvme",), r"nvme\d+n?\d*: I/O .*timeout|nvme\d+: (?:Abort status|resetting controller|"
+                               r"controller is down)", "disk", "critical"),
+    # Case-insensitive: drivers spell it "I/O error", "I/O Error" (nvme) or "I/O ERROR"
+    "io_error": (("I/O error", "I/O Error", "I/O ERROR", "SCSI error", "blk_update_request", "failed command",
+                  "exception Emask"),
+                 r"(?i:I/O error, dev \S+|Buffer I/O error|blk_update_request: .*error|SCSI error|"
+                 r"end_request: I/O error|nvme\d+(?:c\d+)?n\d+(?:p\d+)?: .*I/O error|"
+                 r"ata\d+(?:\.\d+)?: (?:failed command|exception Emask))", "disk", "critical"),
+    "filesystem_error": (("EXT4-fs error", "XFS", "BTRFS", "read-only"),
+                         r"EXT4-fs error|XFS \(\S+\): (?:metadata I/O error|Corruption|Log I/O Error)|"
+                         r"BTRFS (?:error|critical)|Remounting filesystem read-only", "disk", "critical"),
+    "hardware_error": (("Machine check", "Hardware Error", "EDAC"),
+                       r"Machine check|mce: \[Hardware Error\]|EDAC \S+: \d+ (?:CE|UE)", "cpu", "critical"),
+    "thermal_throttling": (("temperature above threshold", "clock throttled"),
+                           r"temperature above threshold|cpu clock throttled", "cpu", "warning"),
+    "network_error": (("NETDEV WATCHDOG", "table full", "TCP: out of memory", "SYN flooding", "Link is Down"),
+                      r"NETDEV WATCHDOG|nf_conntrack: table full|TCP: out of memory|possible SYN flooding|"
+                      r"Link is Down", "network", "warning"),
+    "segfault": (("segfault", "general protection", "traps:"),
+                 r"segfault at|general protection fault|traps: \S+ trap", "processes", "info"),
+}
+KERNEL_LOG_KEYWORDS = tuple({
+    keyword.encode() for keywords, pattern, resource, severity in KERNEL_LOG_CLASSES.values() for keyword in keywords
+})
+KERNEL_LOG_PATTERNS = tuple(
+    (event, re.compile(pattern.encode())) for event, (keywords, pattern, resource, severity) in KERNEL_LOG_CLASSES.items()
+)
+
+class KernelLogScan:
+    """
+    Counts and the most recent examples of each event class. Messages are
+    classified a block at a time and only the last KERNEL_LOG_EXAMPLES
+    messages per class are kept, so memory stays bounded however many
+    lines are scanned.
+    """
+
+    def __init__(self, examples=KERNEL_LOG_EXAMPLES):
+        self.lines = 0
+        self.counts = collections.Counter()
+        self.recent = collections.defaultdict(lambda: collections.deque(maxlen=examples))
+
+    def add_block(self, block, lines, timestamps=None):
+        """
+        Classify a block of `lines` newline-separated messages. `timestamps`,
+        when given, holds the time of each line.
+
+        Keywords are located with bytes.find over the whole block, which runs
+        at memory speed, and only the lines containing one are matched
+        against the patterns.
+        """
+        self.lines += lines
+        candidates = set()
+        for keyword in KERNEL_LOG_KEYWORDS:
+            position = block.find(keyword)
+            while position >= 0:
+                candidates.add(block.rfind(b"\n", 0, position) + 1)
+                end = block.find(b"\n", position)
+                if end < 0:
+                    break
+                position = block.find(keyword, end)
+        for start in sorted(candidates):
+            end = block.find(b"\n", start)
+            message = block[start:end if end >= 0 else len(block)]
+            for event, pattern in KERNEL_LOG_PATTERNS:
+                if pattern.search(message):
+                    break
+            else:
+                continue
+            self.counts[event] += 1
+            example = {"message": message[:KERNEL_LOG_MESSAGE_CHARS].decode(errors="replace").strip()}
+            if timestamps is not None:
+                example["time"] = timestamps[block.count(b"\n", 0, start)]
+            self.recent[event].append(example)
+
+    def events(self):
+        return {
+            event: {
+                "count": count,
+                "resource": KERNEL_LOG_CLASSES[event][2],
+                "severity": KERNEL_LOG_CLASSES[event][3],
+                "recent": list(self.recent[event])
+            }
+            for event, count in self.counts.most_common()
+        }
+
+def load_kernel_log_cursor():
+    """Return the saved position of the previous scan, or {} after a reboot or on the first run."""
+    try:
+        with open(KERNEL_LOG_CURSOR_FILE) as f:
+            cursor = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return cursor if cursor.get("boot_id") == read_boot_id() else {}
+
+def save_kernel_log_cursor(cursor):
+    try:
+        os.makedirs(os.path.dirname(KERNEL_LOG_CURSOR_FILE), exist_ok=True)
+        tmp_file = f"{KERNEL_LOG_CURSOR_FILE}.{os.getpid()}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(dict(cursor, boot_id=read_boot_id()), f)
+        os.replace(tmp_file, KERNEL_LOG_CURSOR_FILE)
+    except OSError:
+        pass  # Without a cursor the next run rescans the whole buffer
+
+def scan_kmsg(scan, after_seq, max_age=None):
+    """
+    Stream /dev/kmsg record by record and add every record newer than
+    `after_seq` (and, with `max_age`, logged in the last `max_age` seconds)
+    to `scan`, in blocks of KERNEL_LOG_BLOCK_RECORDS. Returns the sequence
+    number of the last record read.
+    """
+    # Records carry microseconds since boot; this turns them into wall-clock time
+    uptime = time.clock_gettime(time.CLOCK_MONOTONIC)
+    boot_time = time.time() - uptime
+    after_us = (uptime - max_age) * 1e6 if max_age is not None else -1
+    fd = os.open("/dev/kmsg", os.O_RDONLY | os.O_NONBLOCK)
+    last_seq = after_seq
+    messages, timestamps = [], []
+    try:
+        while True:
+            try:
+                record = os.read(fd, 8192)  # Every read returns exactly one record
+            except BlockingIOError:
+                break  # Reached the end of the buffer
+            except BrokenPipeError:
+                continue  # The record was overwritten while we were reading; carry on with the next one
+            header, _, text = record.partition(b";")
+            fields = header.split(b",", 3)
+            seq = int(fields[1])
+            last_seq = max(last_seq, seq)
+            if seq <= after_seq or int(fields[2]) < after_us:
+                continue
+            # Continuation lines (" KEY=value") carry device metadata, not the message
+            messages.append(text.split(b"\n", 1)[0])
+            timestamps.append(datetime.fromtimestamp(boot_time + int(fields[2]) / 1e6).isoformat(timespec="seconds"))
+            if len(messages) == KERNEL_LOG_BLOCK_RECORDS:
+                scan.add_block(b"\n".join(messages), len(messages), timestamps)
+                messages, timestamps = [], []
+    finally:
+        os.close(fd)
+    if messages:
+        scan.add_block(b"\n".join(messages), len(messages), timestamps)
+    return last_seq
+
+def scan_kernel_log_file(scan, path, cursor):
+    """
+    Stream a saved kernel log file in KERNEL_LOG_BLOCK_BYTES blocks from the
+    byte offset in `cursor`, starting over when the file was rotated or
+    truncated. A partly written last line is left for the next run. Returns
+    the new cursor.
+    """
+    with open(path, "rb") as f:
+        stat = os.fstat(f.fileno())
+        offset = cursor.get("offset", 0) if cursor.get("inode") == stat.st_ino else 0
+        if offset > stat.st_size:
+            offset = 0
+        f.seek(offset)
+        pending = b""
+        while True:
+            chunk = f.read(KERNEL_LOG_BLOCK_BYTES)
+            if not chunk:
+                break
+            data = pending + chunk
+            cut = data.rfind(b"\n") + 1
+            if not cut and len(data) >= KERNEL_LOG_BLOCK_BYTES:
+                cut = len(data)  # A line longer than a block is scanned in pieces
+            scan.add_block(data[:cut], data.count(b"\n", 0, cut))
+            offset += cut
+            pending = data[cut:]
+        return {"inode": stat.st_ino, "offset": offset}
+
+def check_kernel_log(since_last_run=True, examples=KERNEL_LOG_EXAMPLES):
+    """
+    Scan the kernel log for OOM kills, hung tasks, lockups, storage timeouts
+    and errors, hardware errors and network drops.
+
+    /dev/kmsg is read record by record, falling back to a saved kernel log
+    file when it is not readable. With `since_last_run`, only messages newer
+    than the cursor saved by the previous scan are classified, and on the
+    first run only those of the last KERNEL_LOG_FIRST_RUN_SECONDS, so events
+    from long ago are not reported as current; the cursor is always advanced.
+    `recent_only` tells whether every classified message is that recent.
+    """
+    try:
+        cursor = load_kernel_log_cursor()
+        scan = KernelLogScan(examples)
+        source = None
+        try:
+            after_seq = cursor.get("kmsg_seq", -1) if since_last_run else -1
+            first_run = since_last_run and after_seq < 0
+            cursor["kmsg_seq"] = scan_kmsg(scan, after_seq, KERNEL_LOG_FIRST_RUN_SECONDS if first_run else None)
+            source = "/dev/kmsg"
+            if first_run:
+                since = f"last {KERNEL_LOG_FIRST_RUN_SECONDS // 60} minutes"
+            else:
+                since = "previous run" if after_seq >= 0 else "boot"
+        except OSError:
+            for path in KERNEL_LOG_FALLBACK_FILES:
+                previous = cursor.get("files", {}).get(path, {}) if since_last_run else {}
+                try:
+                    cursor.setdefault("files", {})[path] = scan_kernel_log_file(scan, path, previous)
+                except OSError:
+                    continue
+                source = path
+                since = "previous run" if previous else "start of file"
+                break
+        if source is None:
+            return {
+                "status": "error",
+                "message": "Cannot read /dev/kmsg (root is needed when kernel.dmesg_restrict=1) "
+                           f"or any of {list(KERNEL_LOG_FALLBACK_FILES)}"
+            }
+        save_kernel_log_cursor(cursor)
+        return {
+            "status": "success",
+            "data": {
+                "source": source,
+                "since": since,
+                # Saved log files carry no timestamps we parse, so their first scan may reach far back
+                "recent_only": since not in ("boot", "start of file"),
+                "messages_scanned": scan.lines,
+                "events": scan.events()
+            }
+        }
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
@@ -546,6 +2914,10 @@ FUNCTION_MAP = {
     "check_hostnamectl_info": check_hostnamectl_info,
     "check_cpu_info": check_cpu_info,
     "check_network_info": check_network_info,
+    "check_scheduler_latency": check_scheduler_latency,
+    "check_cgroup_usage": check_cgroup_usage,
+    "check_thread_activity": check_thread_activity,
+    "check_kernel_log": check_kernel_log,
 }
 
 # Function definitions - for API calls
@@ -554,13 +2926,13 @@ TOOLS_DEFINITION = [
         "type": "function",
         "function": {
             "name": "check_cpu_usage",
-            "description": "Check CPU usage and load status",
+            "description": "Check CPU usage (per core, including iowait, steal, irq and softirq), load and run queue",
             "parameters": {
                 "type": "object",
                 "properties": {
                     "duration": {
                         "type": "integer",
-                        "description": "Monitoring duration (seconds)",
+                        "description": "Monitoring duration (seconds), shared with the disk and process checks",
                         "default": 5
                     }
                 }
@@ -571,7 +2943,7 @@ TOOLS_DEFINITION = [
         "type": "function",
         "function": {
             "name": "check_memory_usage",
-            "description": "Check memory and Swap usage",
+            "description": "Check memory and Swap usage, page cache, dirty pages, and fault, swap, reclaim, compaction and OOM activity",
             "parameters": {}
         }
     },
@@ -579,7 +2951,7 @@ TOOLS_DEFINITION = [
         "type": "function",
         "function": {
             "name": "check_disk_io",
-            "description": "Check disk IO performance",
+            "description": "Check disk IO performance (IOPS, throughput, await, queue depth, util with min/mean/p95/max)",
             "parameters": {
                 "type": "object",
                 "properties": {
@@ -587,6 +2959,23 @@ TOOLS_DEFINITION = [
                         "type": "string",
                         "description": "Disk device name (e.g., sda)",
                         "default": "all"
+                    },
+                    "include_partitions": {
+                        "type": "boolean",
+                        "description": "Also report partitions as separate devices",
+                        "default": False
+                    },
+                    "rollup": {
+                        "type": "boolean",
+                        "description": "Group partitions and device-mapper devices under their physical disks",
+                        "default": False
+                    },
+                    "interval": {
+                        "type": "number",
+                        "description": "Seconds between disk samples, for finer or coarser percentiles "
+                                       "(default: the shared window's interval; another value samples separately)",
+                        "minimum": DISK_INTERVAL_RANGE[0],
+                        "maximum": DISK_INTERVAL_RANGE[1]
                     }
                 }
             }
@@ -596,7 +2985,7 @@ TOOLS_DEFINITION = [
         "type": "function",
         "function": {
             "name": "check_running_processes",
-            "description": "Check processes with the highest resource consumption",
+            "description": "Check processes with the highest recent CPU, memory and disk I/O consumption",
             "parameters": {
                 "type": "object",
                 "properties": {
@@ -604,6 +2993,12 @@ TOOLS_DEFINITION = [
                         "type": "integer",
                         "description": "Number of processes to display",
                         "default": 5
+                    },
+                    "sort_by": {
+                        "type": "array",
+                        "items": {"type": "string", "enum": ["cpu", "memory", "io"]},
+                        "description": "Resources to rank processes by",
+                        "default": ["cpu", "memory", "io"]
                     }
                 }
             }
@@ -631,82 +3026,1101 @@ TOOLS_DEFINITION = [
         "type": "function",
         "function": {
             "name": "check_network_info",
-            "description": "Check socket usage summary",
+            "description": "Check socket usage, per-interface throughput, drops and errors, and TCP/UDP retransmit and overflow rates",
+            "parameters": {
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "check_scheduler_latency",
+            "description": "Check run-queue wait time per CPU and for the tasks that waited longest, plus runnable and blocked task counts",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "top_n": {
+                        "type": "integer",
+                        "description": "Number of tasks to display",
+                        "default": 5
+                    }
+                }
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "check_cgroup_usage",
+            "description": "Rank cgroups (containers, pods, systemd services and slices) by CPU, CPU throttling, memory, memory limit, I/O and pressure stall time",
             "parameters": {
+                "type": "object",
+                "properties": {
+                    "top_n": {
+                        "type": "integer",
+                        "description": "Number of cgroups to display per ranking",
+                        "default": 5
+                    },
+                    "include_parents": {
+                        "type": "boolean",
+                        "description": "Also rank parent cgroups (slices) by usage, not only the leaves",
+                        "default": False
+                    }
+                }
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "check_thread_activity",
+            "description": "Drill down into the threads of the busiest (or given) processes: CPU%, state, run-queue wait, context switches and wait channel per thread pool, plus the hottest threads",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "pids": {
+                        "type": "array",
+                        "items": {"type": "integer"},
+                        "description": "Processes to inspect; by default the busiest ones by CPU"
+                    },
+                    "top_k": {
+                        "type": "integer",
+                        "description": "Number of busiest processes to inspect when no pids are given",
+                        "default": 3
+                    },
+                    "top_n": {
+                        "type": "integer",
+                        "description": "Number of thread pools to display per process",
+                        "default": 8
+                    },
+                    "duration": {
+                        "type": "number",
+                        "description": "Seconds between the two thread samples",
+                        "default": 1
+                    }
+                }
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "check_kernel_log",
+            "description": "Scan the kernel log for OOM kills, hung tasks, soft lockups, RCU stalls, NVMe timeouts, I/O and filesystem errors, hardware errors and network drops, with counts and recent examples",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "since_last_run": {
+                        "type": "boolean",
+                        "description": "Only report messages newer than the previous scan, or from the last hour on the first scan (false scans everything since boot)",
+                        "default": True
+                    },
+                    "examples": {
+                        "type": "integer",
+                        "description": "Number of recent messages to display per event class",
+                        "default": 3
+                    }
+                }
             }
         }
-    },
+    },
+
+]
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """Return the shared HTTP session, so every API call reuses pooled keep-alive connections."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=API_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {API_KEY}",
+                "Connection": "keep-alive"
+            })
+            _session = session
+    return _session
+
+def read_sse_stream(response, on_token=None):
+    """
+    Assemble a chat completion from a server-sent events stream.
+
+    `on_token(kind, text)` is called for every reasoning or content token as
+    it arrives, with kind set to "reasoning" or "content".
+
+    Returns:
+        tuple: (completion dict shaped like a non-streaming response, time to first token)
+    """
+    started = time.perf_counter()
+    first_token = None
+    message = {"role": "assistant", "content": "", "reasoning_content": ""}
+    tool_calls = {}
+    finish_reason = None
+    usage = None
+
+    for line in response.iter_lines():
+        # Skip keep-alive blank lines and SSE comments
+        if not line or not line.startswith(b"data:"):
+            continue
+        data = line[5:].strip()
+        if data == b"[DONE]":
+            # Keep reading to the end of the body so the connection goes back to the pool
+            continue
+        chunk = json.loads(data)
+        usage = chunk.get("usage") or usage
+        for choice in chunk.get("choices") or []:
+            delta = choice.get("delta") or {}
+            finish_reason = choice.get("finish_reason") or finish_reason
+            for kind, key in (("reasoning", "reasoning_content"), ("content", "content")):
+                text = delta.get(key)
+                if text:
+                    if first_token is None:
+                        first_token = time.perf_counter() - started
+                    message[key] += text
+                    if on_token:
+                        on_token(kind, text)
+            # Tool calls arrive in fragments keyed by index
+            for fragment in delta.get("tool_calls") or []:
+                if first_token is None:
+                    first_token = time.perf_counter() - started
+                call = tool_calls.setdefault(fragment.get("index", len(tool_calls)), {
+                    "id": None,
+                    "type": "function",
+                    "function": {"name": "", "arguments": ""}
+                })
+                call["id"] = fragment.get("id") or call["id"]
+                function = fragment.get("function") or {}
+                call["function"]["name"] += function.get("name") or ""
+                call["function"]["arguments"] += function.get("arguments") or ""
+
+    if tool_calls:
+        message["tool_calls"] = [tool_calls[index] for index in sorted(tool_calls)]
+    completion = {"choices": [{"message": message, "finish_reason": finish_reason}]}
+    if usage:
+        completion["usage"] = usage
+    return completion, first_token
+
+def call_siliconflow_api(messages, tools=None, tool_choice="auto", stream=STREAM_RESPONSES, on_token=None):
+    """
+    Call the SiliconFlow API over the pooled session.
+
+    With `stream`, the completion is read as server-sent events and every
+    token is passed to `on_token(kind, text)` as it arrives. The response
+    carries a "timing" entry with the time to first token and total latency.
+    """
+    payload = {
+        "model": MODEL_NAME,
+        "messages": messages,
+        "tool_choice": tool_choice,
+        "tools": tools if tools else TOOLS_DEFINITION
+    }
+    if stream:
+        payload["stream"] = True
+    
+    with trace_span("api call", "http", tool_choice=tool_choice, stream=stream) as span:
+        started = time.perf_counter()
+        try:
+            with trace_span("serialize request", "serialize") as request_span:
+                body = json.dumps(payload).encode()
+                request_span["bytes"] = len(body)
+            with get_session().post(API_URL, data=body, stream=stream,
+                                    timeout=(API_CONNECT_TIMEOUT, API_TIMEOUT)) as response:
+                first_byte = time.perf_counter()
+                trace_add("time to first byte", "http", started, first_byte, status=response.status_code)
+                response.raise_for_status()
+                if stream:
+                    result, first_token = read_sse_stream(response, on_token)
+                    if first_token is not None:
+                        trace_add("time to first token", "http", first_byte, first_byte + first_token)
+                else:
+                    result = response.json()
+                    first_token = None
+        except Exception as e:
+            span["error"] = str(e)
+            error = {"error": f"API call failed: {str(e)}"}
+            failed = getattr(e, "response", None)
+            if failed is not None:
+                # Lets callers tell rate limiting and server errors apart from bad requests
+                error["status_code"] = failed.status_code
+                retry_after = failed.headers.get("Retry-After", "")
+                if retry_after.isdigit():
+                    error["retry_after"] = int(retry_after)
+            return error
+
+        total = time.perf_counter() - started
+        result["timing"] = {
+            "time_to_first_token_s": round(first_token if first_token is not None else total, 3),
+            "total_s": round(total, 3)
+        }
+        usage = result.get("usage")
+        if usage:
+            span["usage"] = usage
+            if _tracer is not None:
+                _tracer.counter("tokens", prompt=usage.get("prompt_tokens", 0),
+                                completion=usage.get("completion_tokens", 0))
+        return result
+
+def print_api_timing(response):
+    """Print the latency and token usage of an API response."""
+    timing = response.get("timing", {})
+    usage = response.get("usage", {})
+    line = f"⏱️ API latency: first token {timing.get('time_to_first_token_s', 0):.2f}s, total {timing.get('total_s', 0):.2f}s"
+    if usage:
+        line += f", {usage.get('prompt_tokens', 0)} prompt / {usage.get('completion_tokens', 0)} completion tokens"
+    print(line)
+
+class StreamEcho:
+    """
+    Echo streamed tokens to the terminal as they arrive, and to the report.
+
+    One echo serves every round of an analysis. Reasoning goes to the report
+    as it arrives, under a header per round; content is held until its round
+    ends, since only the content of the final round (the one that asks for no
+    more checks) is the report.
+    """
+
+    TITLES = {
+        "reasoning": "🧠 Reasoning:",
+        "content": "💡 Performance Analysis Report:",
+    }
+
+    def __init__(self, report=None):
+        self.report = report
+        self.kind = None        # Kind of the latest token of the current round
+        self.round = 0
+        self.streamed = False   # Whether any token was received at all
+        self.content = []
+        self._written = False
+
+    def start_round(self, number):
+        self.round = number
+        self.kind = None
+        self.content = []
+
+    def __call__(self, kind, text):
+        if kind != self.kind:
+            print("\n" + "="*50)
+            print(self.TITLES[kind])
+            if kind == "reasoning":
+                self._header(f"Reasoning (round {self.round}):")
+            self.kind = kind
+        self.streamed = True
+        print(text, end="", flush=True)
+        if kind == "reasoning":
+            self._write(text)
+        else:
+            self.content.append(text)
+
+    def end_round(self, final):
+        """Close the round on the terminal and write its content: the report when `final`, else a note."""
+        if self.kind is not None:
+            print("\n" + "="*50)
+        if self.content:
+            self._header("Report:" if final else f"Notes (round {self.round}):")
+            self._write("".join(self.content))
+        self.content = []
+
+    def _header(self, title):
+        # A blank line before every section, two lines after the end of the previous one
+        self._write(("\n\n" if self._written else "\n") + title + "\n")
+
+    def _write(self, text):
+        if self.report:
+            self.report.write(text)
+            self.report.flush()
+            self._written = True
+
+def parse_tool_arguments(call):
+    """Safely parse the JSON arguments of a tool call."""
+    func_name = call["function"]["name"]
+    args_str = call["function"].get("arguments")
+    try:
+        if args_str and isinstance(args_str, str):
+            # Attempt to parse, handling potential malformed JSON from the model
+            return json.loads(args_str)
+        return {} # Default to empty dictionary if no arguments or not a string
+    except json.JSONDecodeError as e:
+        print(f"⚠️ Warning: Could not decode arguments for {func_name}. Received: '{args_str}'. Error: {e}")
+        return {}
+    except TypeError as e:
+        print(f"⚠️ Warning: Arguments for {func_name} is not a string or unexpected type. Received: '{args_str}'. Error: {e}")
+        return {}
+
+def tool_call_key(func_name, arguments):
+    """Identify a tool call by function name and arguments normalised with the function's defaults."""
+    func = FUNCTION_MAP.get(func_name)
+    if func is not None:
+        try:
+            bound = inspect.signature(func).bind(**arguments)
+            bound.apply_defaults()
+            arguments = bound.arguments
+        except TypeError:
+            pass  # Invalid arguments are keyed as given and fail when the tool runs
+    return func_name, json.dumps(arguments, sort_keys=True, default=str)
+
+def run_tool(func_name, arguments):
+    """Run a single tool and return (result, elapsed seconds)."""
+    start = time.perf_counter()
+    if func_name not in FUNCTION_MAP:
+        return {"error": f"Unknown function: {func_name}"}, 0.0
+    if _low_impact is not None:
+        reason = _low_impact.check(func_name)
+        if reason:
+            return {"status": "skipped", "message": f"Skipped in low-impact mode: {reason}"}, 0.0
+    try:
+        with trace_span(func_name, "tool", arguments=arguments):
+            if _replay is not None and func_name not in WINDOWED_TOOLS:
+                result = _replay.result(func_name, arguments)
+            else:
+                result = FUNCTION_MAP[func_name](**arguments)
+    except Exception as e:
+        # A bad argument from the model must not take down the whole batch
+        result = {"status": "error", "message": f"{func_name} failed: {str(e)}"}
+    return result, time.perf_counter() - start
+
+def submit_daemon_jobs(jobs, max_workers, name="tool-worker"):
+    """
+    Run (function, args) jobs on at most `max_workers` daemon threads and
+    return one Future per job. Unlike ThreadPoolExecutor workers, a job that
+    hangs past its timeout cannot keep the interpreter from exiting.
+    """
+    futures = [Future() for _ in jobs]
+    queue = collections.deque(zip(futures, jobs))
+
+    def work():
+        while True:
+            try:
+                future, (func, args) = queue.popleft()
+            except IndexError:
+                return
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+    for _ in range(max(1, min(max_workers, len(jobs)))):
+        threading.Thread(target=work, name=name, daemon=True).start()
+    return futures
+
+def _dispatch_tool_calls(calls, results, timings, parallel, max_workers, tool_timeout, batch_timeout, batch_start):
+    """Run parsed tool calls, filling `results` and `timings` in place."""
+    if not parallel or len(calls) <= 1:
+        for i, (call, func_name, arguments) in enumerate(calls):
+            results[i], timings[i] = run_tool(func_name, arguments)
+    else:
+        started = {}
+
+        def worker(i, func_name, arguments):
+            started[i] = time.perf_counter()
+            return run_tool(func_name, arguments)
+
+        futures = submit_daemon_jobs(
+            [(worker, (i, func_name, arguments)) for i, (call, func_name, arguments) in enumerate(calls)],
+            max_workers
+        )
+        pending = {future: i for i, future in enumerate(futures)}
+        batch_deadline = batch_start + batch_timeout
+        try:
+            while pending:
+                now = time.perf_counter()
+                if now >= batch_deadline:
+                    break
+
+                # Wake up at the nearest per-tool or batch deadline
+                deadlines = [started[i] + tool_timeout for i in pending.values() if i in started]
+                wait_for = min(deadlines + [batch_deadline]) - now
+                done, _ = wait(pending, timeout=max(wait_for, 0), return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = pending.pop(future)
+                    results[i], timings[i] = future.result()
+
+                # Expire tools that have exceeded their own timeout
+                now = time.perf_counter()
+                for future, i in list(pending.items()):
+                    if i in started and now - started[i] >= tool_timeout:
+                        del pending[future]
+                        future.cancel()
+                        results[i] = {"status": "error", "message": f"Tool timed out after {tool_timeout}s"}
+                        timings[i] = now - started[i]
+        finally:
+            # Anything left over did not finish within the batch timeout
+            now = time.perf_counter()
+            for future, i in pending.items():
+                future.cancel()
+                results[i] = {"status": "error", "message": f"Batch timed out after {batch_timeout}s"}
+                timings[i] = now - started.get(i, now)
+
+def collect_tool_results(tool_calls, prefetched=None, parallel=PARALLEL_TOOL_CALLS, max_workers=TOOL_MAX_WORKERS,
+                         tool_timeout=TOOL_TIMEOUT, batch_timeout=BATCH_TIMEOUT, verbose=True):
+    """
+    Execute tool calls and return a list of (call, function name, arguments, result).
+
+    In parallel mode every call is submitted to a bounded thread pool, so the
+    total collection time is close to the slowest collector rather than the
+    sum of all of them. A tool that runs longer than `tool_timeout`, or is
+    still pending when `batch_timeout` expires, is reported as an error.
+    Calls whose key is in `prefetched` reuse that result instead of running.
+    Results are always returned in the order of `tool_calls`. When recording,
+    the raw data of the calls that actually ran is appended to the snapshot.
+    """
+    batch_start = time.perf_counter()
+    prefetched = prefetched or {}
+    if _low_impact is not None:
+        max_workers = min(max_workers, LOW_IMPACT_MAX_WORKERS)
+    calls = [(call, call["function"]["name"], parse_tool_arguments(call)) for call in tool_calls]
+    results = [None] * len(calls)
+    timings = [None] * len(calls)
+
+    pending = []
+    for i, (call, func_name, arguments) in enumerate(calls):
+        key = tool_call_key(func_name, arguments)
+        if key in prefetched:
+            results[i] = prefetched[key]
+        elif _low_impact is not None and func_name in FUNCTION_MAP and _low_impact.check(func_name):
+            # Decided before the window is opened, so a skipped tool does not get its sources sampled
+            reason = _low_impact.skipped[func_name]
+            results[i] = {"status": "skipped", "message": f"Skipped in low-impact mode: {reason}"}
+            timings[i] = 0.0
+        else:
+            pending.append(i)
+
+    if pending:
+        todo = [calls[i] for i in pending]
+        todo_results = [None] * len(todo)
+        todo_timings = [None] * len(todo)
+        # One sampling window serves every time-based collector in the batch
+        window = open_shared_window([(func_name, arguments) for call, func_name, arguments in todo])
+        try:
+            with trace_span("tool batch", "stage", tools=[func_name for call, func_name, arguments in todo]):
+                _dispatch_tool_calls(todo, todo_results, todo_timings, parallel, max_workers,
+                                     tool_timeout, batch_timeout, batch_start)
+        finally:
+            close_shared_window()
+        if _recorder is not None:
+            _recorder.record(window, todo, todo_results, todo_timings)
+        for i, result, elapsed in zip(pending, todo_results, todo_timings):
+            results[i], timings[i] = result, elapsed
+
+    # Report the time spent in each tool
+    if verbose:
+        for (call, func_name, arguments), elapsed in zip(calls, timings):
+            if elapsed is None:
+                print(f"  ⏱️ {func_name}: reused")
+            else:
+                print(f"  ⏱️ {func_name}: {elapsed:.2f}s")
+        print(f"  ⏱️ Total collection time: {time.perf_counter() - batch_start:.2f}s")
+
+    return [(call, func_name, arguments, result) for (call, func_name, arguments), result in zip(calls, results)]
+
+# Tool result compaction - keeps the prompt of the analysis call under a token budget
+COMPACTION_LEVELS = 4       # 0 = drop noise only ... 3 = most aggressive
+NOTABLE_CORE_BUSY = 50.0    # Cores below these thresholds are collapsed into one aggregate
+NOTABLE_CORE_WAIT = 10.0
+DROPPED_KEYS = ("debug",)
+# hostnamectl fields that only identify the machine and do not help a diagnosis
+HOSTNAMECTL_NOISE = ("ID", "UUID", "URL", "Serial", "Icon")
+
+def estimate_tokens(text):
+    """Roughly estimate the number of tokens in a piece of text."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def compact_value(value, level):
+    """Drop debug and empty fields, round floats and, at higher levels, truncate long lists."""
+    if isinstance(value, dict):
+        return {
+            key: compact_value(item, level)
+            for key, item in value.items()
+            if key not in DROPPED_KEYS and item is not None and item != ""
+        }
+    if isinstance(value, list):
+        limit = {2: 5, 3: 3}.get(level)
+        if limit and len(value) > limit + 1 and isinstance(value[0], dict):
+            return [compact_value(item, level) for item in value[:limit]] + [{"omitted": len(value) - limit}]
+        return [compact_value(item, level) for item in value]
+    if isinstance(value, float):
+        return round(value, 2 if level == 0 else 1)
+    return value
+
+def drop_zeros(row, keep=("device", "interface", "cpu")):
+    """Remove zero-valued metrics from a row; their absence means zero."""
+    return {key: value for key, value in row.items() if key in keep or value not in (0, 0.0)}
+
+def compact_cpu_info(data, level):
+    """Flatten the lscpu -J tree into field/value pairs without the CPU flags."""
+    flat = {}
+
+    def walk(entries):
+        for entry in entries:
+            field = entry.get("field", "").rstrip(":")
+            if field != "Flags" and not (level >= 1 and field.startswith("Vulnerability")):
+                flat[field] = entry.get("data")
+            walk(entry.get("children", []))
+
+    walk(data.get("lscpu", []))
+    return flat
+
+def compact_hostnamectl_info(data, level):
+    return {key: value for key, value in data.items() if not key.endswith(HOSTNAMECTL_NOISE)}
+
+def compact_cpu_usage(data, level):
+    """Keep busy or waiting cores and collapse the rest into one aggregate."""
+    data = dict(data)
+    per_core = data.pop("per_core", [])
+    notable = [
+        core for core in per_core
+        if core["busy"] >= NOTABLE_CORE_BUSY or max(core["iowait"], core["steal"], core["softirq"]) >= NOTABLE_CORE_WAIT
+    ]
+    notable.sort(key=lambda core: core["busy"], reverse=True)
+    if level >= 1:
+        notable = notable[:8]
+    kept = {core["cpu"] for core in notable}
+    rest = [core["busy"] for core in per_core if core["cpu"] not in kept]
+    if level < 3:
+        data["notable_cores"] = [drop_zeros(core) for core in notable]
+    if rest:
+        data["other_cores"] = {
+            "count": len(rest),
+            "busy_mean": sum(rest) / len(rest),
+            "busy_max": max(rest)
+        }
+    return data
 
-]
+def compact_scheduler_latency(data, level):
+    """Keep the CPUs with long run-queue waits and collapse the rest into one aggregate."""
+    data = dict(data)
+    per_cpu = data.pop("per_cpu", [])
+    notable = sorted((cpu for cpu in per_cpu if cpu["wait_ms/s"] >= NOTABLE_CPU_WAIT),
+                     key=lambda cpu: cpu["wait_ms/s"], reverse=True)
+    if level >= 1:
+        notable = notable[:8]
+    kept = {cpu["cpu"] for cpu in notable}
+    rest = [cpu["wait_ms/s"] for cpu in per_cpu if cpu["cpu"] not in kept]
+    if level < 3:
+        data["notable_cpus"] = notable
+    if rest:
+        data["other_cpus"] = {"count": len(rest), "wait_ms/s_mean": sum(rest) / len(rest), "wait_ms/s_max": max(rest)}
+    return data
+
+def compact_disk_io(data, level):
+    """Collapse idle devices into a list of names and trim per-sample statistics."""
+    data = dict(data)
+    devices = data.get("devices", [])
+    active = [row for row in devices if row.get("iops") or row.get("%util")]
+    idle = [row["device"] for row in devices if not (row.get("iops") or row.get("%util"))]
+    active.sort(key=lambda row: row.get("%util", 0), reverse=True)
+    devices = []
+    for rank, row in enumerate(active):
+        row = dict(row)
+        stats = row.pop("stats", None)
+        if stats and (level == 0 or (level < 3 and rank < 5)):
+            row["stats"] = stats
+        devices.append(drop_zeros(row))
+    data["devices"] = devices
+    if idle:
+        data["idle_devices"] = idle if level < 2 else len(idle)
+    return data
+
+def compact_network_info(data, level):
+    """Collapse idle interfaces and omit zero protocol rates."""
+    data = dict(data)
+    interfaces = data.get("interfaces", [])
+    active = [drop_zeros(row) for row in interfaces if any(v for k, v in row.items() if k != "interface")]
+    idle = [row["interface"] for row in interfaces if len(drop_zeros(row)) == 1]
+    data["interfaces"] = active
+    if idle:
+        data["idle_interfaces"] = idle
+    data["protocols"] = {table: drop_zeros(rates) for table, rates in data.get("protocols", {}).items()}
+    return data
+
+COMPACTORS = {
+    "check_cpu_info": compact_cpu_info,
+    "check_hostnamectl_info": compact_hostnamectl_info,
+    "check_cpu_usage": compact_cpu_usage,
+    "check_disk_io": compact_disk_io,
+    "check_network_info": compact_network_info,
+    "check_scheduler_latency": compact_scheduler_latency,
+}
+
+def compact_result(func_name, result, level):
+    """Compact one tool result at the given level without modifying the original."""
+    if isinstance(result, dict) and result.get("status") == "success" and func_name in COMPACTORS:
+        try:
+            result = dict(result, data=COMPACTORS[func_name](result["data"], level))
+        except (KeyError, TypeError, AttributeError):
+            pass  # Unexpected shape, fall back to the generic compaction
+    return compact_value(result, level)
+
+def compact_tool_results(collected, token_budget=TOKEN_BUDGET, verbose=True):
+    """
+    Serialise collected tool results as compact JSON under `token_budget`.
+
+    Each level is tried in turn until the results fit; the number of tokens
+    saved compared to the plain json.dumps output is reported.
+
+    Returns:
+        list: One JSON string per entry of `collected`.
+    """
+    original = sum(estimate_tokens(json.dumps(result)) for call, func_name, arguments, result in collected)
+    for level in range(COMPACTION_LEVELS):
+        contents = [
+            json.dumps(compact_result(func_name, result, level), separators=(",", ":"))
+            for call, func_name, arguments, result in collected
+        ]
+        used = sum(estimate_tokens(content) for content in contents)
+        if used <= token_budget:
+            break
+    if verbose:
+        print(f"🗜️ Tool results compacted: ~{original} -> ~{used} tokens (saved ~{original - used}, level {level})")
+        if used > token_budget:
+            print(f"⚠️ Warning: Tool results still exceed the budget of {token_budget} tokens.")
+    return contents
+
+# Local pre-triage - deterministic USE-method rules over the collected results
+TRIAGE_SEVERITY = {"critical": 3, "warning": 2, "info": 1}
+TRIAGE_RULES = collections.defaultdict(list)  # tool name -> rules that read its data
 
-def call_siliconflow_api(messages, tools=None, tool_choice="auto"):
-    """Call the SiliconFlow API"""
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {API_KEY}"
+def triage_rule(func_name):
+    """Register a rule that inspects the data returned by one tool."""
+    def register(rule):
+        TRIAGE_RULES[func_name].append(rule)
+        return rule
+    return register
+
+def finding(rule, resource, kind, severity, value, threshold, summary, conclusive=False, **evidence):
+    """
+    Build one finding. `kind` is the USE-method category (utilization,
+    saturation or errors); the score ranks findings by severity first, then
+    conclusive causes before symptoms, then by how far `value` is past
+    `threshold`.
+    """
+    excess = min(value / threshold, 10.0) if threshold else 1.0
+    return {
+        "rule": rule,
+        "resource": resource,
+        "kind": kind,
+        "severity": severity,
+        "score": round(TRIAGE_SEVERITY[severity] * 100 + conclusive * 50 + excess, 2),
+        "summary": summary,
+        "conclusive": conclusive,
+        "evidence": evidence
     }
-    
-    payload = {
-        "model": MODEL_NAME,
-        "messages": messages,
-        "tool_choice": tool_choice,
-        "tools": tools if tools else TOOLS_DEFINITION
+
+def graded(value, warning, critical):
+    """Return the severity of a value against warning and critical thresholds, or None."""
+    if value >= critical:
+        return "critical"
+    if value >= warning:
+        return "warning"
+    return None
+
+@triage_rule("check_cpu_usage")
+def triage_cpu(data, results):
+    cpus = data.get("cpu_count") or 1
+    severity = graded(data["busy"], 80, 95)
+    if severity:
+        yield finding("cpu_utilization", "cpu", "utilization", severity, data["busy"], 80,
+                      f"CPUs are {data['busy']}% busy (user {data['user']}%, system {data['system']}%)",
+                      busy=data["busy"])
+    queue_per_cpu = data["run_queue"]["mean"] / cpus
+    severity = graded(queue_per_cpu, 1.0, 2.0)
+    if severity:
+        yield finding("cpu_saturation", "cpu", "saturation", severity, queue_per_cpu, 1.0,
+                      f"{data['run_queue']['mean']} runnable tasks on average for {cpus} CPUs",
+                      run_queue=data["run_queue"], load_1min=data["load_1min"])
+    if data["saturated_cores"] and data["busy"] < 50:
+        yield finding("single_core_saturation", "cpu", "saturation", "warning", len(data["saturated_cores"]), 1,
+                      f"CPUs {data['saturated_cores']} are saturated while the average is only {data['busy']}% busy, "
+                      "which points at a single-threaded bottleneck or interrupt affinity",
+                      saturated_cores=data["saturated_cores"])
+    severity = graded(data["iowait"], 20, 40)
+    if severity:
+        yield finding("cpu_iowait", "cpu", "saturation", severity, data["iowait"], 20,
+                      f"{data['iowait']}% of CPU time is spent waiting for I/O", iowait=data["iowait"])
+    severity = graded(data["steal"], 10, 25)
+    if severity:
+        yield finding("cpu_steal", "cpu", "saturation", severity, data["steal"], 10,
+                      f"{data['steal']}% of CPU time is stolen by the hypervisor (noisy neighbour or undersized VM)",
+                      conclusive=severity == "critical", steal=data["steal"])
+    severity = graded(data["softirq"], 15, 30)
+    if severity:
+        yield finding("cpu_softirq", "cpu", "utilization", severity, data["softirq"], 15,
+                      f"{data['softirq']}% of CPU time is spent in softirqs (network or block interrupts)",
+                      softirq=data["softirq"])
+
+@triage_rule("check_scheduler_latency")
+def triage_scheduler(data, results):
+    cpus = results.get("check_cpu_usage", {}).get("cpu_count") or os.cpu_count() or 1
+    runqueue = data.get("runqueue")
+    if runqueue:
+        severity = graded(runqueue["avg_wait_ms"], 5, 20)
+        if severity:
+            yield finding("runqueue_latency", "cpu", "saturation", severity, runqueue["avg_wait_ms"], 5,
+                          f"Runnable tasks wait {runqueue['avg_wait_ms']} ms for a CPU per timeslice "
+                          f"({runqueue['wait_ms/s']} ms/s of waiting in total)",
+                          avg_wait_ms=runqueue["avg_wait_ms"], wait_ms_per_s=runqueue["wait_ms/s"])
+    blocked = data.get("procs_blocked", {}).get("mean", 0)
+    if blocked >= max(1, cpus / 4):
+        yield finding("blocked_tasks", "disk", "saturation", "warning", blocked, max(1, cpus / 4),
+                      f"{blocked} tasks are blocked in uninterruptible sleep on average (usually waiting for I/O)",
+                      procs_blocked=data["procs_blocked"])
+
+@triage_rule("check_cgroup_usage")
+def triage_cgroups(data, results):
+    for row in data.get("top_throttling", [])[:3]:
+        severity = graded(row["throttled_periods_pct"], 25, 50)
+        if severity:
+            yield finding("cgroup_throttling", "cpu", "saturation", severity, row["throttled_periods_pct"], 25,
+                          f"{row['cgroup']} was throttled by its cpu.max limit in {row['throttled_periods_pct']}% "
+                          f"of its periods ({row['throttled_ms/s']} ms/s)",
+                          conclusive=severity == "critical", cgroup=row["cgroup"],
+                          throttled_ms_per_s=row["throttled_ms/s"])
+    for row in data.get("oom_killed_cgroups", []):
+        yield finding("cgroup_oom_kill", "memory", "errors", "critical", row["oom_kills"], 1,
+                      f"The OOM killer ran {row['oom_kills']} time(s) in {row['cgroup']} at its memory limit",
+                      conclusive=True, cgroup=row["cgroup"], oom_kills=row["oom_kills"])
+    for row in data.get("top_memory_limit", [])[:3]:
+        if row["memory_max_events"] and not row["oom_kills"]:
+            yield finding("cgroup_memory_limit", "memory", "saturation", "warning", row["memory_limit_pct"], 90,
+                          f"{row['cgroup']} hit its memory.max {row['memory_max_events']} time(s) "
+                          f"({row['memory_mb']} of {row['memory_max_mb']} MB) and is reclaiming to stay under it",
+                          cgroup=row["cgroup"], memory_max_events=row["memory_max_events"])
+
+@triage_rule("check_kernel_log")
+def triage_kernel_log(data, results):
+    for event, info in data["events"].items():
+        if info["severity"] == "info":
+            continue
+        latest = info["recent"][-1]["message"] if info["recent"] else ""
+        since = f"in the {data['since']}" if data["since"].startswith("last") else f"since the {data['since']}"
+        # Events from long before the run are history, not necessarily the cause of the current problem
+        yield finding(f"kernel_{event}", info["resource"], "errors", info["severity"], info["count"], 1,
+                      f"The kernel logged {info['count']} {event.replace('_', ' ')} event(s) {since}, "
+                      f"latest: {latest}",
+                      conclusive=info["severity"] == "critical" and data.get("recent_only", False),
+                      count=info["count"])
+
+@triage_rule("check_memory_usage")
+def triage_memory(data, results):
+    available = 100.0 * data["available_mb"] / (data["total_mb"] or 1)
+    severity = graded(100 - available, 90, 95)
+    if severity:
+        yield finding("memory_utilization", "memory", "utilization", severity, 100 - available, 90,
+                      f"Only {data['available_mb']} MB of {data['total_mb']} MB memory is available",
+                      available_mb=data["available_mb"], total_mb=data["total_mb"])
+    swapping = data["swap_in_pages/s"] + data["swap_out_pages/s"]
+    if swapping:
+        # A trickle of under 1 page/s is still worth a line
+        severity = graded(swapping, 1, 100) or "info"
+        yield finding("swapping", "memory", "saturation", severity, swapping, 1,
+                      f"The system is swapping {swapping} pages/s with {data['swap_used_mb']} MB of swap in use",
+                      conclusive=severity == "critical", swap_used_mb=data["swap_used_mb"],
+                      swap_in=data["swap_in_pages/s"], swap_out=data["swap_out_pages/s"])
+    elif data["swap_used_mb"]:
+        yield finding("swap_in_use", "memory", "utilization", "info", data["swap_used_mb"], 1,
+                      f"{data['swap_used_mb']} MB of swap is in use but nothing is swapping right now",
+                      swap_used_mb=data["swap_used_mb"])
+    if data["direct_reclaim_stalls/s"] or data["direct_scan_pages/s"]:
+        yield finding("direct_reclaim", "memory", "saturation", "warning", data["direct_scan_pages/s"] or 1, 1,
+                      "Allocations are stalling in direct reclaim",
+                      stalls=data["direct_reclaim_stalls/s"], scanned=data["direct_scan_pages/s"])
+    severity = graded(data["major_faults/s"], 100, 1000)
+    if severity:
+        yield finding("major_faults", "memory", "saturation", severity, data["major_faults/s"], 100,
+                      f"{data['major_faults/s']} major page faults/s are hitting the disk",
+                      major_faults=data["major_faults/s"])
+    if data["oom_kills"]:
+        yield finding("oom_kill", "memory", "errors", "critical", data["oom_kills"], 1,
+                      f"The OOM killer ran {data['oom_kills']} time(s) during the window",
+                      conclusive=True, oom_kills=data["oom_kills"])
+
+@triage_rule("check_disk_io")
+def triage_disk(data, results):
+    for device in data["devices"]:
+        name = device["device"]
+        severity = graded(device["%util"], 70, 90)
+        if severity:
+            # %util alone overstates how busy devices that serve requests in parallel are
+            conclusive = device["%util"] >= 95 and device["await"] >= 50
+            yield finding("disk_utilization", f"disk {name}", "utilization", severity, device["%util"], 70,
+                          f"{name} is {device['%util']}% busy at {device['iops']} IOPS with {device['await']} ms await",
+                          conclusive=conclusive, util=device["%util"], iops=device["iops"], await_ms=device["await"])
+        severity = graded(device["await"], 50, 200)
+        if severity:
+            yield finding("disk_latency", f"disk {name}", "saturation", severity, device["await"], 50,
+                          f"{name} requests take {device['await']} ms on average "
+                          f"(read {device['r_await']} ms, write {device['w_await']} ms)",
+                          await_ms=device["await"], queue=device["aqu-sz"])
+        severity = graded(device["aqu-sz"], 4, 32)
+        if severity:
+            yield finding("disk_queue", f"disk {name}", "saturation", severity, device["aqu-sz"], 4,
+                          f"{name} has {device['aqu-sz']} requests queued on average", queue=device["aqu-sz"])
+
+@triage_rule("check_running_processes")
+def triage_processes(data, results):
+    cpu_data = results.get("check_cpu_usage", {})
+    capacity = 100.0 * (cpu_data.get("cpu_count") or os.cpu_count() or 1)
+    for process in data.get("top_cpu", [])[:1]:
+        if process["cpu"] >= 100 and process["cpu"] >= capacity * 0.5:
+            yield finding("process_cpu_hog", "process", "utilization", "critical", process["cpu"], capacity * 0.5,
+                          f"{process['command']} (PID {process['pid']}) uses {process['cpu']}% CPU, "
+                          f"{round(100 * process['cpu'] / capacity)}% of the machine",
+                          conclusive=True, pid=process["pid"], command=process["command"], cpu=process["cpu"])
+        elif process["cpu"] >= 90:
+            yield finding("process_cpu_busy", "process", "utilization", "warning", process["cpu"], 90,
+                          f"{process['command']} (PID {process['pid']}) keeps {process['cpu'] / 100:.1f} CPUs busy",
+                          pid=process["pid"], command=process["command"], cpu=process["cpu"])
+    for process in data.get("top_memory", [])[:1]:
+        severity = graded(process["mem"], 50, 80)
+        if severity:
+            yield finding("process_memory_hog", "process", "utilization", severity, process["mem"], 50,
+                          f"{process['command']} (PID {process['pid']}) holds {process['mem']}% of memory "
+                          f"({process['rss_mb']} MB)",
+                          pid=process["pid"], command=process["command"], mem=process["mem"])
+
+@triage_rule("check_network_info")
+def triage_network(data, results):
+    tcp = data["protocols"].get("Tcp", {})
+    ext = data["protocols"].get("TcpExt", {})
+    severity = graded(tcp.get("retransmit_ratio", 0), 2, 10)
+    if severity:
+        yield finding("tcp_retransmits", "network", "errors", severity, tcp["retransmit_ratio"], 2,
+                      f"{tcp['retransmit_ratio']}% of TCP segments are retransmitted",
+                      retransmit_ratio=tcp["retransmit_ratio"])
+    overflows = ext.get("ListenOverflows/s", 0) + ext.get("ListenDrops/s", 0)
+    if overflows:
+        yield finding("listen_overflows", "network", "saturation", "warning", overflows, 1,
+                      f"{overflows} connections/s are dropped because accept queues are full",
+                      listen_overflows=ext.get("ListenOverflows/s", 0), listen_drops=ext.get("ListenDrops/s", 0))
+    if ext.get("TCPAbortOnMemory/s") or ext.get("PruneCalled/s"):
+        yield finding("tcp_memory_pressure", "network", "saturation", "warning", 1, 1,
+                      "The TCP stack is under memory pressure (aborted connections or pruned queues)",
+                      abort_on_memory=ext.get("TCPAbortOnMemory/s", 0), prune_called=ext.get("PruneCalled/s", 0))
+    for interface in data["interfaces"]:
+        errors = sum(interface.get(key, 0) for key in ("rx_errors", "tx_errors", "rx_drops", "tx_drops"))
+        if errors:
+            yield finding("interface_errors", f"interface {interface['interface']}", "errors", "warning", errors, 1,
+                          f"{interface['interface']} drops or errors {errors} packets/s",
+                          **{key: interface.get(key, 0) for key in ("rx_errors", "tx_errors", "rx_drops", "tx_drops")})
+
+def triage_results(results):
+    """
+    Run every rule over successful tool results and return the findings,
+    ranked most severe first.
+
+    Args:
+        results: iterable of (function name, result) pairs
+    """
+    data = {
+        func_name: result["data"] for func_name, result in results
+        if isinstance(result, dict) and result.get("status") == "success"
     }
-    
-    try:
-        response = requests.post(
-            API_URL,
-            headers=headers,
-            data=json.dumps(payload),
-            timeout=600
-        )
-        response.raise_for_status()
-        return response.json()
-    except Exception as e:
-        return {"error": f"API call failed: {str(e)}"}
+    findings = []
+    for func_name, rules in TRIAGE_RULES.items():
+        if func_name not in data:
+            continue
+        for rule in rules:
+            try:
+                # Rules are generators: keep what a failing rule found before it failed
+                for item in rule(data[func_name], data):
+                    findings.append(item)
+            except (KeyError, TypeError, ZeroDivisionError) as e:
+                print(f"⚠️ Warning: Triage rule {rule.__name__} failed on {func_name} data: {type(e).__name__}: {e}")
+    findings.sort(key=lambda item: item["score"], reverse=True)
+    return findings
 
-def execute_tool_calls(tool_calls):
-    """Execute tool calls and return results."""
-    tool_responses = []
-    
-    for call in tool_calls:
-        func_name = call["function"]["name"]
-        
-        # Safely parse arguments
-        try:
-            args_str = call["function"].get("arguments")
-            if args_str and isinstance(args_str, str):
-                # Attempt to parse, handling potential malformed JSON from the model
-                arguments = json.loads(args_str)
-            else:
-                arguments = {} # Default to empty dictionary if no arguments or not a string
-        except json.JSONDecodeError as e:
-            print(f"⚠️ Warning: Could not decode arguments for {func_name}. Received: '{args_str}'. Error: {e}")
-            arguments = {} # Default to empty dictionary
-        except TypeError as e:
-            print(f"⚠️ Warning: Arguments for {func_name} is not a string or unexpected type. Received: '{args_str}'. Error: {e}")
-            arguments = {} # Default to empty dictionary
-
-
-        if func_name in FUNCTION_MAP:
-            # Execute the function
-            result = FUNCTION_MAP[func_name](**arguments)
-            tool_responses.append({
-                "role": "tool",
-                "content": json.dumps(result),
-                "tool_call_id": call["id"]
-            })
+def is_conclusive(findings):
+    """
+    A run is conclusive when its top-ranked finding is a critical, conclusive
+    one and no conclusive finding points at a different resource.
+    """
+    causes = {item["resource"] for item in findings if item["conclusive"] and item["severity"] == "critical"}
+    return bool(findings) and findings[0]["severity"] == "critical" and findings[0]["conclusive"] and len(causes) == 1
+
+def format_findings(findings):
+    """Render findings as a Markdown list for the terminal and the report."""
+    if not findings:
+        return "No rule-based findings: nothing crossed a local threshold."
+    lines = []
+    for i, item in enumerate(findings, 1):
+        marker = " (conclusive)" if item["conclusive"] else ""
+        lines.append(f"{i}. **{item['severity']}** {item['resource']} {item['kind']}: {item['summary']}{marker}")
+    return "\n".join(lines)
+
+def triage_message(findings):
+    """Build the prompt message that hands the findings to the model."""
+    ranked = [
+        {key: item[key] for key in ("severity", "resource", "kind", "summary", "conclusive")}
+        for item in findings
+    ]
+    return {
+        "role": "user",
+        "content": "A local rule engine (USE method: utilization, saturation, errors) ranked these findings "
+                   "from the tool results above. Verify them against the data, explain the root cause and the "
+                   "fixes, and keep the report short without restating metrics the findings already cover:\n"
+                   + json.dumps(ranked, ensure_ascii=False, separators=(",", ":"))
+    }
+
+def execute_tool_calls(tool_calls, prefetched=None, token_budget=None, memo=None, **options):
+    """
+    Execute tool calls and return results as tool messages.
+
+    With `memo` (a ToolMemo), fresh results from earlier calls are reused and
+    new results are remembered. With `token_budget`, the results are
+    compacted to fit it before they are serialised; otherwise each result is
+    sent as plain JSON.
+    """
+    if memo is not None:
+        prefetched = {**memo.fresh(), **(prefetched or {})}
+    collected = collect_tool_results(tool_calls, prefetched, **options)
+    if memo is not None:
+        memo.store(collected)
+    with trace_span("serialize tool results", "serialize") as span:
+        if token_budget:
+            contents = compact_tool_results(collected, token_budget)
         else:
-            tool_responses.append({
-                "role": "tool",
-                "content": json.dumps({"error": f"Unknown function: {func_name}"}),
-                "tool_call_id": call["id"]
-            })
-    
-    return tool_responses
+            contents = [json.dumps(result) for call, func_name, arguments, result in collected]
+        span["tokens"] = sum(estimate_tokens(content) for content in contents)
+    return [
+        {
+            "role": "tool",
+            "content": content,
+            "tool_call_id": call["id"]
+        }
+        for (call, func_name, arguments, result), content in zip(collected, contents)
+    ]
+
+class ToolMemo:
+    """
+    Memoize tool results within one diagnosis session.
+
+    Results are keyed like tool_call_key(), by function name and normalised
+    arguments, and stay fresh for the TTL configured for that function, so a
+    model repeating a request does not re-run the collector.
+    """
+
+    def __init__(self, ttls=None, default_ttl=DEFAULT_TOOL_RESULT_TTL):
+        self.ttls = TOOL_RESULT_TTL if ttls is None else ttls
+        self.default_ttl = default_ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def fresh(self):
+        """Return the results that are still fresh, ready to be passed as `prefetched`."""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                key: result
+                for key, (result, stored_at) in self._entries.items()
+                if now - stored_at < self.ttls.get(key[0], self.default_ttl)
+            }
+
+    def store(self, collected):
+        """Remember the successful results of a collect_tool_results() batch."""
+        now = time.monotonic()
+        with self._lock:
+            for call, func_name, arguments, result in collected:
+                if isinstance(result, dict) and result.get("status") == "success":
+                    key = tool_call_key(func_name, arguments)
+                    # A result served from the memo keeps its original timestamp
+                    if self._entries.get(key, (None, 0))[0] is not result:
+                        self._entries[key] = (result, now)
+
+def start_speculative_collection(tool_calls):
+    """
+    Start collecting `tool_calls` in the background.
+
+    Returns a Future whose result maps tool_call_key() to the tool result,
+    ready to be passed to execute_tool_calls() as `prefetched`.
+    """
+    def collect():
+        return {
+            tool_call_key(func_name, arguments): result
+            for call, func_name, arguments, result in collect_tool_results(tool_calls)
+        }
+
+    return submit_daemon_jobs([(collect, ())], 1, name="speculative")[0]
+
+def merge_tool_calls(requested, known):
+    """
+    Combine the tool calls the model requested with the known diagnostics.
+
+    The model's own calls come first and keep their ids; known calls that the
+    model did not ask for are appended so their results are not wasted.
+    """
+    requested = list(requested or [])
+    keys = {tool_call_key(call["function"]["name"], parse_tool_arguments(call)) for call in requested}
+    return requested + [
+        call for call in known
+        if tool_call_key(call["function"]["name"], parse_tool_arguments(call)) not in keys
+    ]
+
+def print_tool_calls(tool_calls):
+    """Print the checks requested by the model."""
+    print("⚙️ The large model requested the following performance checks:")
+    for call in tool_calls:
+        func = call["function"]
+        # Print arguments in a more readable way
+        arg_str = func.get('arguments', 'no arguments')
+        print(f"  - {func['name']}({arg_str})")
+
+def run_triage(prefetched):
+    """Triage the speculatively collected results and print the ranked findings."""
+    with trace_span("local triage", "triage") as span:
+        findings = triage_results((key[0], result) for key, result in prefetched.items())
+        span["findings"] = len(findings)
+    print(f"🩺 Local pre-triage: {len(findings)} finding(s)")
+    if findings:
+        print(format_findings(findings))
+    return findings
+
+def write_triage_report(findings, report_file):
+    """Save a report made only of local findings, for runs that skip the model."""
+    with open(report_file, "w") as f:
+        f.write("Linux Performance Analysis Report\n\n")
+        f.write(f"Time: {datetime.now()}\n")
+        f.write("Author: local pre-triage (the large model was not called)\n\n")
+        f.write("## Local Pre-triage\n\n" + format_findings(findings) + "\n")
+    print("✅ The top finding is conclusive, the large model was not called.")
+    print(f"\n📝 Report saved to: {report_file}")
 
 def analyze_performance():
-    """Main analysis function."""
+    """
+    Main analysis function.
+
+    Runs an agent loop: the model may request more checks over several
+    rounds, bounded by MAX_AGENT_ROUNDS and MAX_AGENT_SECONDS. Tool results
+    are memoized for the session, so repeated requests do not re-run
+    collectors while their results are still fresh. Every stage is traced
+    and the trace is saved next to the report, also when the run fails, so
+    a timed-out or rejected request shows where the time went.
+    """
+    global _tracer
+    _tracer = Tracer()
+    report_base = f"performance_report_{datetime.now():%Y%m%d_%H%M%S}"
+    try:
+        _analyze_performance(report_base)
+    finally:
+        if TRACE_EXPORT:
+            trace_add("diagnosis", "stage", _tracer.origin, time.perf_counter())
+            trace_file = report_base + ".trace.json"
+            _tracer.export(trace_file)
+            print(f"🧭 Timing trace saved to: {trace_file} (open in ui.perfetto.dev or chrome://tracing)")
+        _tracer = None
+
+def print_trace_summary():
+    """Print the timing table of a run that ended without a report to append it to."""
+    if TRACE_SUMMARY:
+        print("\n⏱️ Timing summary:\n" + _tracer.summary())
+
+def _analyze_performance(report_base):
     # Initialize conversation
     messages = [
         {
@@ -718,75 +4132,788 @@ def analyze_performance():
             "content": "My Linux server is responding very slowly. Please help me analyze the performance issue. The report output format is Markdown."
         }
     ]
-    
+
     print("🔍 Starting performance analysis...")
+    started = time.monotonic()
+    memo = ToolMemo()
+    # The diagnostics are known in advance, so collect them while the first request is in flight
+    print("🛠️ Collecting system metrics in the background...")
+    speculative = start_speculative_collection(my_tool_calls)
+
+    findings = None
+    if TRIAGE_ONLY:
+        # Triage before the first request, so a conclusive run needs no model at all
+        with trace_span("wait for speculative collection"):
+            prefetched = speculative.result()
+        findings = run_triage(prefetched)
+        if is_conclusive(findings):
+            write_triage_report(findings, report_base + ".txt")
+            return
+
     print("📡 Contacting the large model for initial diagnosis...")
-    
+
     # First API call - to request tool calls
-    response = call_siliconflow_api(messages)
-    
+    with trace_span("initial diagnosis"):
+        response = call_siliconflow_api(messages)
+
     if "error" in response:
         print(f"❌ Error: {response['error']}")
+        print_trace_summary()
         return
-    
+    print_api_timing(response)
+
     # Parse the response
     try:
-        choice = response["choices"][0]
-        message = choice["message"]
+        message = response["choices"][0]["message"]
+        # Reasoning is not sent back: it only inflates later prompts and R1-style endpoints reject it
+        message.pop("reasoning_content", None)
         messages.append(message)
-        
-        # Note: Manually inserting tool calls
-        message["tool_calls"] = my_tool_calls
-        if "tool_calls" in message:
-            print("⚙️ The large model requested the following performance checks:")
-            for call in message["tool_calls"]:
-                func = call["function"]
-                # Print arguments in a more readable way
-                arg_str = func.get('arguments', 'no arguments')
-                print(f"  - {func['name']}({arg_str})")
-            
-            # Execute tool calls
-            print("🛠️ Executing system check commands...")
-            tool_responses = execute_tool_calls(message["tool_calls"])
-            messages.extend(tool_responses)
-            
-            # Second API call - to get analysis based on tool results
-            print("📊 Analyzing check results...")
-            analysis_response = call_siliconflow_api(messages)
-            
-            if "error" in analysis_response:
-                print(f"❌ Analysis error: {analysis_response['error']}")
-                return
-            
-            # Display final analysis results
-            analysis_message = analysis_response["choices"][0]["message"]
-            print("\n" + "="*50)
-            print("💡 Performance Analysis Report:")
-            print(analysis_message["content"])
-            print("="*50)
-            
-            # Save the report to a file
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            report_file = f"performance_report_{timestamp}.txt"
-            with open(report_file, "w") as f:
-                f.write("Linux Performance Analysis Report\n\n")
-                f.write(f"Time: {datetime.now()}\n")
-                f.write(f"Author: {MODEL_NAME}\n")
-                f.write(analysis_message["content"])
-            
-            print(f"\n📝 Report saved to: {report_file}")
-        else:
-            print("\n" + "="*50)
-            print("💬 Direct response from the large model:")
-            print(message["content"])
-            print("="*50)
-            
+
+        # Note: Manually inserting tool calls. The model's own requests are kept
+        # and the known diagnostics it did not ask for are added after them.
+        message["tool_calls"] = merge_tool_calls(message.get("tool_calls"), my_tool_calls)
+        if findings is None:
+            with trace_span("wait for speculative collection"):
+                prefetched = speculative.result()
+            findings = run_triage(prefetched)
+
+        # Streamed tokens go to the terminal and the report file as they arrive
+        report_file = report_base + ".txt"
+        with open(report_file, "w") as f:
+            f.write("Linux Performance Analysis Report\n\n")
+            f.write(f"Time: {datetime.now()}\n")
+            f.write(f"Author: {MODEL_NAME}\n")
+            if findings:
+                f.write("\n## Local Pre-triage\n\n" + format_findings(findings) + "\n")
+
+            echo = StreamEcho(f)
+            for round_number in range(1, MAX_AGENT_ROUNDS + 1):
+                round_start = time.perf_counter()
+                print_tool_calls(message["tool_calls"])
+
+                # Execute tool calls, reusing results that are prefetched or still fresh
+                print("🛠️ Executing system check commands...")
+                messages.extend(execute_tool_calls(message["tool_calls"], prefetched=prefetched,
+                                                   token_budget=TOKEN_BUDGET, memo=memo))
+                if prefetched is not None and findings:
+                    # Hand the local findings to the model with the first results
+                    messages.append(triage_message(findings))
+                prefetched = None
+
+                # On the last round the model has to answer without further tools
+                last_round = round_number == MAX_AGENT_ROUNDS or time.monotonic() - started >= MAX_AGENT_SECONDS
+
+                # Next API call - to get analysis (or further requests) based on tool results
+                print("📊 Analyzing check results...")
+                echo.start_round(round_number)
+                with trace_span("analysis call"):
+                    analysis_response = call_siliconflow_api(messages, tool_choice="none" if last_round else "auto",
+                                                             on_token=echo)
+                # A round that asks for more checks is not the report, unless it cannot get them
+                echo.end_round(final="error" in analysis_response or last_round
+                               or not analysis_response["choices"][0]["message"].get("tool_calls"))
+                trace_add(f"round {round_number}", "stage", round_start, time.perf_counter())
+
+                if "error" in analysis_response:
+                    break
+                print_api_timing(analysis_response)
+
+                message = analysis_response["choices"][0]["message"]
+                message.pop("reasoning_content", None)
+                messages.append(message)
+                if not message.get("tool_calls"):
+                    break
+                if last_round:
+                    print("⚠️ Warning: Round or time limit reached, finishing with the data collected so far.")
+                    break
+
+            if "error" not in analysis_response and echo.kind is None:
+                # Not streamed: display the final analysis results
+                print("\n" + "="*50)
+                print("💡 Performance Analysis Report:")
+                print(message["content"])
+                print("="*50)
+                f.write("\n" + (message["content"] or ""))
+
+            if "error" not in analysis_response and _low_impact is not None:
+                overhead = _low_impact.describe()
+                print("\n🪶 Diagnostic overhead:\n" + overhead)
+                f.write("\n\n## Diagnostic Overhead\n\n" + overhead + "\n")
+
+            if TRACE_SUMMARY:
+                f.write("\n\n## Timing Summary\n\n")
+                f.write(_tracer.summary() + "\n")
+
+        if "error" in analysis_response:
+            print(f"❌ Analysis error: {analysis_response['error']}")
+            if not echo.streamed:
+                os.remove(report_file)  # Nothing was received, do not leave an empty report
+                print_trace_summary()
+            return
+
+        print(f"\n📝 Report saved to: {report_file} ({round_number} round(s), {time.monotonic() - started:.1f}s)")
+
     except KeyError as e:
         print(f"❌ Failed to parse API response: {str(e)}")
         print("Full response:", json.dumps(response, indent=2))
+        print_trace_summary()
+
+# PSI watch mode - block on pressure stall triggers and capture the moment a stall starts
+PSI_RESOURCES = ("cpu", "memory", "io")
+
+def read_pressure(resource):
+    """Read /proc/pressure/<resource> into {"some": {"avg10": ..., ...}, "full": {...}}."""
+    pressure = {}
+    with open(f"/proc/pressure/{resource}") as f:
+        for line in f:
+            kind, *fields = line.split()
+            pressure[kind] = {key: float(value) for key, value in (field.split("=") for field in fields)}
+    return pressure
+
+def open_psi_trigger(resource, kind, stall_us, window_us=PSI_WINDOW_US):
+    """
+    Register a PSI trigger and return its file descriptor, which becomes
+    readable with POLLPRI whenever `kind` stall time exceeds `stall_us`
+    within `window_us`.
+    """
+    fd = os.open(f"/proc/pressure/{resource}", os.O_RDWR | os.O_NONBLOCK)
+    try:
+        os.write(fd, f"{kind} {stall_us} {window_us}\0".encode())
+    except OSError:
+        os.close(fd)
+        raise
+    return fd
+
+class RateLimiter:
+    """
+    Decide whether a triggered event may act, deduplicating by key.
+
+    An event is allowed when at least one of its keys is out of its
+    `cooldown`, `min_interval` has passed since the last allowed event and
+    fewer than `max_per_hour` events were allowed in the last hour. Refused
+    events are counted per key so the next capture can report them.
+    """
+
+    def __init__(self, cooldown, min_interval, max_per_hour):
+        self.cooldown = cooldown
+        self.min_interval = min_interval
+        self.max_per_hour = max_per_hour
+        self.last_by_key = {}
+        self.allowed = collections.deque()
+        self.suppressed = collections.Counter()
+
+    def allow(self, keys, now):
+        while self.allowed and now - self.allowed[0] >= 3600:
+            self.allowed.popleft()
+        fresh = [key for key in keys if now - self.last_by_key.get(key, -self.cooldown) >= self.cooldown]
+        if (not fresh or (self.allowed and now - self.allowed[-1] < self.min_interval)
+                or len(self.allowed) >= self.max_per_hour):
+            self.suppressed.update(keys)
+            return False
+        for key in keys:
+            self.last_by_key[key] = now
+        self.allowed.append(now)
+        return True
+
+    def take_suppressed(self):
+        suppressed, self.suppressed = dict(self.suppressed), collections.Counter()
+        return suppressed
+
+def capture_stall(resources, analyze, suppressed):
+    """Collect every diagnostic right away and report it, with the model when `analyze` is set."""
+    pressure = {}
+    for resource in PSI_RESOURCES:
+        try:
+            pressure[resource] = read_pressure(resource)
+        except OSError:
+            pass
+    print(f"\n🚨 {datetime.now():%H:%M:%S} Stall on {', '.join(sorted(resources))}: " + ", ".join(
+        f"{resource} some avg10={values['some']['avg10']}%" for resource, values in pressure.items()
+    ))
+    if suppressed:
+        print(f"  (suppressed since the last capture: {suppressed})")
+    if analyze:
+        analyze_performance()
+        return
+
+    collected = collect_tool_results(my_tool_calls)
+    findings = triage_results((func_name, result) for call, func_name, arguments, result in collected)
+    print(f"🩺 Local pre-triage: {len(findings)} finding(s)")
+    if findings:
+        print(format_findings(findings))
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    report_file = f"performance_report_{timestamp}.txt"
+    with open(report_file, "w") as f:
+        f.write("Linux Performance Analysis Report\n\n")
+        f.write(f"Time: {datetime.now()}\n")
+        f.write(f"Author: PSI watch mode, triggered by {', '.join(sorted(resources))} pressure\n\n")
+        f.write("## Pressure\n\n")
+        for resource, values in pressure.items():
+            f.write(f"- {resource}: " + "; ".join(
+                f"{kind} avg10={v['avg10']}% avg60={v['avg60']}% avg300={v['avg300']}%" for kind, v in values.items()
+            ) + "\n")
+        if suppressed:
+            f.write(f"\nTriggers suppressed since the last capture: {suppressed}\n")
+        f.write("\n## Local Pre-triage\n\n" + format_findings(findings) + "\n")
+        f.write("\n## Collected Data\n\n")
+        for (call, func_name, arguments, result), content in zip(collected, compact_tool_results(collected)):
+            f.write(f"### {func_name}\n\n```json\n{content}\n```\n\n")
+    print(f"📝 Report saved to: {report_file}")
+
+def run_watch(analyze=False):
+    """
+    Wait for pressure stalls and capture each one as it happens.
+
+    Blocks in poll() on PSI triggers, so an idle watch costs nothing. Kernels
+    or users that cannot register triggers fall back to reading the avg10
+    values every PSI_FALLBACK_INTERVAL seconds. Captures are rate-limited and
+    deduplicated per resource, and model analyses have their own hourly limit.
+    """
+    triggers = {}
+    for resource, (kind, stall_us) in PSI_TRIGGERS.items():
+        try:
+            triggers[open_psi_trigger(resource, kind, stall_us)] = resource
+        except OSError as e:
+            print(f"⚠️ Warning: Cannot register a PSI trigger for {resource}: {e}")
+    poller = select.poll()
+    for fd in triggers:
+        poller.register(fd, select.POLLPRI)
+
+    captures = RateLimiter(WATCH_COOLDOWN, WATCH_MIN_INTERVAL, WATCH_MAX_CAPTURES_PER_HOUR)
+    analyses = RateLimiter(0, 0, WATCH_MAX_ANALYSES_PER_HOUR)
+    watched = sorted(triggers.values()) if triggers else [r for r in PSI_TRIGGERS if os.path.exists(f"/proc/pressure/{r}")]
+    if not watched:
+        print("❌ Error: /proc/pressure is not available (kernel 4.20+ with PSI enabled is required).")
+        return
+    print(f"👀 Watching {', '.join(watched)} pressure "
+          f"({'PSI triggers' if triggers else f'polling every {PSI_FALLBACK_INTERVAL}s'}). Press Ctrl+C to stop.")
+
+    try:
+        while True:
+            if triggers:
+                triggered = set()
+                for fd, mask in poller.poll():
+                    if mask & select.POLLERR:
+                        raise RuntimeError(f"The {triggers[fd]} PSI trigger was removed by the kernel")
+                    triggered.add(triggers[fd])
+            else:
+                time.sleep(PSI_FALLBACK_INTERVAL)
+                triggered = {
+                    resource for resource in watched
+                    if read_pressure(resource)[PSI_TRIGGERS[resource][0]]["avg10"]
+                    >= 100.0 * PSI_TRIGGERS[resource][1] / PSI_WINDOW_US
+                }
+            now = time.monotonic()
+            if triggered and captures.allow(triggered, now):
+                capture_stall(triggered, analyze and analyses.allow(("model",), now), captures.take_suppressed())
+    except KeyboardInterrupt:
+        print("\nWatch stopped.")
+    finally:
+        for fd in triggers:
+            os.close(fd)
+
+# Fleet mode - hosts emit JSON snapshots, one aggregator analyzes them in batches
+FLEET_SNAPSHOT_FORMAT = "system-doctor-fleet/1"
+FLEET_RETRY_STATUS = (429, 500, 502, 503, 504)
+
+def emit_fleet_snapshot(path):
+    """
+    Run every FUNCTION_MAP collector and write the results as one JSON
+    document, to `path` or to stdout when `path` is "-". Nothing else is
+    written to stdout, so the output can be piped straight to an aggregator.
+    In low-impact mode the snapshot also carries what collecting it cost.
+    """
+    # Collector warnings go to stderr with everything else that is not the snapshot
+    with contextlib.redirect_stdout(sys.stderr):
+        collected = collect_tool_results(my_tool_calls, verbose=False)
+    snapshot = {
+        "format": FLEET_SNAPSHOT_FORMAT,
+        "host": socket.gethostname(),
+        "boot_id": read_boot_id(),
+        "time": datetime.now().isoformat(),
+        "results": {func_name: result for call, func_name, arguments, result in collected}
+    }
+    if _low_impact is not None:
+        snapshot["overhead"] = _low_impact.overhead()
+    if path == "-":
+        json.dump(snapshot, sys.stdout, separators=(",", ":"))
+        sys.stdout.write("\n")
+        sys.stdout.flush()
+    else:
+        with open(path, "w") as f:
+            json.dump(snapshot, f, separators=(",", ":"))
+        print(f"📝 Snapshot of {snapshot['host']} saved to: {path}", file=sys.stderr)
+
+def parse_fleet_snapshots(text, source):
+    """Decode every snapshot in `text`, which may hold several concatenated or line-delimited documents."""
+    decoder = json.JSONDecoder()
+    snapshots = []
+    position = 0
+    while True:
+        while position < len(text) and text[position].isspace():
+            position += 1
+        if position == len(text):
+            return snapshots
+        snapshot, position = decoder.raw_decode(text, position)
+        if not isinstance(snapshot, dict) or snapshot.get("format") != FLEET_SNAPSHOT_FORMAT:
+            raise ValueError(f"{source}: not a {FLEET_SNAPSHOT_FORMAT} snapshot")
+        if not isinstance(snapshot.get("results"), dict):
+            # Keep the other snapshots of the source
+            print(f"⚠️ Warning: Skipping a snapshot without results in {source} (host {snapshot.get('host', '?')})")
+            continue
+        snapshots.append(snapshot)
+
+def read_fleet_source(source):
+    """Read the snapshots of one file, or of stdin when `source` is "-"."""
+    if source == "-":
+        return parse_fleet_snapshots(sys.stdin.read(), "stdin")
+    with open(source) as f:
+        return parse_fleet_snapshots(f.read(), source)
+
+def ingest_fleet_snapshots(sources, max_workers=FLEET_INGEST_WORKERS):
+    """
+    Read and decode every source concurrently.
+
+    Returns:
+        tuple: (snapshots in source order, {source: error message})
+    """
+    snapshots, errors = [], {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [(source, executor.submit(read_fleet_source, source)) for source in sources]
+        for source, future in futures:
+            try:
+                snapshots.extend(future.result())
+            except (OSError, ValueError) as e:
+                errors[source] = str(e)
+    return snapshots, errors
+
+def symptom_signature(findings):
+    """
+    Hosts whose warning or critical findings come from the same rules on the
+    same kind of resource share a signature. Device and interface names are
+    left out, so "disk sda" on one host groups with "disk nvme0n1" on another.
+    """
+    return tuple(sorted({
+        (item["resource"].split()[0], item["rule"]) for item in findings
+        if TRIAGE_SEVERITY[item["severity"]] >= TRIAGE_SEVERITY["warning"]
+    }))
+
+def group_fleet_hosts(snapshots):
+    """
+    Triage every snapshot and group the hosts by symptom signature.
+
+    Returns:
+        list: {"signature", "hosts": [(snapshot, findings), ...]} groups, the
+        most severe first. Hosts without symptoms share the empty signature.
+    """
+    groups = {}
+    for snapshot in snapshots:
+        findings = triage_results(snapshot["results"].items())
+        groups.setdefault(symptom_signature(findings), []).append((snapshot, findings))
+    ranked = []
+    for signature, hosts in groups.items():
+        # The worst host of each group comes first and represents it
+        hosts.sort(key=lambda host: host[1][0]["score"] if host[1] else 0, reverse=True)
+        ranked.append({"signature": signature, "hosts": hosts})
+    ranked.sort(key=lambda group: group["hosts"][0][1][0]["score"] if group["signature"] else -1, reverse=True)
+    return ranked
+
+def fleet_batch_messages(signature, hosts):
+    """
+    Build one analysis request for a batch of hosts sharing `signature`.
+
+    Only the first (most severe) host sends its full compacted results; the
+    others are described by their findings, which keeps the prompt close to
+    the size of a single-host diagnosis.
+    """
+    representative, findings = hosts[0]
+    collected = [(None, func_name, {}, result) for func_name, result in representative["results"].items()]
+    contents = compact_tool_results(collected, verbose=False)
+    symptoms = ", ".join(rule for resource, rule in signature)
+    lines = [
+        f"These {len(hosts)} Linux servers show the same symptoms ({symptoms}). "
+        "Explain the likely common cause and give recommendations that apply to all of them, "
+        "noting any host that differs. The report output format is Markdown.",
+        "",
+        "## Local findings per host",
+    ]
+    for snapshot, host_findings in hosts:
+        lines.append(f"### {snapshot['host']} ({snapshot['time']})")
+        lines.append(format_findings(host_findings))
+    lines.append("")
+    lines.append(f"## Full data of {representative['host']}")
+    for (call, func_name, arguments, result), content in zip(collected, contents):
+        lines.append(f"### {func_name}\n{content}")
+    return [
+        {
+            "role": "system",
+            "content": "You are a Linux system performance expert. You analyze groups of servers with similar symptoms and provide solution recommendations."
+        },
+        {"role": "user", "content": "\n".join(lines)}
+    ]
+
+class RequestPacer:
+    """Space request starts at least `60 / per_minute` seconds apart across threads."""
+
+    def __init__(self, per_minute):
+        self.spacing = 60.0 / per_minute if per_minute else 0.0
+        self.next_start = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.spacing
+        time.sleep(start - now)
+
+    def hold(self, seconds):
+        """Push every later start back, e.g. after the server asked to retry later."""
+        with self.lock:
+            self.next_start = max(self.next_start, time.monotonic() + seconds)
+
+def call_with_retry(messages, pacer, retries=FLEET_RETRIES, backoff=FLEET_RETRY_BACKOFF):
+    """
+    Call the API under `pacer`, retrying rate-limited, server-side and
+    connection errors with exponential backoff and jitter. A Retry-After
+    from the server holds back every pending request, not only this one.
+    """
+    for attempt in range(retries + 1):
+        pacer.wait()
+        response = call_siliconflow_api(messages, tool_choice="none", stream=False)
+        status = response.get("status_code")
+        if "error" not in response or attempt == retries or (status is not None and status not in FLEET_RETRY_STATUS):
+            response["attempts"] = attempt + 1
+            return response
+        delay = backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+        if response.get("retry_after"):
+            delay = max(delay, response["retry_after"])
+            pacer.hold(delay)
+        time.sleep(delay)
+
+def run_fleet(sources, max_concurrency=FLEET_MAX_CONCURRENCY, hosts_per_request=FLEET_HOSTS_PER_REQUEST,
+              requests_per_minute=FLEET_REQUESTS_PER_MINUTE):
+    """
+    Analyze snapshots of many hosts: ingest them concurrently, group hosts
+    with similar local findings, and send one analysis request per batch of
+    up to `hosts_per_request` hosts, at most `max_concurrency` at a time and
+    `requests_per_minute` overall. Hosts without symptoms are listed only.
+    """
+    started = time.monotonic()
+    snapshots, errors = ingest_fleet_snapshots(sources)
+    for source, message in errors.items():
+        print(f"⚠️ Warning: Skipped {source}: {message}")
+    if not snapshots:
+        print("❌ Error: No snapshots to analyze.")
+        return
+    groups = group_fleet_hosts(snapshots)
+    batches = [
+        (group["signature"], group["hosts"][i:i + hosts_per_request])
+        for group in groups if group["signature"]
+        for i in range(0, len(group["hosts"]), hosts_per_request)
+    ]
+    print(f"📥 Ingested {len(snapshots)} snapshot(s) from {len(sources)} source(s): "
+          f"{len(groups)} symptom group(s), {len(batches)} analysis request(s)")
+
+    pacer = RequestPacer(requests_per_minute)
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        responses = list(executor.map(
+            lambda batch: call_with_retry(fleet_batch_messages(*batch), pacer), batches
+        ))
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    report_file = f"fleet_report_{timestamp}.txt"
+    failed = 0
+    with open(report_file, "w") as f:
+        f.write("Linux Fleet Performance Analysis Report\n\n")
+        f.write(f"Time: {datetime.now()}\n")
+        f.write(f"Author: {MODEL_NAME}\n")
+        f.write(f"Hosts: {len(snapshots)}\n\n")
+        for (signature, hosts), response in zip(batches, responses):
+            symptoms = ", ".join(rule for resource, rule in signature)
+            f.write(f"## {symptoms}\n\n")
+            f.write("Hosts: " + ", ".join(snapshot["host"] for snapshot, findings in hosts) + "\n\n")
+            if "error" in response:
+                failed += 1
+                f.write(f"Analysis failed after {response['attempts']} attempt(s): {response['error']}\n\n")
+                f.write(format_findings(hosts[0][1]) + "\n\n")
+            else:
+                f.write((response["choices"][0]["message"].get("content") or "") + "\n\n")
+        healthy = [snapshot["host"] for group in groups if not group["signature"] for snapshot, findings in group["hosts"]]
+        if healthy:
+            f.write("## No symptoms\n\n" + ", ".join(healthy) + "\n")
+    if failed:
+        print(f"⚠️ Warning: {failed} of {len(batches)} analysis request(s) failed, their local findings were reported instead.")
+    print(f"\n📝 Fleet report saved to: {report_file} ({time.monotonic() - started:.1f}s)")
+
+# Metrics exporter - the native collectors served as an OpenMetrics / Prometheus text endpoint
+# Scheduler, process and cgroup results are not exported: their rows are keyed by PID or
+# cgroup path, so every scrape would bring new label sets, and the scheduler and process
+# collectors walk all of /proc on each collection
+METRICS_TOOLS = ("check_cpu_usage", "check_memory_usage", "check_disk_io", "check_network_info")
+METRICS_LABEL_KEYS = ("cpu", "device", "interface", "resource")  # Row keys that become labels
+# Collector fields whose names would read as counters or clash with the _count suffix
+# OpenMetrics reserves for histograms and summaries, renamed before they become metric names
+METRICS_FIELD_RENAMES = {
+    "cpu_count": "cpus",
+    "device_count": "devices",
+    "iops": "ios/s",
+    "total_iops": "total_ios/s",
+    "total_throughput": "total_throughput_kB/s",
+    "oom_kills": "oom_kills_in_window",
+}
+METRICS_RATE_TABLES = ("interfaces",)  # Tables whose columns are per-second rates named like counters
+METRICS_NAME_UNSAFE = re.compile(r"[^a-z0-9_]+")
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+@functools.lru_cache(maxsize=None)
+def metric_name(*parts):
+    """Turn collector field names such as "%util" or "r/s" into a valid metric name, once per name."""
+    name = "_".join(parts).lower().replace("%", "pct_").replace("/s", "_per_second")
+    return "system_doctor_" + METRICS_NAME_UNSAFE.sub("_", name).strip("_")
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def flatten_metrics(prefix, data, samples):
+    """
+    Append (metric name, labels, value) for every number in a collector
+    result. Nested dicts extend the name; lists of rows are labelled by
+    their cpu, device, interface or resource key. Rates always end in
+    _per_second (or a unit per second) in the metric name.
+    """
+    for key, value in data.items():
+        if isinstance(value, bool) or key in METRICS_LABEL_KEYS:
+            continue
+        if isinstance(value, (int, float)):
+            samples.append((metric_name(*prefix, METRICS_FIELD_RENAMES.get(key, key)), "", value))
+        elif isinstance(value, dict) and key != "stats":
+            flatten_metrics(prefix + (key,), value, samples)
+        elif isinstance(value, list) and value and isinstance(value[0], dict):
+            for row in value:
+                label = next((name for name in METRICS_LABEL_KEYS if name in row), None)
+                if label is None:
+                    continue
+                labels = f'{label}="{escape_label(row[label])}"'
+                for field, number in row.items():
+                    if field != label and isinstance(number, (int, float)) and not isinstance(number, bool):
+                        field = METRICS_FIELD_RENAMES.get(field, field)
+                        if key in METRICS_RATE_TABLES:
+                            field += "/s"
+                        samples.append((metric_name(*prefix, key, field), labels, number))
+
+def render_metrics(samples, counters=(), openmetrics=True):
+    """
+    Render the exposition text of (name, labels, value) gauge samples and
+    counter samples as one bytes object: one list of fragments and a single
+    join, with the samples of a family kept together under one TYPE line.
+    Counter samples are exposed as <name>_total; OpenMetrics names the
+    family without the suffix, the Prometheus text format with it.
+    """
+    out = []
+    for kind, rows in (("gauge", samples), ("counter", counters)):
+        families = {}
+        for name, labels, value in rows:
+            families.setdefault(name, []).append((labels, value))
+        for name, family in families.items():
+            sample_name = name + "_total" if kind == "counter" else name
+            out.append(f"# TYPE {name if openmetrics else sample_name} {kind}\n")
+            for labels, value in family:
+                out.append(f"{sample_name}{{{labels}}} {value}\n" if labels else f"{sample_name} {value}\n")
+    return "".join(out).encode()
 
-def main():
+class MetricsCache:
+    """
+    The exposition text of the latest collection.
+
+    A collection reads every counter source once and measures the rates
+    since the previous collection, so no scrape waits for a sampling window.
+    The first scrape after `interval` seconds collects while every concurrent
+    scrape waits for that same collection; all others get the cached bytes.
+    """
+
+    def __init__(self, interval=METRICS_INTERVAL):
+        self.interval = interval
+        self.sources = tuple(sorted({source for tool in METRICS_TOOLS for source in WINDOWED_TOOLS[tool]}))
+        self.previous = self.read()
+        self.collected_at = float("-inf")
+        self.bodies = {True: b"", False: b""}  # OpenMetrics or not -> exposition text
+        self.lock = threading.Lock()
+
+    def read(self):
+        counters = {}
+        for name in self.sources:
+            try:
+                counters[name] = SAMPLERS[name][0]()
+            except Exception:
+                pass  # Its collectors report the missing samples and are exported as down
+        return time.monotonic(), counters
+
+    def collect(self):
+        started = time.perf_counter()
+        now = self.read()
+        (t0, first), (t1, last) = self.previous, now
+        window = SamplingWindow(t1 - t0, sources=self.sources)
+        window.samples = {name: [(t0, first[name]), (t1, last[name])] for name in self.sources
+                          if name in first and name in last}
+        window.origin = "exporter"
+        window._done.set()
+
+        global _shared_window
+        _shared_window = window
+        try:
+            results = {func_name: FUNCTION_MAP[func_name]() for func_name in METRICS_TOOLS}
+        finally:
+            close_shared_window()
+        self.previous = now
+
+        samples = []
+        for func_name, result in results.items():
+            samples.append(("system_doctor_collector_up", f'collector="{func_name}"', int(result["status"] == "success")))
+            if result["status"] == "success":
+                flatten_metrics((func_name.replace("check_", ""),), result["data"], samples)
+        counters = []
+        for resource in PSI_RESOURCES:
+            try:
+                values = read_pressure(resource)
+            except OSError:
+                continue
+            labels = f'resource="{resource}"'
+            for kind, fields in values.items():
+                for key, value in fields.items():
+                    if key == "total":
+                        # Cumulative stall time in microseconds
+                        counters.append((f"system_doctor_pressure_{kind}_stall_seconds", labels, value / 1e6))
+                    else:
+                        samples.append((metric_name("pressure", f"{kind}_{key}"), labels, value))
+        samples.append(("system_doctor_collection_duration_seconds", "", round(time.perf_counter() - started, 6)))
+        samples.append(("system_doctor_collection_timestamp_seconds", "", round(time.time(), 3)))
+        self.bodies = {openmetrics: render_metrics(samples, counters, openmetrics) for openmetrics in (True, False)}
+
+    def get(self, openmetrics=True):
+        """Return the exposition text, collecting first if it is older than the interval."""
+        if time.monotonic() - self.collected_at < self.interval:
+            return self.bodies[openmetrics]
+        with self.lock:
+            # Another scrape may have collected while this one waited for the lock
+            if time.monotonic() - self.collected_at >= self.interval:
+                self.collect()
+                self.collected_at = time.monotonic()
+            return self.bodies[openmetrics]
+
+class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    """Serve GET /metrics from the shared MetricsCache."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        openmetrics = "application/openmetrics-text" in self.headers.get("Accept", "")
+        body = self.server.cache.get(openmetrics)
+        if openmetrics:
+            content_type, trailer = OPENMETRICS_CONTENT_TYPE, b"# EOF\n"
+        else:
+            content_type, trailer = PROMETHEUS_CONTENT_TYPE, b""
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body) + len(trailer)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.wfile.write(trailer)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes every few seconds would flood the terminal
+
+def run_metrics_server(port=METRICS_PORT, address=METRICS_ADDRESS):
+    """Serve the collectors as metrics on http://<address>:<port>/metrics until interrupted."""
+    server = http.server.ThreadingHTTPServer((address, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    server.cache = MetricsCache()
+
+    # Exit cleanly on SIGTERM as well as Ctrl-C
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    print(f"📈 Serving metrics on http://{address}:{port}/metrics (collected at most every {METRICS_INTERVAL}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print("\nMetrics server stopped.")
+
+def parse_args(argv=None):
+    """Parse the command line."""
+    parser = argparse.ArgumentParser(description="Linux System Performance Diagnostic Assistant")
+    parser.add_argument("--daemon", action="store_true",
+                        help="run the resident sampler that keeps recent metrics in memory for later diagnoses")
+    parser.add_argument("--record", metavar="FILE",
+                        help="append the raw collector data and timings of this run to a snapshot file")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="re-run recorded snapshots offline instead of collecting from this machine")
+    parser.add_argument("--snapshot", type=int, metavar="N",
+                        help="with --replay, only replay the N-th snapshot (0-based)")
+    parser.add_argument("--analyze", action="store_true",
+                        help="with --replay or --watch, send the results to the large model for analysis")
+    parser.add_argument("--watch", action="store_true",
+                        help="wait for CPU, memory or I/O pressure stalls and capture a report when one starts")
+    parser.add_argument("--emit-snapshot", metavar="FILE",
+                        help="only collect, and write the results as a JSON snapshot for --fleet (- for stdout)")
+    parser.add_argument("--fleet", nargs="+", metavar="FILE",
+                        help="analyze JSON snapshots of many hosts in batches grouped by symptoms (- for stdin)")
+    parser.add_argument("--serve-metrics", nargs="?", type=int, const=METRICS_PORT, metavar="PORT",
+                        help=f"serve the collectors as OpenMetrics on 127.0.0.1:PORT/metrics (default {METRICS_PORT})")
+    parser.add_argument("--trace-summary", action="store_true",
+                        help="append a per-stage timing table to the end of the report")
+    parser.add_argument("--triage-only", action="store_true",
+                        help="skip the large model when the local pre-triage finds a conclusive cause")
+    parser.add_argument("--low-impact", action="store_true",
+                        help="run at the lowest CPU and I/O priority with capped CPU time and memory, "
+                             "without forking, for hosts that are already overloaded")
+    return parser.parse_args(argv)
+
+def main(argv=None):
     """Main function."""
+    args = parse_args(argv)
+    if args.low_impact and (args.daemon or args.serve_metrics or args.watch):
+        lower_own_priority()  # Long-running modes get no CPU time budget
+    if args.daemon:
+        # Sampling only, no large model involved
+        run_daemon()
+        return
+    if args.serve_metrics:
+        run_metrics_server(args.serve_metrics)
+        return
+    if args.replay and not args.analyze:
+        run_replay(args.replay, args.snapshot)
+        return
+    if args.watch and not args.analyze:
+        # Collection and local triage only, no large model involved
+        run_watch()
+        return
+    if args.record:
+        global _recorder
+        _recorder = SnapshotRecorder(args.record)
+    if args.trace_summary:
+        global TRACE_SUMMARY
+        TRACE_SUMMARY = True
+    if args.triage_only:
+        global TRIAGE_ONLY
+        TRIAGE_ONLY = True
+    if args.low_impact and not args.watch:
+        global _low_impact
+        _low_impact = LowImpactGuard().enter()
+    if args.emit_snapshot:
+        # Collection only, the aggregator talks to the large model
+        try:
+            emit_fleet_snapshot(args.emit_snapshot)
+        except CpuBudgetExceeded as e:
+            print(f"❌ Stopped in low-impact mode: {e}", file=sys.stderr)
+        return
+
     print("="*50)
     print(f"🖥️ Linux System Performance Diagnostic Assistant ({MODEL_NAME})")
     print("="*50)
@@ -796,20 +4923,31 @@ def main():
         return
     
     try:
-        # Check if required commands exist
-        required_commands = ["mpstat", "iostat", "free", "ps", "hostnamectl", "lscpu"]
-        missing = [cmd for cmd in required_commands if not subprocess.run(["which", cmd], stdout=subprocess.DEVNULL).returncode == 0]
+        # Check if required commands exist (looked up on PATH without forking)
+        # CPU, memory, disk, process and network metrics are read from /proc and need no external tools
+        # The fleet aggregator only reads snapshots collected elsewhere
+        required_commands = [] if _low_impact is not None or args.fleet else ["hostnamectl", "lscpu"]
+        missing = [cmd for cmd in required_commands if shutil.which(cmd) is None]
         
         if missing:
             print(f"❌ Missing required commands: {', '.join(missing)}")
-            print("Please install the sysstat and procps packages:")
-            print("  Ubuntu/Debian: sudo apt install sysstat procps")
-            print("  RHEL/CentOS: sudo yum install sysstat procps-ng")
+            print("Please install the systemd and util-linux packages:")
+            print("  Ubuntu/Debian: sudo apt install systemd util-linux")
+            print("  RHEL/CentOS: sudo yum install systemd util-linux")
             return
         
-        analyze_performance()
+        if args.replay:
+            run_replay(args.replay, args.snapshot, analyze=True)
+        elif args.watch:
+            run_watch(analyze=True)
+        elif args.fleet:
+            run_fleet(args.fleet)
+        else:
+            analyze_performance()
     except KeyboardInterrupt:
         print("\nOperation cancelled.")
+    except CpuBudgetExceeded as e:
+        print(f"\n❌ Stopped in low-impact mode: {e}")
 
 if __name__ == "__main__":
     main()
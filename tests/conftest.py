@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import doctor  # noqa: E402
+
+CORPUS = os.path.join(ROOT, "benchmarks", "corpus")
+CORPUS_HOST = os.path.join(CORPUS, "proc", "debian12-kvm-1cpu")
+
+@pytest.fixture(autouse=True)
+def isolated_globals(monkeypatch):
+    """Keep every test away from a running daemon and from state left by another test."""
+    monkeypatch.setattr(doctor, "_history", None)
+    monkeypatch.setattr(doctor, "_replay", None)
+    monkeypatch.setattr(doctor, "_shared_window", None)
+    monkeypatch.setattr(doctor, "fetch_daemon_samples", lambda sources, duration: None)
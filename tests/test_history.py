@@ -0,0 +1,69 @@
+import os
+import time
+
+import pytest
+
+import doctor
+from conftest import CORPUS_HOST
+
+@pytest.fixture
+def sampler(monkeypatch):
+    """A history sampler holding the two corpus samples of cpu and loadavg, one second apart."""
+    sampler = doctor.HistorySampler()
+    now = time.monotonic()
+    for t, sample in ((now - 1, "0"), (now, "1")):
+        base = os.path.join(CORPUS_HOST, sample)
+        sampler.rings["cpu"][1].append(t, doctor.pack_sample(doctor.read_proc_stat(os.path.join(base, "stat"))))
+        sampler.rings["loadavg"][1].append(t, doctor.pack_sample(doctor.read_loadavg(os.path.join(base, "loadavg"))))
+    monkeypatch.setattr(doctor, "_history", sampler)
+    return sampler
+
+def test_history_window_leaves_out_a_failing_source(sampler):
+    sampler.errors["sched"] = "[Errno 2] No such file or directory: '/proc/schedstat'"
+    window = doctor.history_window(("cpu", "loadavg", "sched"), 1)
+    assert window.origin == "history"
+    assert window.errors == {"sched": sampler.errors["sched"]}
+    assert len(window.samples["cpu"]) == 2
+    with pytest.raises(RuntimeError, match="schedstat"):
+        window.span("sched")
+    # The collectors that do not need the failing source are served from history
+    doctor._shared_window = window
+    assert doctor.check_cpu_usage()["data"]["cpu_count"] == 1
+
+def test_history_window_needs_every_source_that_has_not_failed(sampler):
+    assert doctor.history_window(("cpu", "loadavg", "sched"), 1) is None
+    assert doctor.history_window(("cpu", "loadavg"), 1) is not None
+
+def test_history_window_without_a_sampler_or_daemon():
+    assert doctor.history_window(("cpu",), 1) is None
+
+def test_history_window_from_the_daemon_reply(monkeypatch):
+    samples = {"cpu": [(0.0, doctor.read_proc_stat(os.path.join(CORPUS_HOST, "0", "stat"))),
+                       (1.0, doctor.read_proc_stat(os.path.join(CORPUS_HOST, "1", "stat")))]}
+    monkeypatch.setattr(doctor, "fetch_daemon_samples",
+                        lambda sources, duration: (samples, {"sched": "no schedstat"}))
+    window = doctor.history_window(("cpu", "sched"), 1)
+    assert window.errors == {"sched": "no schedstat"}
+    assert window.span("cpu")[0] == 1.0
+
+def test_ring_buffer_thins_old_samples_over_its_byte_budget():
+    sample = doctor.pack_sample(doctor.read_proc_stat(os.path.join(CORPUS_HOST, "0", "stat")))
+    size = doctor.sample_size(sample)
+    ring = doctor.RingBuffer(capacity=100, max_bytes=size * 10)
+    for t in range(30):
+        ring.append(float(t), sample)
+    timestamps = [t for t, entry in ring.since(float("-inf"))]
+    assert ring.bytes <= size * 10
+    assert timestamps[-1] == 29.0
+    # Thinning keeps reach into the past at a coarser resolution
+    assert timestamps[0] < 29.0 - len(timestamps)
+
+def test_packed_samples_round_trip():
+    for path, reader in (("stat", doctor.read_proc_stat), ("diskstats", doctor.read_diskstats)):
+        sample = reader(os.path.join(CORPUS_HOST, "0", path))
+        assert doctor.unpack_sample(doctor.pack_sample(sample)) == sample
+    processes = {
+        1: doctor.ProcessSample("systemd", "S", 812, 3120, 1, 0, 4096, 10 ** 9, 10 ** 6, 2000),
+        4242: doctor.ProcessSample("java", "R", 98765, 2 ** 21, 64, 2 ** 40, 0, 0, 0, 0),
+    }
+    assert doctor.unpack_sample(doctor.pack_sample(processes)) == processes
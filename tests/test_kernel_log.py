@@ -0,0 +1,109 @@
+import os
+
+import pytest
+
+import doctor
+
+LOG = b"\n".join([
+    b"[ 12.0] eth0: Link is Up - 1Gbps/Full",
+    b"[ 13.1] Out of memory: Killed process 4242 (java) total-vm:8000000kB",
+    b"[ 14.2] nvme0c1n1: I/O Cmd(0x2) @ LBA 2048, 8 blocks, I/O Error (sct 0x2 / sc 0x81) DNR",
+    b"[ 15.3] Buffer I/O ERROR on dev sdb1, logical block 0, async page read",
+    b"[ 16.4] INFO: task kworker/0:1:77 blocked for more than 120 seconds.",
+    b"[ 17.5] e1000e 0000:00:1f.6 eth0: NIC Link is Down",
+    b"[ 18.6] app[999]: segfault at 0 ip 0000 sp 0000 error 4 in app",
+]) + b"\n"
+
+@pytest.fixture
+def cursor_file(tmp_path, monkeypatch):
+    path = tmp_path / "cache" / "kernel_log_cursor.json"
+    monkeypatch.setattr(doctor, "KERNEL_LOG_CURSOR_FILE", str(path))
+    monkeypatch.setattr(doctor, "read_boot_id", lambda: "boot-a")
+    return path
+
+def test_classifier_counts_each_event_class():
+    scan = doctor.KernelLogScan()
+    scan.add_block(LOG, LOG.count(b"\n"))
+    assert scan.lines == 7
+    assert dict(scan.counts) == {
+        "oom_kill": 1, "io_error": 2, "hung_task": 1, "network_error": 1, "segfault": 1
+    }
+    events = scan.events()
+    assert events["io_error"]["resource"] == "disk"
+    assert events["oom_kill"]["severity"] == "critical"
+    assert events["io_error"]["recent"][0]["message"].startswith("[ 14.2] nvme0c1n1:")
+
+def test_classifier_keeps_only_the_latest_examples():
+    block = b"".join(b"Out of memory: Killed process %d (worker)\n" % pid for pid in range(10))
+    scan = doctor.KernelLogScan(examples=3)
+    scan.add_block(block, 10, timestamps=[f"t{i}" for i in range(10)])
+    recent = scan.events()["oom_kill"]["recent"]
+    assert scan.counts["oom_kill"] == 10
+    assert [example["time"] for example in recent] == ["t7", "t8", "t9"]
+    assert recent[-1]["message"] == "Out of memory: Killed process 9 (worker)"
+
+def test_cursor_is_kept_per_boot(cursor_file, monkeypatch):
+    assert doctor.load_kernel_log_cursor() == {}
+    doctor.save_kernel_log_cursor({"kmsg_seq": 42})
+    assert doctor.load_kernel_log_cursor() == {"kmsg_seq": 42, "boot_id": "boot-a"}
+    monkeypatch.setattr(doctor, "read_boot_id", lambda: "boot-b")
+    assert doctor.load_kernel_log_cursor() == {}
+
+def test_log_file_scan_resumes_after_the_last_full_line(tmp_path):
+    path = tmp_path / "kern.log"
+    path.write_bytes(b"Out of memory: Killed process 1 (a)\nOut of memory: Kill")
+    scan = doctor.KernelLogScan()
+    cursor = doctor.scan_kernel_log_file(scan, str(path), {})
+    assert cursor["offset"] == len(b"Out of memory: Killed process 1 (a)\n")
+    assert scan.counts["oom_kill"] == 1
+
+    # The partly written line is scanned once it is complete, and only once
+    with open(path, "ab") as f:
+        f.write(b"ed process 2 (b)\n")
+    scan = doctor.KernelLogScan()
+    cursor = doctor.scan_kernel_log_file(scan, str(path), cursor)
+    assert (scan.lines, scan.counts["oom_kill"]) == (1, 1)
+    assert cursor["offset"] == os.path.getsize(path)
+
+def test_log_file_scan_starts_over_after_rotation_or_truncation(tmp_path):
+    path = tmp_path / "kern.log"
+    path.write_bytes(b"Out of memory: Killed process 1 (a)\n" * 3)
+    cursor = doctor.scan_kernel_log_file(doctor.KernelLogScan(), str(path), {})
+
+    os.rename(path, tmp_path / "kern.log.1")
+    path.write_bytes(b"Out of memory: Killed process 2 (b)\n")
+    scan = doctor.KernelLogScan()
+    rotated = doctor.scan_kernel_log_file(scan, str(path), cursor)
+    assert rotated["inode"] != cursor["inode"]
+    assert scan.counts["oom_kill"] == 1
+
+    scan = doctor.KernelLogScan()
+    doctor.scan_kernel_log_file(scan, str(path), dict(rotated, offset=10 ** 6))
+    assert scan.counts["oom_kill"] == 1
+
+def test_check_kernel_log_falls_back_to_a_log_file(cursor_file, tmp_path, monkeypatch):
+    def no_kmsg(scan, after_seq, max_age=None):
+        raise PermissionError("/dev/kmsg")
+    path = tmp_path / "kern.log"
+    path.write_bytes(LOG)
+    monkeypatch.setattr(doctor, "scan_kmsg", no_kmsg)
+    monkeypatch.setattr(doctor, "KERNEL_LOG_FALLBACK_FILES", (str(tmp_path / "missing.log"), str(path)))
+
+    first = doctor.check_kernel_log()["data"]
+    assert (first["source"], first["since"], first["recent_only"]) == (str(path), "start of file", False)
+    assert first["messages_scanned"] == 7
+
+    with open(path, "ab") as f:
+        f.write(b"Out of memory: Killed process 5 (db)\n")
+    second = doctor.check_kernel_log()["data"]
+    assert (second["since"], second["recent_only"], second["messages_scanned"]) == ("previous run", True, 1)
+    assert list(second["events"]) == ["oom_kill"]
+
+def test_check_kernel_log_reports_no_readable_source(cursor_file, monkeypatch):
+    def no_kmsg(scan, after_seq, max_age=None):
+        raise PermissionError("/dev/kmsg")
+    monkeypatch.setattr(doctor, "scan_kmsg", no_kmsg)
+    monkeypatch.setattr(doctor, "KERNEL_LOG_FALLBACK_FILES", ("/nonexistent/kern.log",))
+    result = doctor.check_kernel_log()
+    assert result["status"] == "error"
+    assert "/nonexistent/kern.log" in result["message"]
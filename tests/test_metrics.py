@@ -0,0 +1,60 @@
+import re
+
+import bench
+import doctor
+from conftest import CORPUS_HOST
+
+# Metric names the OpenMetrics text format allows, without the suffixes it reserves
+VALID_NAME = re.compile(r"^[a-zA-Z_:][a-zA-Z0-9_:]*$")
+RESERVED_SUFFIXES = ("_total", "_count", "_sum", "_bucket", "_created", "_info")
+
+def test_metric_names():
+    assert doctor.metric_name("disk_io", "devices", "%util") == "system_doctor_disk_io_devices_pct_util"
+    assert doctor.metric_name("disk_io", "devices", "r/s") == "system_doctor_disk_io_devices_r_per_second"
+    assert doctor.metric_name("memory_usage", "major_faults/s") == "system_doctor_memory_usage_major_faults_per_second"
+
+def test_flatten_metrics_renames_and_labels():
+    samples = []
+    doctor.flatten_metrics(("cpu_usage",), {
+        "cpu_count": 4, "busy": 12.5, "saturated_cores": [], "idle_only": True,
+        "run_queue": {"mean": 1.5},
+        "per_core": [{"cpu": 0, "busy": 20.0}],
+    }, samples)
+    doctor.flatten_metrics(("network_info",), {
+        "interfaces": [{"interface": 'eth"0', "rx_bytes": 1024.0}],
+    }, samples)
+    assert samples == [
+        ("system_doctor_cpu_usage_cpus", "", 4),
+        ("system_doctor_cpu_usage_busy", "", 12.5),
+        ("system_doctor_cpu_usage_run_queue_mean", "", 1.5),
+        ("system_doctor_cpu_usage_per_core_busy", 'cpu="0"', 20.0),
+        ("system_doctor_network_info_interfaces_rx_bytes_per_second", 'interface="eth\\"0"', 1024.0),
+    ]
+
+def test_render_metrics_formats():
+    gauges = [("system_doctor_busy", 'cpu="0"', 1.5), ("system_doctor_busy", 'cpu="1"', 2.5)]
+    counters = [("system_doctor_pressure_some_stall_seconds", 'resource="cpu"', 12.0)]
+    assert doctor.render_metrics(gauges, counters).decode() == (
+        "# TYPE system_doctor_busy gauge\n"
+        'system_doctor_busy{cpu="0"} 1.5\n'
+        'system_doctor_busy{cpu="1"} 2.5\n'
+        "# TYPE system_doctor_pressure_some_stall_seconds counter\n"
+        'system_doctor_pressure_some_stall_seconds_total{resource="cpu"} 12.0\n'
+    )
+    prometheus = doctor.render_metrics(gauges, counters, openmetrics=False).decode()
+    assert "# TYPE system_doctor_pressure_some_stall_seconds_total counter\n" in prometheus
+
+def test_exported_names_of_the_corpus_host():
+    doctor._replay = doctor.Replay(bench.build_snapshot(CORPUS_HOST))
+    samples = []
+    for func_name in doctor.METRICS_TOOLS:
+        result = doctor.FUNCTION_MAP[func_name]()
+        assert result["status"] == "success", func_name
+        doctor.flatten_metrics((func_name.replace("check_", ""),), result["data"], samples)
+    names = {name for name, labels, value in samples}
+    assert "system_doctor_disk_io_devices_ios_per_second" in names
+    for name in names:
+        assert VALID_NAME.match(name), name
+        assert not name.endswith(RESERVED_SUFFIXES), name
+    # Every label set of a family is unique, or scrapers reject the whole exposition
+    assert len({(name, labels) for name, labels, value in samples}) == len(samples)
@@ -0,0 +1,83 @@
+import types
+
+import pytest
+
+import doctor
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(doctor, "time", types.SimpleNamespace(monotonic=clock.monotonic, sleep=clock.sleep))
+    monkeypatch.setattr(doctor.random, "uniform", lambda low, high: 1.0)
+    return clock
+
+def api_replies(monkeypatch, replies):
+    calls = []
+    def call_siliconflow_api(messages, tool_choice=None, stream=True):
+        calls.append(messages)
+        return dict(replies[min(len(calls), len(replies)) - 1])
+    monkeypatch.setattr(doctor, "call_siliconflow_api", call_siliconflow_api)
+    return calls
+
+def test_rate_limiter_cooldown_and_min_interval():
+    limiter = doctor.RateLimiter(cooldown=60, min_interval=10, max_per_hour=10)
+    assert limiter.allow(["cpu"], 0)
+    assert not limiter.allow(["cpu"], 5)      # cpu is cooling down
+    assert not limiter.allow(["memory"], 5)   # too soon after the last capture
+    assert limiter.allow(["memory"], 10)
+    assert not limiter.allow(["cpu", "memory"], 30)
+    assert limiter.allow(["cpu", "memory"], 60)  # cpu is out of its cooldown again
+    assert limiter.take_suppressed() == {"cpu": 2, "memory": 2}
+    assert limiter.take_suppressed() == {}
+
+def test_rate_limiter_hourly_cap():
+    limiter = doctor.RateLimiter(cooldown=0, min_interval=0, max_per_hour=2)
+    assert limiter.allow(["io"], 0)
+    assert limiter.allow(["io"], 1)
+    assert not limiter.allow(["io"], 2)
+    assert limiter.allow(["io"], 3600)  # the capture at 0 left the hour
+
+def test_request_pacer_spaces_and_holds_starts(clock):
+    pacer = doctor.RequestPacer(per_minute=60)
+    starts = []
+    for _ in range(3):
+        pacer.wait()
+        starts.append(clock.now)
+    assert starts == [0.0, 1.0, 2.0]
+    pacer.hold(30)
+    pacer.wait()
+    assert clock.now == 32.0
+
+def test_retry_after_holds_back_every_request(clock, monkeypatch):
+    calls = api_replies(monkeypatch, [
+        {"error": "rate limited", "status_code": 429, "retry_after": 20},
+        {"choices": [{"message": {"content": "ok"}}]},
+    ])
+    pacer = doctor.RequestPacer(per_minute=0)
+    response = doctor.call_with_retry([], pacer, backoff=2)
+    assert (len(calls), response["attempts"]) == (2, 2)
+    assert 20 in clock.sleeps  # Retry-After beats the shorter backoff
+    # A request started by another thread right after the 429 would have waited as well
+    assert pacer.next_start >= 20
+
+def test_retry_backoff_and_limits(clock, monkeypatch):
+    calls = api_replies(monkeypatch, [{"error": "unavailable", "status_code": 503}])
+    response = doctor.call_with_retry([], doctor.RequestPacer(per_minute=0), retries=3, backoff=2)
+    assert (len(calls), response["attempts"]) == (4, 4)
+    assert [s for s in clock.sleeps if s] == [2, 4, 8]
+
+    calls = api_replies(monkeypatch, [{"error": "bad request", "status_code": 400}])
+    response = doctor.call_with_retry([], doctor.RequestPacer(per_minute=0), retries=3)
+    assert (len(calls), response["attempts"]) == (1, 1)
@@ -0,0 +1,53 @@
+import os
+
+import bench
+import doctor
+from conftest import CORPUS, CORPUS_HOST
+
+def read_text(*parts):
+    with open(os.path.join(CORPUS, *parts)) as f:
+        return f.read()
+
+def test_read_proc_stat():
+    stat = doctor.read_proc_stat(os.path.join(CORPUS_HOST, "0", "stat"))
+    assert stat["cpu"] == stat["cpu0"] == [7169, 0, 1897, 147326, 174, 0, 4, 2701, 0, 0]
+    assert (stat["procs_running"], stat["procs_blocked"]) == (3, 0)
+
+def test_read_loadavg_and_meminfo():
+    assert doctor.read_loadavg(os.path.join(CORPUS_HOST, "0", "loadavg")) == {
+        "load": [0.13, 0.08, 0.02], "runnable": 3, "tasks": 72
+    }
+    meminfo = doctor.read_meminfo(os.path.join(CORPUS_HOST, "0", "meminfo"))
+    assert (meminfo["MemTotal"], meminfo["MemAvailable"], meminfo["SwapTotal"]) == (6147400, 5651964, 0)
+
+def test_read_diskstats():
+    disks = doctor.read_diskstats(os.path.join(CORPUS_HOST, "0", "diskstats"))
+    assert {"vda", "vdb", "zram0"} <= set(disks)
+    assert disks["vda"][:4] == [6828, 3866, 1535746, 9686]
+
+def test_text_parsers_on_every_corpus_version():
+    for name in os.listdir(os.path.join(CORPUS, "ss")):
+        result = doctor.parse_ss_s(read_text("ss", name))
+        assert result["status"] == "success", name
+        assert "TCP" in result["data"]["Transport"], name
+    for name in os.listdir(os.path.join(CORPUS, "hostnamectl")):
+        result = doctor.parse_text_hostnamectl(read_text("hostnamectl", name))
+        assert result["status"] == "success", name
+        assert result["data"]["static_hostname"], name
+    for name in os.listdir(os.path.join(CORPUS, "iostat")):
+        result = doctor.parse_iostat_output(read_text("iostat", name), "all")
+        assert result["status"] == "success", name
+        assert all("%util" in device for device in result["data"]["devices"]), name
+
+def test_windowed_collectors_on_corpus_host():
+    doctor._replay = doctor.Replay(bench.build_snapshot(CORPUS_HOST))
+    cpu = doctor.check_cpu_usage()["data"]
+    assert cpu["cpu_count"] == 1
+    assert cpu["busy"] == round(100 - cpu["idle"], 2)
+    assert cpu["run_queue"]["tasks"] == 72
+    memory = doctor.check_memory_usage()["data"]
+    assert (memory["total_mb"], memory["available_mb"], memory["swap_used_mb"]) == (6003, 5520, 0)
+    # The corpus host has no schedstat: the collector reports that instead of failing
+    scheduler = doctor.check_scheduler_latency()
+    assert scheduler["status"] == "success"
+    assert "CONFIG_SCHEDSTATS" in scheduler["data"]["per_cpu_unavailable"]
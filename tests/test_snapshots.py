@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+import bench
+import doctor
+from conftest import CORPUS_HOST
+
+@pytest.fixture
+def window():
+    """The corpus host's window, as a collection of it would leave it, with a source that failed."""
+    window = doctor.Replay(bench.build_snapshot(CORPUS_HOST)).window
+    window.origin = "live"
+    window.errors = {"cgroups": "No cgroup v2 hierarchy mounted"}
+    return window
+
+def record(path, window):
+    calls = [({"id": "call_1"}, "check_memory_usage", {}), ({"id": "call_2"}, "check_cpu_info", {})]
+    results = [{"status": "success", "data": {}}, {"status": "success", "data": {"Architecture": "x86_64"}}]
+    doctor.SnapshotRecorder(str(path)).record(window, calls, results, [0.01, 0.02])
+
+def test_snapshot_round_trip(tmp_path, window):
+    path = tmp_path / "run.snap"
+    record(path, window)
+    record(path, None)
+    first, second = doctor.read_snapshots(str(path))
+    assert second["window"] is None
+
+    replay = doctor.Replay(first)
+    assert replay.window.origin == "replay"
+    assert replay.window.errors == window.errors
+    assert replay.window.facts == json.loads(json.dumps(window.facts))
+    assert json.dumps(replay.window.samples) == json.dumps(window.samples)
+    # Windowed tools are rebuilt from the samples, the others served as recorded
+    assert [call["function"]["name"] for call in replay.tool_calls()] == ["check_memory_usage", "check_cpu_info"]
+    assert replay.result("check_cpu_info", {})["data"] == {"Architecture": "x86_64"}
+    assert replay.result("check_memory_usage", {})["status"] == "error"
+
+def test_replay_serves_the_recorded_facts_and_errors(tmp_path, window):
+    path = tmp_path / "run.snap"
+    doctor._shared_window = window
+    live = {func_name: doctor.FUNCTION_MAP[func_name]() for func_name in ("check_memory_usage", "check_cgroup_usage")}
+    doctor._shared_window = None
+    record(path, window)
+
+    doctor._replay = doctor.Replay(next(doctor.read_snapshots(str(path))))
+    assert doctor.check_memory_usage() == live["check_memory_usage"]
+    assert doctor.check_cgroup_usage() == live["check_cgroup_usage"]
+    assert live["check_cgroup_usage"]["message"] == "No cgroup v2 hierarchy mounted"
+
+def test_missing_fact_is_an_error_on_replay(tmp_path, window):
+    window.facts = {}
+    path = tmp_path / "run.snap"
+    record(path, window)
+    doctor._replay = doctor.Replay(next(doctor.read_snapshots(str(path))))
+    result = doctor.check_memory_usage()
+    assert result["status"] == "error"
+    assert "meminfo was not recorded in this snapshot" in result["message"]
+
+def test_truncated_or_foreign_snapshot_files(tmp_path, window):
+    path = tmp_path / "run.snap"
+    record(path, window)
+    record(path, window)
+    data = path.read_bytes()
+    path.write_bytes(data[:-10])  # Interrupted while appending the second record
+    assert len(list(doctor.read_snapshots(str(path)))) == 1
+
+    path.write_bytes(b"")
+    assert list(doctor.read_snapshots(str(path))) == []
+    path.write_bytes(b"not a snapshot file")
+    with pytest.raises(ValueError):
+        list(doctor.read_snapshots(str(path)))
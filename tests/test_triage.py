@@ -0,0 +1,80 @@
+import pytest
+
+import bench
+import doctor
+from conftest import CORPUS_HOST
+
+@pytest.fixture
+def idle_host():
+    """Successful results of the windowed collectors on the mostly idle corpus host."""
+    doctor._replay = doctor.Replay(bench.build_snapshot(CORPUS_HOST))
+    results = {func_name: doctor.FUNCTION_MAP[func_name]() for func_name in
+               ("check_cpu_usage", "check_memory_usage", "check_disk_io", "check_network_info")}
+    # The capture counted its own shell in the run queue of the single CPU
+    results["check_cpu_usage"]["data"]["run_queue"]["mean"] = 0.5
+    return results
+
+def with_data(result, **changes):
+    return {"status": "success", "data": dict(result["data"], **changes)}
+
+def rules(findings):
+    return [(item["rule"], item["severity"], item["conclusive"]) for item in findings]
+
+def test_idle_host_has_no_findings(idle_host):
+    assert doctor.triage_results(idle_host.items()) == []
+
+def test_swapping_trickle_is_info_and_oom_kill_is_conclusive(idle_host):
+    memory = with_data(idle_host["check_memory_usage"], **{
+        "swap_in_pages/s": 0.2, "swap_out_pages/s": 0.3, "swap_used_mb": 12, "oom_kills": 2
+    })
+    findings = doctor.triage_results([("check_memory_usage", memory)])
+    assert rules(findings) == [("oom_kill", "critical", True), ("swapping", "info", False)]
+    assert doctor.is_conclusive(findings)
+
+def test_cpu_saturation(idle_host):
+    cpu = with_data(idle_host["check_cpu_usage"], busy=97.0, user=90.0,
+                    run_queue={"min": 2, "mean": 3.0, "max": 4, "tasks": 72})
+    findings = doctor.triage_results([("check_cpu_usage", cpu)])
+    assert set(rules(findings)) == {("cpu_utilization", "critical", False), ("cpu_saturation", "critical", False)}
+    # Critical, but neither finding is conclusive on its own
+    assert not doctor.is_conclusive(findings)
+
+def test_conclusive_findings_on_different_resources_are_not_conclusive(idle_host):
+    memory = with_data(idle_host["check_memory_usage"], oom_kills=1)
+    cpu = with_data(idle_host["check_cpu_usage"], steal=40.0)
+    findings = doctor.triage_results([("check_memory_usage", memory), ("check_cpu_usage", cpu)])
+    assert {item["rule"] for item in findings if item["conclusive"]} == {"oom_kill", "cpu_steal"}
+    assert not doctor.is_conclusive(findings)
+
+def test_failing_rule_keeps_earlier_findings(idle_host, capsys):
+    memory = with_data(idle_host["check_memory_usage"], available_mb=10)
+    del memory["data"]["major_faults/s"]
+    findings = doctor.triage_results([("check_memory_usage", memory)])
+    assert rules(findings) == [("memory_utilization", "critical", False)]
+    assert "Triage rule triage_memory failed on check_memory_usage data: KeyError" in capsys.readouterr().out
+
+def test_failed_results_are_not_triaged():
+    assert doctor.triage_results([("check_memory_usage", {"status": "error", "message": "boom"})]) == []
+
+@pytest.mark.parametrize("since, recent_only, conclusive", [
+    ("previous run", True, True),
+    ("last 60 minutes", True, True),
+    ("boot", False, False),
+    ("start of file", False, False),
+])
+def test_kernel_log_events_are_conclusive_only_when_recent(since, recent_only, conclusive):
+    scan = doctor.KernelLogScan()
+    scan.add_block(b"Out of memory: Killed process 1 (java)\napp[9]: segfault at 0 ip 0\n", 2)
+    data = {"source": "/dev/kmsg", "since": since, "recent_only": recent_only,
+            "messages_scanned": 2, "events": scan.events()}
+    findings = doctor.triage_results([("check_kernel_log", {"status": "success", "data": data})])
+    # Segfaults are informational and left out
+    assert rules(findings) == [("kernel_oom_kill", "critical", conclusive)]
+
+def test_symptom_signature_ignores_device_names_and_info():
+    def disk(device, severity="warning"):
+        return doctor.finding("disk_latency", f"disk {device}", "saturation", severity, 80, 50, "slow")
+    info = doctor.finding("swap_in_use", "memory", "utilization", "info", 1, 1, "swap")
+    assert doctor.symptom_signature([disk("sda"), info]) == doctor.symptom_signature([disk("nvme0n1", "critical")])
+    assert doctor.symptom_signature([disk("sda")]) == (("disk", "disk_latency"),)
+    assert doctor.symptom_signature([info]) == ()